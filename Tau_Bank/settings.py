@@ -35,7 +35,7 @@ SECRET_KEY = env("SECRET_KEY")
 # SECRET_KEY = 'django-insecure-m_b)y!p$yj(=z%g(12lq^9m*!$x8qlxd6a$cji40%*6(p_lwgo'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = env.bool("DEBUG", default=True)
 
 ALLOWED_HOSTS = ["*"]
 CSRF_TRUSTED_ORIGINS = ['https://tau-bank.onrender.com','https://*.127.0.0.1']
@@ -58,11 +58,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.QueryInstrumentationMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'core.middleware.PageCacheMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.AccountCacheMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -71,10 +78,18 @@ ROOT_URLCONF = 'Tau_Bank.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that also reports render times to /metrics
+        'BACKEND': 'core.metrics.InstrumentedDjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # compiled templates are kept in memory whatever DEBUG says; under
+            # runserver the autoreloader clears them when a template changes
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -132,6 +147,31 @@ DATABASES = {
     )
 }
 
+if DATABASES['default'].get('ENGINE') == 'django.db.backends.sqlite3':
+    # SQLite has no row locks: take the write lock when a transaction starts so
+    # the ledger's select_for_update reads cannot go stale under concurrency.
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    })
+    # the test database too: the in-memory one Django uses by default locks
+    # whole tables between threads, and the ledger's concurrency tests fail on that
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', f"{DATABASES['default']['NAME']}.test")
+
+# Read replicas: DATABASE_REPLICA_URLS=url1,url2 adds the aliases replica1,
+# replica2, ... core.routers.ReplicaRouter sends the reads of views marked
+# `read_replica = True` and of admin changelists there; a client that has
+# just written reads from the primary for REPLICA_PIN_SECONDS. For local
+# SQLite replicas, `manage.py sync_sqlite_replicas` copies the primary over.
+DATABASE_REPLICAS = []
+for n, url in enumerate(env.list("DATABASE_REPLICA_URLS", default=[]), start=1):
+    DATABASES[f'replica{n}'] = dj_database_url.parse(url)
+    DATABASES[f'replica{n}']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(f'replica{n}')
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = 10
+REPLICA_PIN_COOKIE = 'db_primary'
+
 
 
 
@@ -171,6 +211,22 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic fingerprints files, writes .gz/.br copies and resized images
+# (core.staticfiles); without it, e.g. in development, files keep their names.
+STATIC_MANIFEST = env.bool("STATIC_MANIFEST", default=not DEBUG)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': 'core.staticfiles.CompressedManifestStaticFilesStorage' if STATIC_MANIFEST
+        else 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+STATIC_IMAGE_WIDTHS = [480, 960, 1600]
+# Serve STATIC_ROOT from the WSGI app itself (Tau_Bank/wsgi.py), with
+# far-future cache headers for fingerprinted files.
+SERVE_STATIC = env.bool("SERVE_STATIC", default=not DEBUG)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -178,9 +234,136 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = env("EMAIL_BACKEND", default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587
 EMAIL_HOST_USER = env("EMAIL")
-EMAIL_HOST_PASSWORD = env("EMAIL_PASSWORD")
\ No newline at end of file
+EMAIL_HOST_PASSWORD = env("EMAIL_PASSWORD")
+
+
+# Approved, unpaid loans an account may hold before new requests are refused
+MAX_ACTIVE_LOANS = 3
+
+# Transaction report pagination (?page_size= can override up to the maximum)
+TRANSACTION_REPORT_PAGE_SIZE = 50
+TRANSACTION_REPORT_MAX_PAGE_SIZE = 500
+
+# Rows fetched per database round trip when streaming a statement export
+TRANSACTION_EXPORT_CHUNK_SIZE = 2000
+
+# `manage.py archive_transactions` moves whole months older than this out of
+# the Transaction table into compressed ArchivedSegment rows (loans stay);
+# statements read them back transparently (transactions.archive).
+TRANSACTION_ARCHIVE_AFTER_DAYS = 365
+
+# Most lines one batch transfer (transactions.batch) may pay
+BATCH_TRANSFER_MAX_LINES = 1000
+
+# Responses to requests sent with an Idempotency-Key are replayed for this
+# long (transactions.idempotency); each worker also keeps the most recent
+# ones in memory. Expired keys: `python manage.py purge_idempotency_keys`.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LRU_SIZE = 1000
+
+
+# Transactional emails are written to an outbox table inside the request and
+# delivered by `python manage.py send_queued_emails`.
+EMAIL_OUTBOX_BATCH_SIZE = env.int("EMAIL_OUTBOX_BATCH_SIZE", default=100)
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 30  # seconds, doubled after every failed attempt
+EMAIL_OUTBOX_LEASE = 300  # seconds a worker may hold a claimed batch
+
+
+# Per-request query counting (core.middleware.QueryInstrumentationMiddleware).
+# Views declare `query_budget`; QUERY_BUDGETS overrides it by URL name.
+QUERY_INSTRUMENTATION = env.bool("QUERY_INSTRUMENTATION", default=False)
+QUERY_BUDGET_STRICT = env.bool("QUERY_BUDGET_STRICT", default=False)  # raise instead of logging
+QUERY_REPEAT_THRESHOLD = 5  # same SQL this many times in one request is logged as a likely N+1
+QUERY_BUDGETS = {
+    'transactions_transaction_changelist': 10,
+    'accounts_userbankaccount_changelist': 10,
+    'accounts_useraddress_changelist': 10,
+}
+
+
+# On-demand cProfile of single requests (core.middleware.ProfilingMiddleware).
+# Staff can add ?_profile=1; anyone sending `X-Profile: <PROFILING_TOKEN>` is
+# profiled too. Stored profiles are listed at /admin/profiles/.
+PROFILING_ENABLED = env.bool("PROFILING_ENABLED", default=False)
+PROFILING_TOKEN = env("PROFILING_TOKEN", default='')
+PROFILING_SAMPLE_RATE = env.float("PROFILING_SAMPLE_RATE", default=0.0)
+PROFILING_DIR = env("PROFILING_DIR", default=str(BASE_DIR / 'profiles'))
+PROFILING_SAMPLE_INTERVAL = 0.001  # seconds between flamegraph stack samples
+PROFILING_KEEP = 200  # oldest profiles beyond this are deleted
+PROFILING_TOP_N = 30
+
+
+# Prometheus metrics at /metrics (core.metrics). Set PROMETHEUS_MULTIPROC_DIR
+# in the environment when running more than one worker process.
+# Only staff, scrapers sending `Authorization: Bearer <METRICS_TOKEN>` and
+# clients from METRICS_ALLOWED_IPS (REMOTE_ADDR, so the proxy's address behind
+# one) can read it; everyone else gets 403.
+METRICS_ENABLED = env.bool("METRICS_ENABLED", default=True)
+METRICS_TOKEN = env("METRICS_TOKEN", default='')
+METRICS_ALLOWED_IPS = env.list("METRICS_ALLOWED_IPS", default=[])
+
+
+# OpenTelemetry tracing (core.tracing). TRACING_EXPORTER is "console", "file"
+# (JSON lines appended to TRACING_FILE) or "otlp" (TRACING_OTLP_ENDPOINT, or
+# the standard OTEL_EXPORTER_OTLP_* variables when empty).
+TRACING_ENABLED = env.bool("TRACING_ENABLED", default=False)
+TRACING_EXPORTER = env("TRACING_EXPORTER", default='console')
+TRACING_FILE = env("TRACING_FILE", default=str(BASE_DIR / 'traces.jsonl'))
+TRACING_OTLP_ENDPOINT = env("TRACING_OTLP_ENDPOINT", default='')
+TRACING_SAMPLE_RATIO = env.float("TRACING_SAMPLE_RATIO", default=1.0)  # share of new traces kept
+TRACING_SERVICE_NAME = env("TRACING_SERVICE_NAME", default='tau-bank')
+
+
+# Django cache, e.g. CACHE_URL=filecache:///var/tmp/tau_cache or
+# redis://localhost:6379/1. Per-process locmem by default; locmem and file
+# caches cull a third of the entries once MAX_ENTRIES is reached.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://tau-bank?MAX_ENTRIES=10000'),
+    # rendered pages for anonymous visitors and the navbar/footer fragments
+    'pages': env.cache('PAGE_CACHE_URL', default='locmemcache://tau-bank-pages?MAX_ENTRIES=1000'),
+}
+
+# Views with `page_cache_timeout` are served from the "pages" cache to
+# visitors without a session (core.middleware.PageCacheMiddleware).
+PAGE_CACHE_ENABLED = env.bool("PAGE_CACHE_ENABLED", default=True)
+
+# accounts.cache: UserBankAccount/UserAddress rows cached per user id and
+# dropped on every change; other workers only see the drop through a shared
+# default cache (CACHE_URL)
+ACCOUNT_CACHE_TIMEOUT = 300
+
+
+# Session storage: "db" (Django's default), "cached_db" (read from the cache,
+# written through to the database), "cache" or "signed_cookies" (no server
+# side state at all; the session lives in a signed cookie).
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_ENGINE = SESSION_ENGINES[env("SESSION_MODE", default='cached_db')]
+
+# The per-request user lookup comes from the cache (accounts.backends).
+# ModelBackend stays listed so sessions created before the switch stay valid.
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+# Only with a default cache shared by every worker: a per-process locmem cache
+# drops a changed user (a new password hash, say) on one worker only, and
+# the others would keep accepting the old sessions until the entry expires.
+AUTH_USER_CACHE_ENABLED = env.bool(
+    "AUTH_USER_CACHE_ENABLED", default=not CACHES['default']['BACKEND'].endswith('.LocMemCache'),
+)
+AUTH_USER_CACHE_TIMEOUT = 300
+
+# Part of the ETag of the statement pages (transactions.conditional); bump it
+# when their templates change so browsers do not keep the old markup.
+STATEMENT_ETAG_VERSION = 1
@@ -16,10 +16,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
-from core.views import HomeView
+from core.views import HomeView,ProfileListView,ProfileDownloadView,metrics_view
 urlpatterns = [
+    path('admin/profiles/', ProfileListView.as_view(), name='profile_list'),
+    path('admin/profiles/<str:name>.<str:kind>', ProfileDownloadView.as_view(), name='profile_download'),
     path('admin/', admin.site.urls),
     path('', HomeView.as_view(),name='homepage'),
+    path('metrics', metrics_view, name='metrics'),
     path('accounts/', include('accounts.urls')),
     path('transactions/', include('transactions.urls')),
 ]
@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Tau_Bank.settings')
 
 application = get_wsgi_application()
+
+if settings.SERVE_STATIC:
+    from core.staticfiles import StaticFilesApplication
+    application = StaticFilesApplication(application)
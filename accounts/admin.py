@@ -3,5 +3,15 @@ from .models import UserBankAccount,UserAddress
 # Register your models here.
 
 
-admin.site.register(UserBankAccount)
-admin.site.register(UserAddress)
\ No newline at end of file
+@admin.register(UserBankAccount)
+class UserBankAccountAdmin(admin.ModelAdmin):
+    list_display = ['account_no', 'user', 'account_type', 'balance', 'active_loans']
+    list_select_related = ['user']
+    search_fields = ['account_no', 'user__username']
+
+
+@admin.register(UserAddress)
+class UserAddressAdmin(admin.ModelAdmin):
+    # __str__ shows the user's email
+    list_display = ['__str__', 'city', 'country']
+    list_select_related = ['user']
@@ -4,3 +4,25 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.contrib.auth.signals import user_logged_out
+        from django.db.models.signals import post_save, post_delete
+        from . import cache
+        from .backends import invalidate_user
+        from .models import UserBankAccount,UserAddress
+
+        for model in (UserBankAccount, UserAddress):
+            post_save.connect(cache.invalidate_instance, sender=model)
+            post_delete.connect(cache.invalidate_instance, sender=model)
+        # user.address comes from the cache when first read; user.account is
+        # attached up front by core.middleware.AccountCacheMiddleware
+        User.address = cache.CachedReverseOneToOneDescriptor(User.address.related, 'address')
+
+        # a password change saves the user; logout ends the cached session user
+        post_save.connect(lambda sender, instance, **kwargs: invalidate_user(instance.pk), sender=User, weak=False)
+        post_delete.connect(lambda sender, instance, **kwargs: invalidate_user(instance.pk), sender=User, weak=False)
+        user_logged_out.connect(
+            lambda sender, request, user, **kwargs: user and invalidate_user(user.pk), weak=False,
+        )
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+from core import metrics
+
+
+def user_cache_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def invalidate_user(user_id):
+    # again after commit, so a concurrent request cannot re-cache the old row
+    cache.delete(user_cache_key(user_id))
+    transaction.on_commit(lambda: cache.delete(user_cache_key(user_id)))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose per-request user lookup (``get_user``) is served from
+    the cache for AUTH_USER_CACHE_TIMEOUT seconds, when AUTH_USER_CACHE_ENABLED
+    (by default, whenever the default cache is not the per-process locmem one).
+
+    The cached copy is dropped whenever the user row is saved (password
+    change included, so other sessions fail the session hash check at once)
+    and on logout; see AccountsConfig.ready.
+    """
+
+    def get_user(self, user_id):
+        if not settings.AUTH_USER_CACHE_ENABLED:
+            return super().get_user(user_id)
+        user = cache.get(user_cache_key(user_id))
+        if user is None:
+            metrics.AUTH_USER_CACHE_REQUESTS.labels('miss').inc()
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(user_cache_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+        else:
+            metrics.AUTH_USER_CACHE_REQUESTS.labels('hit').inc()
+        return user
+
+    async def aget_user(self, user_id):
+        if not settings.AUTH_USER_CACHE_ENABLED:
+            return await super().aget_user(user_id)
+        user = await cache.aget(user_cache_key(user_id))
+        if user is None:
+            metrics.AUTH_USER_CACHE_REQUESTS.labels('miss').inc()
+            user = await super().aget_user(user_id)
+            if user is not None:
+                await cache.aset(user_cache_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+        else:
+            metrics.AUTH_USER_CACHE_REQUESTS.labels('hit').inc()
+        return user
@@ -0,0 +1,120 @@
+"""
+Per-user cache of the UserBankAccount and UserAddress rows.
+
+Entries are keyed by user id and live in Django's default cache for
+ACCOUNT_CACHE_TIMEOUT seconds (the cache backend evicts on its own beyond
+that). A user without an account or address is cached as ``None`` too.
+
+Freshness rules:
+
+* Inside ``transaction.atomic`` the cache is bypassed in both directions, so
+  code that is about to move money always sees the committed row and a
+  rolled-back change never reaches the cache.
+* Saving or deleting a row (model signals) and every balance change made by
+  transactions.ledger call ``invalidate``, which drops the entries now and
+  once more after the commit, so a concurrent reader cannot re-cache the
+  old row in between.
+* Misses are filled from the primary database, never from a replica that may
+  still be behind the write that caused the invalidation.
+
+Invalidation only reaches other workers through a shared default cache
+(CACHE_URL); with the per-process locmem default, run a single worker or
+accept balances on the other workers up to ACCOUNT_CACHE_TIMEOUT seconds
+old on display. Money never moves on a cached row: the ledger locks and
+re-reads the accounts it changes.
+
+``user.account`` comes from the cache when AccountCacheMiddleware attached it
+to ``request.user``; ``user.address`` is looked up here on first access
+(``CachedReverseOneToOneDescriptor``), so pages that never show the address
+never pay for it.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models.fields.related_descriptors import ReverseOneToOneDescriptor
+
+from core import metrics
+from .models import UserBankAccount,UserAddress
+
+MODELS = {'account': UserBankAccount, 'address': UserAddress}
+
+
+def cache_key(kind, user_id):
+    return f"accounts:{kind}:{user_id}"
+
+
+def _in_write_transaction():
+    return connections['default'].in_atomic_block
+
+
+def _load(kind, user_id):
+    return MODELS[kind].objects.db_manager('default').filter(user_id=user_id).first()
+
+
+def get_many(user_id, kinds=('account', 'address')):
+    """``{kind: row or None}`` for the user, from the cache where possible."""
+    if _in_write_transaction():
+        return {kind: _load(kind, user_id) for kind in kinds}
+
+    keys = {cache_key(kind, user_id): kind for kind in kinds}
+    found = cache.get_many(keys)
+    result = {}
+    missing = {}
+    for key, kind in keys.items():
+        if key in found:
+            metrics.ACCOUNT_CACHE_REQUESTS.labels(kind, 'hit').inc()
+            result[kind] = found[key]
+        else:
+            metrics.ACCOUNT_CACHE_REQUESTS.labels(kind, 'miss').inc()
+            result[kind] = missing[key] = _load(kind, user_id)
+    if missing:
+        cache.set_many(missing, settings.ACCOUNT_CACHE_TIMEOUT)
+    return result
+
+
+def get_account(user_id):
+    return get_many(user_id, ('account',))['account']
+
+
+def get_address(user_id):
+    return get_many(user_id, ('address',))['address']
+
+
+def attach(user, kinds=('account',)):
+    """
+    Put the user's cached account (or other ``kinds``) on ``user``, so that
+    ``user.account`` needs no query.
+    """
+    if user.is_authenticated:
+        for kind, row in get_many(user.pk, kinds).items():
+            # a cached None makes `user.account` raise DoesNotExist without a query
+            getattr(User, kind).related.set_cached_value(user, row)
+    return user
+
+
+aattach = sync_to_async(attach)
+
+
+class CachedReverseOneToOneDescriptor(ReverseOneToOneDescriptor):
+    """``user.<kind>`` that is read through this cache on first access."""
+
+    def __init__(self, related, kind):
+        super().__init__(related)
+        self.kind = kind
+
+    def __get__(self, instance, cls=None):
+        if instance is not None and instance.pk is not None and not self.is_cached(instance):
+            self.related.set_cached_value(instance, get_many(instance.pk, (self.kind,))[self.kind])
+        return super().__get__(instance, cls)
+
+
+def invalidate(user_id):
+    keys = [cache_key(kind, user_id) for kind in MODELS]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_instance(sender, instance, **kwargs):
+    invalidate(instance.user_id)
@@ -0,0 +1,282 @@
+"""
+Bulk onboarding of customers from a CSV file.
+
+The columns are UserRegistationForm's fields: ``username``, ``first_name``,
+``last_name``, ``email``, ``account_type``, ``birth_date`` (YYYY-MM-DD),
+``gender``, ``city``, ``street_address``, ``postal_code`` and ``country``,
+plus the password as either ``password`` (plain text, hashed here in a
+process pool) or ``password_hash`` (already in Django's
+``algorithm$...`` format, stored as is). A row with neither gets an
+unusable password, so the customer has to reset it. Passwords are not
+checked against AUTH_PASSWORD_VALIDATORS.
+
+The file is read as a stream and imported in chunks of ``--batch-size``
+rows, each one transaction of three bulk inserts (users, addresses,
+accounts). Account numbers are ``1000000 + user.id`` as in registration,
+taken from the ids the user insert returns, so imported and registered
+customers can never collide. While one chunk is written the next one is
+already being hashed.
+
+Bad rows, and usernames that already exist, are reported with their line
+number and skipped. With ``--checkpoint`` the number of rows done is saved
+after every committed chunk, and running the same command again carries
+on from there.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import identify_hasher,make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from accounts.constants import ACCOUNT_TYPE,GENDER_TYPE
+from accounts.models import UserAddress,UserBankAccount
+
+REQUIRED = ['username', 'first_name', 'last_name', 'email', 'account_type', 'birth_date',
+            'gender', 'city', 'street_address', 'postal_code', 'country']
+MAX_LENGTHS = {
+    'username': 150, 'first_name': 150, 'last_name': 150, 'email': 254,
+    'city': 100, 'street_address': 100, 'country': 100,
+}
+ACCOUNT_TYPES = {value.lower(): value for value, _ in ACCOUNT_TYPE}
+GENDERS = {value.lower(): value for value, _ in GENDER_TYPE}
+validate_username = UnicodeUsernameValidator()
+
+
+def clean_row(row):
+    """``(values, None)`` or ``(None, error message)`` for one CSV row."""
+    values = {name: (row.get(name) or '').strip() for name in REQUIRED}
+    missing = [name for name in REQUIRED if not values[name]]
+    if missing:
+        return None, f"Missing {', '.join(missing)}."
+    for name, limit in MAX_LENGTHS.items():
+        if len(values[name]) > limit:
+            return None, f"{name} can be at most {limit} characters."
+    try:
+        validate_username(values['username'])
+        validate_email(values['email'])
+    except ValidationError as e:
+        return None, e.messages[0]
+
+    values['account_type'] = ACCOUNT_TYPES.get(values['account_type'].lower())
+    if values['account_type'] is None:
+        return None, f"account_type must be one of {', '.join(ACCOUNT_TYPES.values())}."
+    values['gender'] = GENDERS.get(values['gender'].lower())
+    if values['gender'] is None:
+        return None, f"gender must be one of {', '.join(GENDERS.values())}."
+    try:
+        values['birth_date'] = date.fromisoformat(values['birth_date'])
+    except ValueError:
+        return None, f"'{values['birth_date']}' is not a YYYY-MM-DD date."
+    try:
+        values['postal_code'] = int(values['postal_code'])
+    except ValueError:
+        return None, f"'{values['postal_code']}' is not a postal code."
+    if not 0 <= values['postal_code'] < 2 ** 31:
+        return None, "Postal code is out of range."
+
+    password_hash = (row.get('password_hash') or '').strip()
+    if password_hash:
+        try:
+            identify_hasher(password_hash)
+        except ValueError:
+            return None, "password_hash is not a Django password hash."
+        values['password_hash'] = password_hash
+    values['password'] = row.get('password') or None
+    return values, None
+
+
+class Chunk:
+    """One batch of validated rows, with its password hashing under way."""
+
+    def __init__(self, rows_done, rows, errors, hashes):
+        self.rows_done = rows_done
+        self.rows = rows
+        self.errors = errors
+        self.hashes = hashes
+
+
+class Command(BaseCommand):
+    help = "Create users, addresses and bank accounts from a CSV of registration data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Processes hashing plain-text passwords; 0 hashes in this process.")
+        parser.add_argument('--checkpoint', help="File to record progress in, and to resume from.")
+        parser.add_argument('--errors', help="Write rejected rows to this CSV instead of stderr.")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        checkpoint = options['checkpoint']
+        state = {'source': path, 'rows': 0, 'imported': 0, 'rejected': 0}
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state['source'] != path:
+                raise CommandError(f"{checkpoint} is a checkpoint for {state['source']}.")
+            self.stdout.write(f"Resuming after row {state['rows']}.")
+
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            total = sum(1 for _ in csv.reader(f)) - 1
+            f.seek(0)
+            reader = csv.DictReader(f)
+            missing = [name for name in REQUIRED if name not in (reader.fieldnames or [])]
+            if missing:
+                raise CommandError(f"The CSV has no {', '.join(missing)} column.")
+
+            errors_file = open(options['errors'], 'a', newline='') if options['errors'] else None
+            self.rejects = csv.writer(errors_file) if errors_file else None
+            executor = ProcessPoolExecutor(options['workers'], initializer=django.setup) if options['workers'] else None
+            try:
+                self.run(reader, state, total, options['batch_size'], executor, checkpoint)
+            finally:
+                if executor:
+                    executor.shutdown(cancel_futures=True)
+                if errors_file:
+                    errors_file.close()
+
+    def run(self, reader, state, total, batch_size, executor, checkpoint):
+        started = time.perf_counter()
+        resumed_at = state['rows']
+        # usernames earlier in the file; the database catches those from before a resume
+        seen = set()
+        pending = None
+        for batch in self.read_chunks(reader, resumed_at, batch_size):
+            chunk = self.prepare(batch, seen, executor)
+            if pending:
+                # the previous chunk is written while this one is hashed
+                self.commit(pending, state, checkpoint, total, started, resumed_at)
+            pending = chunk
+        if pending:
+            self.commit(pending, state, checkpoint, total, started, resumed_at)
+
+        elapsed = time.perf_counter() - started
+        rate = (state['rows'] - resumed_at) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{state['imported']} customers imported, {state['rejected']} rows rejected; "
+            f"{state['rows'] - resumed_at} rows in {elapsed:.1f}s ({rate:.0f} rows/s)"
+        ))
+
+    def read_chunks(self, reader, skip, batch_size):
+        """Lists of ``(line number, row)``, after the first ``skip`` rows."""
+        rows = iter(reader)
+        for _ in islice(rows, skip):
+            pass
+        while True:
+            batch = [(reader.line_num, row) for row in islice(rows, batch_size)]
+            if not batch:
+                return
+            yield batch
+
+    def prepare(self, batch, seen, executor):
+        rows, errors = [], []
+        for line, row in batch:
+            values, error = clean_row(row)
+            if error is None and values['username'] in seen:
+                error = f"Username {values['username']} appears earlier in the file."
+            if error:
+                errors.append((line, row.get('username', ''), error))
+                continue
+            seen.add(values['username'])
+            rows.append((line, values))
+
+        # checked before hashing, so a resumed run does not hash the rows it already imported
+        existing = set(User.objects.filter(
+            username__in=[values['username'] for _, values in rows],
+        ).values_list('username', flat=True))
+        if existing:
+            errors += [(line, values['username'], f"Username {values['username']} already exists.")
+                       for line, values in rows if values['username'] in existing]
+            rows = [(line, values) for line, values in rows if values['username'] not in existing]
+
+        passwords = [values['password'] for _, values in rows
+                     if values['password'] and 'password_hash' not in values]
+        if executor and passwords:
+            hashes = executor.map(make_password, passwords, chunksize=max(1, len(passwords) // 64))
+        else:
+            hashes = map(make_password, passwords)
+        return Chunk(len(batch), rows, errors, hashes)
+
+    def commit(self, chunk, state, checkpoint, total, started, resumed_at):
+        hashes = iter(chunk.hashes)
+        for _, values in chunk.rows:
+            if 'password_hash' not in values:
+                values['password_hash'] = next(hashes) if values['password'] else make_password(None)
+
+        rows = [values for _, values in chunk.rows]
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    username=values['username'],
+                    first_name=values['first_name'],
+                    last_name=values['last_name'],
+                    email=values['email'],
+                    password=values['password_hash'],
+                )
+                for values in rows
+            ])
+            if users and users[0].pk is None:
+                # backends that cannot return ids from a bulk insert
+                ids = dict(User.objects.filter(
+                    username__in=[user.username for user in users],
+                ).values_list('username', 'id'))
+                for user in users:
+                    user.pk = ids[user.username]
+
+            UserAddress.objects.bulk_create([
+                UserAddress(
+                    user=user,
+                    street_address=values['street_address'],
+                    city=values['city'],
+                    postal_code=values['postal_code'],
+                    country=values['country'],
+                )
+                for user, values in zip(users, rows)
+            ])
+            UserBankAccount.objects.bulk_create([
+                UserBankAccount(
+                    user=user,
+                    account_type=values['account_type'],
+                    gender=values['gender'],
+                    birth_date=values['birth_date'],
+                    account_no=1000000 + user.pk,
+                )
+                for user, values in zip(users, rows)
+            ])
+
+        state['rows'] += chunk.rows_done
+        state['imported'] += len(users)
+        state['rejected'] += len(chunk.errors)
+        if checkpoint:
+            self.save_checkpoint(checkpoint, state)
+        for line, username, error in sorted(chunk.errors):
+            if self.rejects:
+                self.rejects.writerow([line, username, error])
+            else:
+                self.stderr.write(f"line {line}: {error}")
+
+        elapsed = time.perf_counter() - started
+        rate = (state['rows'] - resumed_at) / elapsed if elapsed else 0
+        remaining = f", {(total - state['rows']) / rate:.0f}s left" if rate else ''
+        self.stdout.write(
+            f"{state['rows']}/{total} rows, {state['imported']} imported, "
+            f"{state['rejected']} rejected, {rate:.0f} rows/s{remaining}"
+        )
+
+    def save_checkpoint(self, checkpoint, state):
+        # written aside and renamed, so a crash never leaves half a file
+        with open(checkpoint + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(checkpoint + '.tmp', checkpoint)
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:46
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+LOAN = 3
+
+
+def populate_loan_counters(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+
+    stats = (
+        Transaction.objects.filter(transaction_type=LOAN)
+        .values('account_id')
+        .annotate(
+            active=Count('id', filter=Q(loan_approve=True)),
+            pending=Count('id', filter=Q(loan_approve=False)),
+            principal=Sum('amount', filter=Q(loan_approve=True)),
+        )
+    )
+    for row in stats.iterator():
+        UserBankAccount.objects.filter(pk=row['account_id']).update(
+            active_loans=row['active'],
+            pending_loan_requests=row['pending'],
+            outstanding_loan_principal=row['principal'] or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_userbankaccount_is_bankrupt'),
+        ('transactions', '0006_dailybalancesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='active_loans',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='outstanding_loan_principal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='pending_loan_requests',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_loan_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_loan_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='archived_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -14,6 +14,13 @@ class UserBankAccount(models.Model):
     initial_deposite_date = models.DateField(auto_now_add=True)
     balance = models.DecimalField(default=0,max_digits=12,decimal_places=2)
     is_bankrupt = models.BooleanField(default=False, null=True,blank=True)
+    # kept in step by transactions.ledger; rebuild with `manage.py reconcile_loan_counters`
+    active_loans = models.PositiveIntegerField(default=0)
+    pending_loan_requests = models.PositiveIntegerField(default=0)
+    outstanding_loan_principal = models.DecimalField(default=0,max_digits=12,decimal_places=2)
+    # transactions before this date, loans excepted, have been moved to
+    # transactions.ArchivedSegment by `manage.py archive_transactions`
+    archived_until = models.DateField(null=True,blank=True)
 
     def __str__(self):
         return str(self.account_no)
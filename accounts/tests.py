@@ -1,3 +1,155 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase,TransactionTestCase,override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from transactions import ledger
+from . import cache as account_cache
+from .backends import CachedModelBackend,user_cache_key
+from .models import UserAddress,UserBankAccount
+
+
+def make_customer(username, balance=0):
+    user = User.objects.create_user(username, f"{username}@example.com", 'secret-pass-123')
+    UserAddress.objects.create(user=user, street_address='1 Road', city='Dhaka', postal_code=1000, country='Bangladesh')
+    UserBankAccount.objects.create(
+        user=user, account_type='Savings', gender='Male', account_no=1000000 + user.pk, balance=Decimal(balance),
+    )
+    return user
+
+
+class AccountCacheTests(TransactionTestCase):
+    # the cache is bypassed inside transaction.atomic, so no TestCase here
+    def setUp(self):
+        cache.clear()
+        self.user = make_customer('alice', 100)
+
+    def test_cached_account_needs_no_query(self):
+        account_cache.get_account(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(account_cache.get_account(self.user.pk).balance, Decimal('100'))
+
+    def test_balance_change_invalidates(self):
+        account_cache.get_account(self.user.pk)
+        ledger.deposit(UserBankAccount.objects.get(user=self.user), Decimal('150'))
+        self.assertEqual(account_cache.get_account(self.user.pk).balance, Decimal('250'))
+
+    def test_cached_request_reads_no_account_row(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('transaction_report'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('transaction_report'))
+        self.assertContains(response, '100')
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('accounts_userbankaccount', tables)
+        self.assertNotIn('accounts_useraddress', tables)
+
+    def test_address_loads_on_first_access(self):
+        user = account_cache.attach(User.objects.get(pk=self.user.pk))
+        self.assertFalse(User.address.is_cached(user))
+        account_cache.get_address(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.address.city, 'Dhaka')
+
+    def test_address_is_served_from_the_cache(self):
+        account_cache.get_address(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(account_cache.get_address(self.user.pk).city, 'Dhaka')
+
+    def test_deleted_account(self):
+        account_cache.get_account(self.user.pk)
+        UserBankAccount.objects.filter(user=self.user).delete()
+        self.assertIsNone(account_cache.get_account(self.user.pk))
+
+
+class CachedModelBackendTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_customer('alice')
+
+    @override_settings(AUTH_USER_CACHE_ENABLED=True)
+    def test_user_is_cached_when_enabled(self):
+        CachedModelBackend().get_user(self.user.pk)
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+        with self.assertNumQueries(0):
+            self.assertEqual(CachedModelBackend().get_user(self.user.pk), self.user)
+
+    @override_settings(AUTH_USER_CACHE_ENABLED=False)
+    def test_user_is_read_from_the_database_when_disabled(self):
+        CachedModelBackend().get_user(self.user.pk)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        # a password changed on another worker, whose invalidation never got here
+        User.objects.filter(pk=self.user.pk).update(password='changed')
+        self.assertEqual(CachedModelBackend().get_user(self.user.pk).password, 'changed')
+
+
+class ImportCustomersTests(TestCase):
+    HEADER = ('username,first_name,last_name,email,account_type,birth_date,gender,'
+              'city,street_address,postal_code,country,password,password_hash\n')
+
+    def setUp(self):
+        make_customer('alice')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.hash = make_password('ben-secret-123')
+        self.path = self.write('customers.csv', [
+            'ann,Ann,Lee,ann@example.com,savings,1990-01-02,Female,Dhaka,1 Road,1000,Bangladesh,ann-secret-123,',
+            f'ben,Ben,Roy,ben@example.com,Current,1985-05-06,male,Khulna,2 Road,9000,Bangladesh,,{self.hash}',
+            'dan,Dan,Das,dan@example.com,Savings,yesterday,Male,Dhaka,3 Road,1000,Bangladesh,,',
+            'ann,Ann,Again,ann2@example.com,Savings,1990-01-02,Female,Dhaka,4 Road,1000,Bangladesh,,',
+            'alice,Alice,Taken,alice2@example.com,Savings,1990-01-02,Female,Dhaka,5 Road,1000,Bangladesh,,',
+            'cat,Cat,Khan,cat@example.com,Savings,2000-12-31,Female,Sylhet,6 Road,3100,Bangladesh,,',
+        ])
+        self.checkpoint = os.path.join(self.directory.name, 'progress.json')
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(self.HEADER + '\n'.join(lines) + '\n')
+        return path
+
+    def run_import(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_customers', self.path, workers=0, batch_size=2, checkpoint=self.checkpoint,
+                     stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import(self):
+        out, err = self.run_import()
+        self.assertIn("3 customers imported, 3 rows rejected", out)
+        self.assertEqual([line.split(':')[0] for line in err.splitlines()], ['line 4', 'line 5', 'line 6'])
+        self.assertIn("appears earlier in the file", err)
+        self.assertIn("already exists", err)
+
+        for user in User.objects.filter(username__in=['ann', 'ben', 'cat']):
+            self.assertEqual(user.account.account_no, 1000000 + user.pk)
+            self.assertEqual(user.address.country, 'Bangladesh')
+        self.assertTrue(User.objects.get(username='ann').check_password('ann-secret-123'))
+        self.assertEqual(User.objects.get(username='ben').password, self.hash)
+        self.assertFalse(User.objects.get(username='cat').has_usable_password())
+        self.assertEqual(User.objects.get(username='alice').last_name, '')
+
+    def test_resume_from_checkpoint(self):
+        self.run_import()
+        # as if the run had stopped after its first chunk
+        User.objects.filter(username='cat').delete()
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        with open(self.checkpoint, 'w') as f:
+            json.dump({**state, 'rows': 4, 'imported': 2, 'rejected': 2}, f)
+
+        out, err = self.run_import()
+        self.assertIn("Resuming after row 4", out)
+        self.assertIn("3 customers imported, 3 rows rejected; 2 rows", out)
+        self.assertEqual([line.split(':')[0] for line in err.splitlines()], ['line 6'])
+        self.assertTrue(User.objects.filter(username='cat').exists())
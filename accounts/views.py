@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.shortcuts import render,redirect
 from django.views.generic import FormView
 from .forms import UserRegistationForm,UserUpdateForm
@@ -8,22 +9,20 @@ from django.urls import reverse_lazy
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash
+from asgiref.sync import sync_to_async
 
 
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from core.mail import queue_email
+from core.mixins import AsyncLoginRequiredMixin,arender
+from .cache import aattach
 # Create your views here.
 
 
 
 def send_pass_change_email(user, subject, template):
-    message = render_to_string(template, {
+    queue_email(subject, user.email, template, {
         'user': user,
     })
-    send_email = EmailMultiAlternatives(subject,'',to=[user.email])
-
-    send_email.attach_alternative(message, "text/html")
-    send_email.send()
 
 
 
@@ -32,18 +31,20 @@ class UserRegistrationView(FormView):
     template_name = 'accounts/user_registration.html'
     form_class = UserRegistationForm
     success_url = reverse_lazy("profile")
+    page_cache_timeout = 300
 
 
     def form_valid(self, form):
         # print(form.cleaned_data)
         user = form.save()
-        login(self.request, user)
+        login(self.request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
         # print(user)
         return super().form_valid(form)
 
 
 class UserLoginView(LoginView):
     template_name = 'accounts/user_login.html'
+    page_cache_timeout = 300
 
     def get_success_url(self):
         return reverse_lazy("homepage")
@@ -82,14 +83,20 @@ class account_pass_change(FormView):
 
 
 
-class UserBankAccountUpdateView(View):
+class UserBankAccountUpdateView(AsyncLoginRequiredMixin,View):
     template_name = 'accounts/profile.html'
+    query_budget = 10  # the POST saves user, account and address
 
-    def get(self, request):
+    async def get(self, request):
+        # account and address come from accounts.cache, so building the form is free
+        await aattach(request.user, ('account', 'address'))
         form = UserUpdateForm(instance=request.user)
-        return render(request, self.template_name, {'form': form})
+        return await arender(request, self.template_name, {'form': form})
+
+    async def post(self, request):
+        return await sync_to_async(self.update)(request)
 
-    def post(self, request):
+    def update(self, request):
         form = UserUpdateForm(data=request.POST, instance=request.user)
         if form.is_valid():
             form.save()
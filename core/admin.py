@@ -1,3 +1,11 @@
 from django.contrib import admin
+from .models import EmailOutbox
 
 # Register your models here.
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['to', 'subject']
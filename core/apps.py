@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from .instrumentation import install_query_observers
+        connection_created.connect(install_query_observers)
+
+        if settings.TRACING_ENABLED:
+            from . import tracing
+            tracing.setup()
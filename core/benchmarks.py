@@ -0,0 +1,198 @@
+"""
+Load-test harness for the banking flows.
+
+``run_flows`` drives every URL in accounts/urls.py and transactions/urls.py
+with N concurrent simulated clients (Django test clients, one thread each)
+and records latency and query count per URL name. It is used by
+``manage.py run_benchmarks`` and can be called from a test just the same.
+"""
+import itertools
+import math
+import os
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from accounts.models import UserBankAccount
+from transactions import ledger
+from transactions.constants import DEPOSIT,WITHDRAWAL,LOAN
+
+PASSWORD = 'bench-Pa55word!'
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+@contextmanager
+def test_database():
+    """Run the block against a freshly migrated throwaway database."""
+    setup_test_environment()
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+        # worker threads need a file they can all open, not a private in-memory DB
+        test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+class BenchmarkRecorder:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, url_name, seconds, queries, status):
+        with self.lock:
+            self.samples.setdefault(url_name, []).append((seconds, queries, status))
+
+    def summary(self, elapsed):
+        results = {}
+        for url_name, samples in sorted(self.samples.items()):
+            latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+            queries = [count for _, count, _ in samples]
+            results[url_name] = {
+                'requests': len(samples),
+                'errors': sum(1 for _, _, status in samples if status >= 400),
+                'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'mean_ms': statistics.fmean(latencies),
+                'queries_mean': statistics.fmean(queries),
+                'queries_max': max(queries),
+            }
+        return results
+
+
+class SimulatedClient:
+    """One user walking through the site with its own session."""
+
+    _ids = itertools.count()
+
+    def __init__(self, recorder, recipients):
+        self.recorder = recorder
+        self.recipients = recipients
+        self.client = Client()
+        self.username = f"bench_{time.time_ns()}_{next(self._ids)}"
+        self.password = PASSWORD
+
+    def request(self, method, path, data=None, follow=False):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(path, data or {}, follow=follow)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        self.recorder.add(response.resolver_match.url_name, elapsed, len(queries), response.status_code)
+        return response
+
+    def sign_up(self):
+        self.request('get', '/accounts/register/')
+        self.request('post', '/accounts/register/', {
+            'username': self.username,
+            'password1': self.password,
+            'password2': self.password,
+            'first_name': 'Bench',
+            'last_name': 'User',
+            'email': f"{self.username}@example.com",
+            'account_type': 'Savings',
+            'birth_date': '1990-01-01',
+            'gender': 'Male',
+            'city': 'Dhaka',
+            'street_address': 'Road 1',
+            'postal_code': 1200,
+            'country': 'Bangladesh',
+        })
+        self.request('get', '/accounts/logout/')
+        self.request('post', '/accounts/login/', {'username': self.username, 'password': self.password})
+        self.account = UserBankAccount.objects.get(user__username=self.username)
+
+    def iteration(self):
+        self.request('get', '/')
+        self.request('post', '/transactions/deposit/', {'amount': 5000, 'transaction_type': DEPOSIT})
+        self.request('post', '/transactions/withdraw/', {'amount': 500, 'transaction_type': WITHDRAWAL})
+        self.request('post', '/transactions/loan_request/', {'amount': 1000, 'transaction_type': LOAN})
+        self.request('post', '/transactions/transfer/', {
+            'recipient_account_number': self.recipients[next(self._ids) % len(self.recipients)],
+            'amount': 100,
+        })
+
+        # approve a loan outside the measured requests so there is one to repay
+        loan = ledger.request_loan(self.account, Decimal(200))
+        loan.account = self.account
+        ledger.approve_loan(loan)
+        self.request('get', f'/transactions/loans/{loan.pk}/')
+
+        self.request('get', '/transactions/report/')
+        self.request('get', '/transactions/loans/')
+        self.request('get', '/transactions/export/?format=csv')
+        self.request('get', '/accounts/profile/')
+
+    def change_password(self):
+        new_password = self.password + '1'
+        self.request('get', '/accounts/pass_change/')
+        self.request('post', '/accounts/pass_change/', {
+            'old_password': self.password,
+            'new_password1': new_password,
+            'new_password2': new_password,
+        })
+        self.password = new_password
+
+
+def seed_recipients(count):
+    from django.contrib.auth.models import User
+
+    recipients = []
+    for n in range(count):
+        user = User.objects.create_user(f"bench_recipient_{time.time_ns()}_{n}")
+        account = UserBankAccount.objects.create(
+            user=user, account_type='Savings', gender='Male', account_no=1000000 + user.id,
+        )
+        recipients.append(account.account_no)
+    return recipients
+
+
+def run_flows(clients=4, iterations=10, recipients=10):
+    """Run the flows and return ``(results per URL name, elapsed seconds)``."""
+    recorder = BenchmarkRecorder()
+    recipient_numbers = seed_recipients(recipients)
+    errors = []
+
+    def worker():
+        try:
+            simulated = SimulatedClient(recorder, recipient_numbers)
+            simulated.sign_up()
+            for _ in range(iterations):
+                simulated.iteration()
+            simulated.change_password()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if errors:
+        raise errors[0]
+    return recorder.summary(elapsed), elapsed
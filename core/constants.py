@@ -0,0 +1,11 @@
+PENDING = 1
+SENDING = 2
+SENT = 3
+FAILED = 4
+
+OUTBOX_STATUS = (
+    (PENDING, "Pending"),
+    (SENDING, "Sending"),
+    (SENT, "Sent"),
+    (FAILED, "Failed"),
+)
@@ -0,0 +1,77 @@
+"""
+Query observers that work under both WSGI and ASGI.
+
+``connection.execute_wrapper`` only applies to the connection object of the
+current thread, but async views run their queries in a sync_to_async worker
+thread with a connection of its own. So every connection gets one permanent
+wrapper (installed on ``connection_created``), and that wrapper runs the
+observers registered in a context variable, which asgiref copies into the
+worker thread along with the rest of the request's context.
+"""
+import functools
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_observers = ContextVar('query_observers', default=())
+
+# `IN (%s, %s, %s)` lists of different lengths are the same query
+IN_LIST = re.compile(r'\((?:%s, )*%s\)')
+
+
+def fingerprint(sql):
+    return IN_LIST.sub('(...)', sql)
+
+
+def _run_observers(execute, sql, params, many, context):
+    # the first observer registered ends up outermost, as with nested execute_wrapper blocks
+    for observer in reversed(_observers.get()):
+        execute = functools.partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def install_query_observers(sender, connection, **kwargs):
+    # connection_created fires on every reconnect of the same wrapper object
+    if _run_observers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_run_observers)
+
+
+@contextmanager
+def observe_queries(observer):
+    """
+    Call ``observer`` like an ``execute_wrapper`` for every query run inside
+    the block, in this thread or in threads it hands work to.
+    """
+    token = _observers.set(_observers.get() + (observer,))
+    try:
+        yield observer
+    finally:
+        _observers.reset(token)
+
+
+class QueryStats:
+    """Observer that counts and times every query."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold):
+        """Fingerprints run at least ``threshold`` times, the usual sign of an N+1."""
+        return {sql: n for sql, n in self.fingerprints.items() if n >= threshold}
+
+    @property
+    def duplicates(self):
+        return self.count - len(self.fingerprints)
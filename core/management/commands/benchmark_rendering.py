@@ -0,0 +1,80 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from accounts.models import UserAddress,UserBankAccount
+from core.benchmarks import PASSWORD,percentile,test_database
+
+ANONYMOUS_PAGES = ['/', '/accounts/login/', '/accounts/register/']
+USER_PAGES = ['/', '/accounts/profile/', '/transactions/report/', '/transactions/deposit/']
+
+# what rendering looked like before the cached loader, page and fragment caches
+UNCACHED = {
+    'TEMPLATES': [{
+        **settings.TEMPLATES[0],
+        'OPTIONS': {
+            **settings.TEMPLATES[0]['OPTIONS'],
+            'loaders': [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ],
+        },
+    }],
+    'CACHES': {**settings.CACHES, 'pages': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    'PAGE_CACHE_ENABLED': False,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the anonymous pages and the common logged-in pages with the "
+        "template, page and fragment caches off and on, and report latency "
+        "and queries per page."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with test_database(), override_settings(
+            PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+        ):
+            user = User.objects.create_user('bench_rendering', password=PASSWORD, first_name='Bench')
+            UserBankAccount.objects.create(user=user, account_type='Savings', gender='Male', account_no=1000000 + user.id)
+            UserAddress.objects.create(user=user, street_address='Road 1', city='Dhaka', postal_code=1200, country='Bangladesh')
+
+            self.stdout.write(f"{'page':<32}{'caches':>8}{'queries':>9}{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}")
+            for label, overrides in (('off', UNCACHED), ('on', {})):
+                with override_settings(**overrides):
+                    caches['pages'].clear()
+                    anonymous = Client()
+                    logged_in = Client()
+                    logged_in.login(username='bench_rendering', password=PASSWORD)
+                    pages = [(f"{path} (anonymous)", anonymous, path) for path in ANONYMOUS_PAGES]
+                    pages += [(f"{path} (user)", logged_in, path) for path in USER_PAGES]
+                    for name, client, path in pages:
+                        queries, latencies = self.measure(client, path, options['requests'])
+                        self.stdout.write(
+                            f"{name:<32}{label:>8}{queries:>9.1f}{percentile(latencies, 50):>9.2f}"
+                            f"{percentile(latencies, 95):>9.2f}{statistics.fmean(latencies):>9.2f}"
+                        )
+
+    def measure(self, client, path, requests):
+        # the first request compiles templates and fills the caches
+        client.get(path)
+        counts, latencies = [], []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(path)
+                latencies.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, (path, response.status_code)
+            counts.append(len(captured))
+        return statistics.fmean(counts), sorted(latencies)
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import PASSWORD, percentile
+
+SERVERS = {
+    'wsgi': (
+        "{python} -m gunicorn Tau_Bank.wsgi:application --bind {host}:{port} "
+        "--workers {workers} --worker-class gthread --threads {threads} --log-level warning"
+    ),
+    'asgi': (
+        "{python} -m uvicorn Tau_Bank.asgi:application --host {host} --port {port} "
+        "--workers {workers} --log-level warning"
+    ),
+}
+CSRF_INPUT = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the app under gunicorn (WSGI) and then uvicorn (ASGI) on this host, "
+        "hold an increasing number of concurrent connections against a read view "
+        "and report throughput, latency and errors for each, plus the highest "
+        "concurrency each deployment served within the latency objective."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='10,50,100,200,400',
+                            help="Comma separated concurrent connection counts to try.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per concurrency level.")
+        parser.add_argument('--path', default='/transactions/report/')
+        parser.add_argument('--workers', type=int, default=2, help="Processes per server.")
+        parser.add_argument('--threads', type=int, default=8, help="Threads per gunicorn worker.")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--slo', type=float, default=1000.0,
+                            help="p99 latency in ms a concurrency level must stay under to count as served.")
+        parser.add_argument('--rows', type=int, default=60, help="Deposits made by the benchmark user.")
+        parser.add_argument('--database-url',
+                            help="Database the servers use. Defaults to a fresh, migrated SQLite file.")
+        parser.add_argument('--servers', default='wsgi,asgi')
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, PYTHONUNBUFFERED='1')
+        if options['database_url']:
+            env['DATABASE_URL'] = options['database_url']
+        else:
+            env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'servers.sqlite3')
+            self.stdout.write("migrating a scratch database...")
+            subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v0'],
+                           cwd=settings.BASE_DIR, env=env, check=True)
+
+        levels = [int(n) for n in options['concurrency'].split(',')]
+        base_url = f"http://127.0.0.1:{options['port']}"
+        cookies = None
+        results = {}
+
+        for server in options['servers'].split(','):
+            command = SERVERS[server].format(
+                python=sys.executable, host='127.0.0.1', port=options['port'],
+                workers=options['workers'], threads=options['threads'],
+            )
+            self.stdout.write(f"\n{server}: {command}")
+            process = subprocess.Popen(shlex.split(command), cwd=settings.BASE_DIR, env=env)
+            try:
+                self.wait_until_up(base_url, process)
+                if cookies is None:
+                    # sessions live in the database, so one login serves both servers
+                    cookies = self.seed(base_url, options['rows'])
+                results[server] = []
+                for concurrency in levels:
+                    row = asyncio.run(self.load(base_url + options['path'], cookies, concurrency, options['duration']))
+                    results[server].append(row)
+                    self.print_row(row)
+            finally:
+                process.terminate()
+                process.wait()
+
+        self.stdout.write("\nhighest concurrency served within "
+                          f"p99 < {options['slo']:.0f}ms and < 1% errors:")
+        for server, rows in results.items():
+            served = [row for row in rows if row['p99_ms'] < options['slo'] and row['error_rate'] < 0.01]
+            best = max(served, key=lambda row: row['concurrency'], default=None)
+            if best:
+                self.stdout.write(f"  {server}: {best['concurrency']} connections at {best['throughput_rps']:.0f} req/s")
+            else:
+                self.stdout.write(f"  {server}: none of the levels tried")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'options': {k: options[k] for k in ('path', 'workers', 'threads', 'duration', 'slo')},
+                           'results': results}, f, indent=2)
+            self.stdout.write(f"results written to {options['output']}")
+
+    def wait_until_up(self, base_url, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"server exited with status {process.returncode}")
+            try:
+                httpx.get(base_url + '/accounts/login/', timeout=1)
+                return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        raise CommandError("server did not come up")
+
+    def seed(self, base_url, rows):
+        """Register a user through the site and give it some history to read."""
+        username = f"bench_{time.time_ns()}"
+        with httpx.Client(base_url=base_url, follow_redirects=True) as client:
+            def post(path, data):
+                token = CSRF_INPUT.search(client.get(path).text).group(1)
+                response = client.post(path, data={'csrfmiddlewaretoken': token, **data})
+                response.raise_for_status()
+
+            post('/accounts/register/', {
+                'username': username, 'password1': PASSWORD, 'password2': PASSWORD,
+                'first_name': 'Bench', 'last_name': 'User', 'email': f"{username}@example.com",
+                'account_type': 'Savings', 'birth_date': '1990-01-01', 'gender': 'Male',
+                'city': 'Dhaka', 'street_address': 'Road 1', 'postal_code': 1200, 'country': 'Bangladesh',
+            })
+            for _ in range(rows):
+                post('/transactions/deposit/', {'amount': 100})
+            return dict(client.cookies)
+
+    async def load(self, url, cookies, concurrency, duration):
+        latencies = []
+        errors = 0
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async with httpx.AsyncClient(cookies=cookies, limits=limits, timeout=30) as client:
+            deadline = time.perf_counter() + duration
+
+            async def connection():
+                nonlocal errors
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(url)
+                        ok = response.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    if ok:
+                        latencies.append((time.perf_counter() - started) * 1000)
+                    else:
+                        errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(connection() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        total = len(latencies) + errors
+        return {
+            'concurrency': concurrency,
+            'requests': total,
+            'throughput_rps': len(latencies) / elapsed,
+            'error_rate': errors / total if total else 1.0,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+        }
+
+    def print_row(self, row):
+        self.stdout.write(
+            f"  {row['concurrency']:>5} conns {row['throughput_rps']:>8.1f} req/s  "
+            f"p50 {row['p50_ms']:>7.1f}  p95 {row['p95_ms']:>7.1f}  p99 {row['p99_ms']:>7.1f} ms  "
+            f"errors {row['error_rate']:.1%}"
+        )
@@ -0,0 +1,68 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from accounts.models import UserBankAccount
+from core.benchmarks import PASSWORD,percentile,test_database
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the fixed per-request cost of sessions and the user lookup: "
+        "log in once per session mode, with and without the cached user loader, "
+        "request the same page repeatedly and report queries and latency per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--path', default='/', help="Page to request; the home page by default.")
+        parser.add_argument('--modes', nargs='+', default=list(settings.SESSION_ENGINES),
+                            choices=list(settings.SESSION_ENGINES))
+
+    def handle(self, *args, **options):
+        with test_database(), override_settings(
+            PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+        ):
+            user = User.objects.create_user('bench_sessions', password=PASSWORD)
+            UserBankAccount.objects.create(user=user, account_type='Savings', gender='Male', account_no=1000000 + user.id)
+
+            self.stdout.write(
+                f"{'session mode':<16}{'user cache':>11}{'queries':>9}{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}"
+            )
+            for mode in options['modes']:
+                for user_cache in (False, True):
+                    backends = settings.AUTHENTICATION_BACKENDS if user_cache else [MODEL_BACKEND]
+                    with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[mode],
+                                           AUTHENTICATION_BACKENDS=backends):
+                        queries, latencies = self.measure(options['path'], options['requests'])
+                    self.stdout.write(
+                        f"{mode:<16}{'on' if user_cache else 'off':>11}{queries:>9.1f}"
+                        f"{percentile(latencies, 50):>9.2f}{percentile(latencies, 95):>9.2f}"
+                        f"{statistics.fmean(latencies):>9.2f}"
+                    )
+
+    def measure(self, path, requests):
+        cache.clear()
+        client = Client()
+        client.login(username='bench_sessions', password=PASSWORD)
+        # the first request fills the caches; it is not part of the steady state
+        client.get(path)
+
+        counts, latencies = [], []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(path)
+                latencies.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.status_code
+            counts.append(len(captured))
+        return statistics.fmean(counts), sorted(latencies)
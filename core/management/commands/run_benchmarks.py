@@ -0,0 +1,107 @@
+import json
+import platform
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.benchmarks import run_flows,test_database
+
+METRICS = ['throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_mean']
+# for these a higher number is better
+HIGHER_IS_BETTER = {'throughput_rps'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database, drive the banking flows with concurrent "
+        "simulated clients and report throughput, latency percentiles and queries "
+        "per request for every URL name."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=4)
+        parser.add_argument('--iterations', type=int, default=10,
+                            help="Iterations of the deposit/withdraw/loan/transfer/report loop per client.")
+        parser.add_argument('--recipients', type=int, default=10)
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', help="Compare against a previous JSON result file.")
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help="Percent change treated as a regression when comparing.")
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--fast-hashing', action='store_true',
+                            help="Use MD5 password hashing so register/login do not dominate.")
+        parser.add_argument('--enforce-budgets', action='store_true',
+                            help="Fail as soon as a view runs more queries than its query budget.")
+
+    def handle(self, *args, **options):
+        overrides = {}
+        if options['fast_hashing']:
+            overrides['PASSWORD_HASHERS'] = ['django.contrib.auth.hashers.MD5PasswordHasher']
+        if options['enforce_budgets']:
+            overrides.update(QUERY_INSTRUMENTATION=True, QUERY_BUDGET_STRICT=True)
+        with test_database(), override_settings(**overrides):
+            results, elapsed = run_flows(options['clients'], options['iterations'], options['recipients'])
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'clients': options['clients'],
+                'iterations': options['iterations'],
+                'elapsed_s': elapsed,
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'debug': settings.DEBUG,
+            },
+            'results': results,
+        }
+        self.print_table(results)
+        total = sum(row['requests'] for row in results.values())
+        self.stdout.write(f"\n{total} requests in {elapsed:.2f}s ({total / elapsed:.1f} req/s overall)")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"results written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline['results'], results, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{regressions} regressions over {options['threshold']}%")
+
+    def print_table(self, results):
+        self.stdout.write(
+            f"{'url name':<22}{'reqs':>6}{'err':>5}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        for url_name, row in results.items():
+            self.stdout.write(
+                f"{url_name:<22}{row['requests']:>6}{row['errors']:>5}{row['throughput_rps']:>9.1f}"
+                f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['queries_mean']:>9.1f}"
+            )
+
+    def compare(self, baseline, results, threshold):
+        self.stdout.write("\nchange against baseline:")
+        regressions = 0
+        for url_name, row in results.items():
+            if url_name not in baseline:
+                continue
+            changes = []
+            for metric in METRICS:
+                old, new = baseline[url_name][metric], row[metric]
+                if not old:
+                    continue
+                change = (new - old) / old * 100
+                worse = -change if metric in HIGHER_IS_BETTER else change
+                flag = ''
+                if worse > threshold:
+                    flag = '!'
+                    regressions += 1
+                changes.append(f"{metric} {change:+.0f}%{flag}")
+            self.stdout.write(f"  {url_name:<22}" + ', '.join(changes))
+        return regressions
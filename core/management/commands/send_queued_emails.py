@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.mail import deliver_batch
+
+
+class Command(BaseCommand):
+    help = "Deliver queued transactional emails from the outbox in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Drain everything that is currently due and exit.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total_sent = total_failed = 0
+        started = time.perf_counter()
+
+        while True:
+            sent, failed = deliver_batch(batch_size)
+            total_sent += sent
+            total_failed += failed
+
+            if sent or failed:
+                self.stdout.write(f"batch: {sent} sent, {failed} failed")
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        elapsed = time.perf_counter() - started
+        rate = total_sent / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"{total_sent} sent, {total_failed} failed in {elapsed:.2f}s ({rate:.1f} emails/s)"
+        ))
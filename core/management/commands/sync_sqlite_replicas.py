@@ -0,0 +1,44 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the SQLite primary database over every SQLite replica in "
+        "DATABASE_REPLICAS, for trying the replica router locally. With "
+        "--interval it keeps copying, which behaves like a lagging replica."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help="Seconds between copies; copy once and exit if not given.")
+
+    def handle(self, *args, **options):
+        primary = connections['default'].settings_dict
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("The primary is not SQLite; use the database's own replication.")
+        replicas = [
+            alias for alias in settings.DATABASE_REPLICAS
+            if connections[alias].settings_dict['ENGINE'] == 'django.db.backends.sqlite3'
+        ]
+        if not replicas:
+            raise CommandError("No SQLite replicas configured; set DATABASE_REPLICA_URLS.")
+
+        while True:
+            started = time.perf_counter()
+            with closing(sqlite3.connect(primary['NAME'])) as source:
+                for alias in replicas:
+                    with closing(sqlite3.connect(connections[alias].settings_dict['NAME'])) as target:
+                        # the backup API takes a consistent snapshot even while the app writes
+                        source.backup(target)
+            self.stdout.write(
+                f"copied to {', '.join(replicas)} in {(time.perf_counter() - started) * 1000:.0f}ms"
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
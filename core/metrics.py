@@ -0,0 +1,98 @@
+"""
+Prometheus metrics, served as text at /metrics.
+
+With several WSGI worker processes, set the PROMETHEUS_MULTIPROC_DIR
+environment variable to an empty directory before the workers start. Each
+worker then writes its samples to mmap'd files there and /metrics adds them
+up across processes. Under gunicorn, call ``mark_process_dead`` from the
+``child_exit`` server hook so dead workers' live samples are dropped.
+"""
+import os
+import time
+
+from django.db import transaction
+from django.template.backends.django import DjangoTemplates, Template
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    'tau_request_latency_seconds', "Time spent producing a response.", ['url_name', 'method'],
+)
+REQUEST_DB_TIME = Histogram(
+    'tau_request_db_seconds', "Time spent in the database per request.", ['url_name'],
+)
+REQUEST_DB_QUERIES = Histogram(
+    'tau_request_db_queries', "Queries run per request.", ['url_name'],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 200),
+)
+TEMPLATE_RENDER_TIME = Histogram(
+    'tau_template_render_seconds', "Time spent rendering a template.", ['template'],
+)
+EMAIL_SEND_LATENCY = Histogram(
+    'tau_email_send_seconds', "Time spent handing one email to the mail server.",
+)
+EMAILS_SENT = Counter('tau_emails_sent_total', "Emails delivered by the outbox worker.")
+EMAIL_FAILURES = Counter('tau_email_failures_total', "Failed email delivery attempts.")
+ACCOUNT_CACHE_REQUESTS = Counter(
+    'tau_account_cache_requests_total', "Account/address cache lookups.", ['kind', 'result'],
+)
+AUTH_USER_CACHE_REQUESTS = Counter(
+    'tau_auth_user_cache_requests_total', "Per-request user lookups by CachedModelBackend.", ['result'],
+)
+LEDGER_OPERATIONS = Counter(
+    'tau_ledger_operations_total', "Committed ledger operations.", ['operation'],
+)
+LEDGER_AMOUNT = Counter(
+    'tau_ledger_amount_total', "Money moved by committed ledger operations.", ['operation'],
+)
+
+
+def count_operation(operation, amount, count=1):
+    """Count a ledger operation once the surrounding transaction commits."""
+    def observe():
+        LEDGER_OPERATIONS.labels(operation).inc(count)
+        LEDGER_AMOUNT.labels(operation).inc(float(amount))
+    transaction.on_commit(observe)
+
+
+def url_name(request):
+    # unresolved paths share one label so random 404s cannot blow up cardinality
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.url_name or 'unnamed'
+
+
+def mark_process_dead(pid):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+def exposition():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            TEMPLATE_RENDER_TIME.labels(self.origin.template_name or 'string').observe(time.perf_counter() - started)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend that times every top-level template render."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
@@ -0,0 +1,341 @@
+import hashlib
+import logging
+import random
+import re
+import time
+from contextlib import contextmanager, nullcontext
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.middleware import get_user
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+from opentelemetry import propagate, trace
+
+from accounts import cache as account_cache
+from . import metrics, tracing
+from .instrumentation import QueryStats,observe_queries
+from .profiling import RequestProfiler
+from .routers import RoutingState,routing
+
+logger = logging.getLogger('core.queries')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class ObservingMiddleware:
+    """
+    Base for middleware that wraps the rest of the request in ``observe`` and
+    then looks at the response in ``finish``. Runs natively under both WSGI
+    and ASGI, so async views are not pushed back onto a thread by it.
+    """
+    sync_capable = True
+    async_capable = True
+    enabled_setting = None
+
+    def __init__(self, get_response):
+        if not getattr(settings, self.enabled_setting):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def observe(self, request):
+        raise NotImplementedError
+
+    def finish(self, request, response, state):
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.observe(request) as state:
+            response = self.get_response(request)
+            return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        with self.observe(request) as state:
+            response = await self.get_response(request)
+            return self.finish(request, response, state)
+
+
+def query_budget(resolver_match):
+    """
+    The query budget of the view that served the request: QUERY_BUDGETS[url_name]
+    if set, otherwise the view's ``query_budget`` attribute, otherwise None.
+    """
+    if resolver_match is None:
+        return None
+    if resolver_match.url_name in settings.QUERY_BUDGETS:
+        return settings.QUERY_BUDGETS[resolver_match.url_name]
+    view = getattr(resolver_match.func, 'view_class', resolver_match.func)
+    return getattr(view, 'query_budget', None)
+
+
+class QueryInstrumentationMiddleware(ObservingMiddleware):
+    """
+    Records query count, DB time and repeated SQL for every request and adds
+    them to the response as X-DB-* headers. Enabled by QUERY_INSTRUMENTATION.
+
+    Queries run while a StreamingHttpResponse is being consumed happen after
+    this middleware returns and are not counted.
+    """
+    enabled_setting = 'QUERY_INSTRUMENTATION'
+
+    def observe(self, request):
+        return observe_queries(QueryStats())
+
+    def finish(self, request, response, stats):
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        repeated = stats.repeated(settings.QUERY_REPEAT_THRESHOLD)
+        response['X-DB-Queries'] = stats.count
+        response['X-DB-Time-ms'] = f"{stats.time * 1000:.1f}"
+        response['X-DB-Duplicate-Queries'] = stats.duplicates
+
+        logger.debug(
+            "%s %s (%s): %d queries, %.1fms, %d duplicates",
+            request.method, request.path, url_name, stats.count, stats.time * 1000, stats.duplicates,
+        )
+        for sql, n in repeated.items():
+            logger.warning("%s (%s) ran the same query %d times: %s", request.path, url_name, n, sql)
+
+        budget = query_budget(request.resolver_match)
+        if budget is not None:
+            response['X-DB-Query-Budget'] = budget
+            if stats.count > budget:
+                message = f"{request.path} ({url_name}) ran {stats.count} queries, budget is {budget}"
+                if settings.QUERY_BUDGET_STRICT:
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when a staff user adds ``?_profile=1``, when the
+    X-Profile header carries PROFILING_TOKEN, or at PROFILING_SAMPLE_RATE.
+    Enabled by PROFILING_ENABLED; must come after AuthenticationMiddleware.
+
+    Like the query counter above, the body of a StreamingHttpResponse is
+    produced after this returns and is not part of the profile. cProfile
+    follows a single thread, so this one stays sync only: while it is
+    enabled Django runs async views in a thread.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        if request.GET.get('_profile') and request.user.is_staff:
+            return True
+        token = request.headers.get('X-Profile')
+        if token and settings.PROFILING_TOKEN and token == settings.PROFILING_TOKEN:
+            return True
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        with RequestProfiler() as profiler:
+            response = self.get_response(request)
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        response['X-Profile-Name'] = profiler.save(request, url_name, response.status_code)
+        return response
+
+
+class MetricsMiddleware(ObservingMiddleware):
+    """
+    Observes latency, DB time and query count per URL name for /metrics.
+    Enabled by METRICS_ENABLED; goes first so it times the other middleware.
+    """
+    enabled_setting = 'METRICS_ENABLED'
+
+    @contextmanager
+    def observe(self, request):
+        with observe_queries(QueryStats()) as stats:
+            yield stats, time.perf_counter()
+
+    def finish(self, request, response, state):
+        stats, started = state
+        url_name = metrics.url_name(request)
+        metrics.REQUEST_LATENCY.labels(url_name, request.method).observe(time.perf_counter() - started)
+        metrics.REQUEST_DB_TIME.labels(url_name).observe(stats.time)
+        metrics.REQUEST_DB_QUERIES.labels(url_name).observe(stats.count)
+        return response
+
+
+class TracingMiddleware(ObservingMiddleware):
+    """
+    Opens a server span per request (continuing the caller's trace if it sent
+    a traceparent header) and a child span for every query. Enabled by
+    TRACING_ENABLED.
+    """
+    enabled_setting = 'TRACING_ENABLED'
+
+    @contextmanager
+    def observe(self, request):
+        with tracing.tracer.start_as_current_span(
+            f"{request.method} {request.path}",
+            context=propagate.extract(request.headers),
+            kind=trace.SpanKind.SERVER,
+        ) as span:
+            span.set_attribute('http.method', request.method)
+            span.set_attribute('http.target', request.get_full_path())
+            with tracing.trace_queries():
+                yield span
+
+    def finish(self, request, response, span):
+        match = request.resolver_match
+        if match is not None:
+            span.update_name(f"{request.method} {match.route}")
+            span.set_attribute('http.route', match.route)
+            span.set_attribute('django.url_name', match.url_name or '')
+        # only if the view already loaded the user: loading it here would be a
+        # synchronous query inside the event loop under ASGI
+        user = getattr(request, '_cached_user', None) or getattr(request, '_acached_user', None)
+        if user is not None and user.is_authenticated:
+            span.set_attribute('enduser.id', user.pk)
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.set_status(trace.StatusCode.ERROR)
+        return response
+
+
+class ReplicaRoutingMiddleware(ObservingMiddleware):
+    """
+    Lets core.routers.ReplicaRouter send the reads of read-only views to the
+    replicas, and pins clients that just wrote to the primary. Enabled when
+    DATABASE_REPLICAS is not empty.
+    """
+    enabled_setting = 'DATABASE_REPLICAS'
+
+    def observe(self, request):
+        pinned = (
+            settings.REPLICA_PIN_COOKIE in request.COOKIES
+            or request.headers.get('X-Read-Primary') == '1'
+        )
+        request.db_routing = RoutingState(primary=pinned)
+        return routing(request.db_routing)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        view = getattr(view_func, 'view_class', view_func)
+        url_name = request.resolver_match.url_name or ''
+        if getattr(view, 'read_replica', False) or url_name.endswith('_changelist'):
+            request.db_routing.replica_allowed = True
+        return None
+
+    def finish(self, request, response, state):
+        if state.wrote:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class PageCacheMiddleware(ObservingMiddleware):
+    """
+    Serves whole pages from the "pages" cache to anonymous visitors, for
+    views with a ``page_cache_timeout`` attribute. Enabled by
+    PAGE_CACHE_ENABLED.
+
+    A visitor counts as anonymous when the request carries no session or
+    messages cookie, so deciding costs no session lookup; everybody else gets
+    the page rendered as usual. The CSRF token is cut out of the stored body
+    and the visitor's own token is put back on every hit, so forms on cached
+    pages (login, register) still pass the CSRF check.
+    """
+    enabled_setting = 'PAGE_CACHE_ENABLED'
+    csrf_input = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+    csrf_placeholder = '__csrf_token__'
+    private_cookies = (settings.SESSION_COOKIE_NAME, 'messages')
+
+    def observe(self, request):
+        return nullcontext()
+
+    def cache_key(self, request):
+        return 'page:' + hashlib.md5(request.get_full_path().encode()).hexdigest()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        timeout = getattr(view, 'page_cache_timeout', None)
+        if timeout is None or request.method not in ('GET', 'HEAD'):
+            return None
+        if any(name in request.COOKIES for name in self.private_cookies):
+            return None
+
+        key = self.cache_key(request)
+        cached = caches['pages'].get(key)
+        if cached is None:
+            request.page_cache = (key, timeout)
+            return None
+
+        content, headers = cached
+        response = HttpResponse(content.replace(self.csrf_placeholder, get_token(request)))
+        for header, value in headers:
+            response[header] = value
+        response['X-Page-Cache'] = 'hit'
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+    def finish(self, request, response, state):
+        if not hasattr(request, 'page_cache'):
+            return response
+        key, timeout = request.page_cache
+        session = getattr(request, 'session', None)
+        cacheable = (
+            response.status_code == 200
+            and not response.streaming
+            # anything but a fresh CSRF cookie means the page was made for this visitor
+            and set(response.cookies) <= {settings.CSRF_COOKIE_NAME}
+            and not (session is not None and session.modified)
+        )
+        if cacheable:
+            content = self.csrf_input.sub(rf'\g<1>{self.csrf_placeholder}\g<2>', response.content.decode(response.charset))
+            headers = [(header, value) for header, value in response.items() if header != 'Content-Length']
+            caches['pages'].set(key, (content, headers), timeout)
+            response['X-Page-Cache'] = 'miss'
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
+class AccountCacheMiddleware:
+    """
+    Hands out ``request.user`` (and ``request.auser()``) with the account
+    from accounts.cache already attached, so ``request.user.account`` in
+    views, forms and the navbar costs no query. The address is left to load
+    from the cache on first access. Goes right after AuthenticationMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # nothing here does I/O, so the same code serves both modes
+        request.user = SimpleLazyObject(lambda: account_cache.attach(get_user(request)))
+        auser = request.auser
+
+        async def cached_auser():
+            user = await auser()
+            if user.is_authenticated and not User.account.related.is_cached(user):
+                await account_cache.aattach(user)
+            return user
+
+        request.auser = cached_auser
+        return self.get_response(request)
@@ -0,0 +1,35 @@
+"""
+Helpers for the async (ASGI) read views.
+
+Under ASGI the lazy ``request.user`` cannot be touched from the event loop,
+since loading it is a synchronous query. AsyncLoginRequiredMixin loads it
+with ``request.auser()`` up front and puts the real user object back on
+the request so templates rendered later can use it freely.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import AccessMixin
+from django.contrib.auth.models import User
+from django.shortcuts import render
+
+from accounts.cache import aattach
+
+# templates may still touch the database (context processors, lazy relations),
+# so they are rendered in the request's sync thread
+arender = sync_to_async(render)
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """LoginRequiredMixin for views whose handlers are all ``async def``."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+    async def aget_account(self):
+        user = self.request.user
+        if not User.account.related.is_cached(user):
+            await aattach(user)
+        # raises DoesNotExist without a query if the user has no account
+        return user.account
@@ -1,3 +1,25 @@
 from django.db import models
-
+from django.utils import timezone
+from .constants import OUTBOX_STATUS,PENDING
 # Create your models here.
+
+
+class EmailOutbox(models.Model):
+    subject = models.CharField(max_length=255)
+    to = models.EmailField()
+    html_body = models.TextField()
+    status = models.IntegerField(choices=OUTBOX_STATUS, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to}"
@@ -0,0 +1,134 @@
+"""
+On-demand request profiling.
+
+ProfilingMiddleware runs selected requests under cProfile while a
+sampling thread records the request thread's stack. Each profile is
+stored in PROFILING_DIR as three files sharing one name:
+
+    <name>.prof     cProfile output, open with pstats or snakeviz
+    <name>.folded   collapsed stacks ("a;b;c 12"), feed to flamegraph.pl
+    <name>.json     request metadata shown on the admin profiles page
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack every ``interval`` seconds."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def finish(self):
+        self.done.set()
+        self.join()
+        return self.stacks
+
+
+class RequestProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.sampler.start()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self.stacks = self.sampler.finish()
+        self.duration = time.perf_counter() - self.started
+
+    def save(self, request, url_name, status):
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        ms = round(self.duration * 1000)
+        name = f"{timezone.now():%Y%m%d-%H%M%S}-{url_name or 'unresolved'}-{ms}ms-{uuid.uuid4().hex[:6]}"
+        base = os.path.join(settings.PROFILING_DIR, name)
+
+        self.profile.dump_stats(base + '.prof')
+        with open(base + '.folded', 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(base + '.json', 'w') as f:
+            json.dump({
+                'name': name,
+                'created': timezone.now().isoformat(),
+                'method': request.method,
+                'path': request.get_full_path(),
+                'url_name': url_name,
+                'status': status,
+                'duration_ms': ms,
+                'user': request.user.get_username() if hasattr(request, 'user') else '',
+            }, f)
+        prune(settings.PROFILING_KEEP)
+        return name
+
+
+def recent_profiles(limit=None):
+    """Metadata of the stored profiles, newest first."""
+    if not os.path.isdir(settings.PROFILING_DIR):
+        return []
+    names = sorted((f for f in os.listdir(settings.PROFILING_DIR) if f.endswith('.json')), reverse=True)
+    profiles = []
+    for filename in names[:limit]:
+        with open(os.path.join(settings.PROFILING_DIR, filename)) as f:
+            profiles.append(json.load(f))
+    return profiles
+
+
+def profile_path(name, extension):
+    # names come from the URL, never let them leave PROFILING_DIR
+    return os.path.join(settings.PROFILING_DIR, os.path.basename(name) + extension)
+
+
+def top_functions(name, limit):
+    """The ``limit`` functions with the highest cumulative time in a profile."""
+    stats = pstats.Stats(profile_path(name, '.prof'))
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    rows = []
+    for func in stats.fcn_list[:limit]:
+        primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[func]
+        rows.append({
+            'function': pstats.func_std_string(func),
+            'calls': calls if calls == primitive_calls else f"{calls}/{primitive_calls}",
+            'total_ms': total_time * 1000,
+            'cumulative_ms': cumulative_time * 1000,
+        })
+    return rows
+
+
+def prune(keep):
+    stale = recent_profiles()[keep:]
+    for profile in stale:
+        for extension in ('.prof', '.folded', '.json'):
+            try:
+                os.remove(profile_path(profile['name'], extension))
+            except FileNotFoundError:
+                pass
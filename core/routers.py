@@ -0,0 +1,80 @@
+"""
+Read-replica routing.
+
+Outside a request, and for any request that has not opted in, everything
+goes to ``default``. ReplicaRoutingMiddleware opts a request in when it is a
+GET/HEAD to a view with ``read_replica = True`` or to an admin changelist.
+Reads then go to a random alias from DATABASE_REPLICAS, until either:
+
+* the request writes anything, after which it reads from the primary, and
+  the response carries a cookie pinning the client to the primary for
+  REPLICA_PIN_SECONDS so the page it is redirected to sees the write, or
+* code asks for the primary with ``use_primary()``, or the client sends an
+  ``X-Read-Primary: 1`` header.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_state = ContextVar('db_routing', default=None)
+
+# sessions and users are always read from the primary, or a client that has
+# just logged in could look logged out until the replica catches up
+PRIMARY_ONLY_APPS = {'sessions', 'auth'}
+
+
+class RoutingState:
+    def __init__(self, primary=False):
+        self.replica_allowed = False
+        self.primary = primary
+        self.wrote = False
+
+
+@contextmanager
+def routing(state):
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block, whatever the request allows."""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    previous, state.primary = state.primary, True
+    try:
+        yield
+    finally:
+        state.primary = previous
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica_allowed or state.primary or state.wrote:
+            return 'default'
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return 'default'
+        if not settings.DATABASE_REPLICAS:
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,195 @@
+"""
+Static file pipeline.
+
+``collectstatic`` with CompressedManifestStaticFilesStorage:
+
+* writes resized copies of every image next to it (``img/bank.960w.jpg``
+  for each width in STATIC_IMAGE_WIDTHS narrower than the original), which
+  the ``{% srcset %}`` tag lists for ``<img srcset>``;
+* fingerprints every file, as ManifestStaticFilesStorage does;
+* writes ``.gz`` and, when the Brotli package is installed, ``.br`` copies
+  of the fingerprinted text files, kept only if they are actually smaller.
+
+StaticFilesApplication serves STATIC_ROOT from the WSGI process: it picks
+the precompressed copy the client accepts and marks fingerprinted files as
+immutable for a year, so browsers never ask for them again.
+"""
+import gzip
+import io
+import mimetypes
+import os
+import posixpath
+import re
+import time
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils.http import http_date
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf'}
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+# ManifestStaticFilesStorage puts 12 hex digits before the extension
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def variant_name(name, width):
+    root, ext = posixpath.splitext(name)
+    return f"{root}.{width}w{ext}"
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+
+        paths = dict(paths)
+        for name in [name for name in paths if posixpath.splitext(name)[1].lower() in IMAGE_EXTENSIONS]:
+            storage, path = paths[name]
+            for variant in self.write_variants(name, storage, path):
+                paths[variant] = (self, variant)
+
+        yield from super().post_process(paths, dry_run, **options)
+
+        for hashed_name in set(self.hashed_files.values()):
+            if posixpath.splitext(hashed_name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self.write_compressed(hashed_name)
+
+    def replace(self, name, content):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, content)
+
+    def write_variants(self, name, storage, path):
+        with storage.open(path) as f:
+            image = Image.open(f)
+            image.load()
+        ext = posixpath.splitext(name)[1].lower()
+        variants = []
+        for width in settings.STATIC_IMAGE_WIDTHS:
+            if width >= image.width:
+                continue
+            resized = image.resize((width, round(image.height * width / image.width)), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            if ext in ('.jpg', '.jpeg'):
+                resized.save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+            else:
+                resized.save(buffer, image.format, optimize=True)
+            variant = variant_name(name, width)
+            self.replace(variant, ContentFile(buffer.getvalue()))
+            variants.append(variant)
+        return variants
+
+    def write_compressed(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['.br'] = brotli.compress(data, quality=11)
+        for suffix, body in compressed.items():
+            if len(body) < len(data) * 0.95:
+                self.replace(name + suffix, ContentFile(body))
+
+
+def accepts(accept_encoding, coding):
+    for item in accept_encoding.split(','):
+        token, _, params = item.strip().partition(';')
+        if token.strip().lower() == coding:
+            return not re.match(r'\s*q\s*=\s*0(\.0*)?\s*$', params)
+    return False
+
+
+class StaticFile:
+    def __init__(self, path, name, immutable):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.mtime = int(stat.st_mtime)
+        self.last_modified = http_date(stat.st_mtime)
+        self.immutable = immutable
+        self.encoded = [
+            (coding, path + suffix, os.path.getsize(path + suffix))
+            for coding, suffix in ENCODINGS if os.path.exists(path + suffix)
+        ]
+
+    def choose(self, accept_encoding):
+        for coding, path, size in self.encoded:
+            if accepts(accept_encoding, coding):
+                return coding, path, size
+        return None, self.path, self.size
+
+
+class StaticFilesApplication:
+    """
+    WSGI middleware serving STATIC_URL from STATIC_ROOT. The directory is
+    indexed once at startup: it only changes with collectstatic, i.e. on a
+    deploy, which restarts the workers anyway.
+    """
+
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.root = str(root or settings.STATIC_ROOT)
+        self.prefix = '/' + (prefix or settings.STATIC_URL).strip('/') + '/'
+        self.files = self.scan()
+
+    def scan(self):
+        files = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if filename.endswith(('.gz', '.br')) and os.path.exists(path[:-3]):
+                    continue
+                files[name] = StaticFile(path, name, bool(HASHED_NAME.search(name)))
+        return files
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        static = self.files.get(path[len(self.prefix):]) if path.startswith(self.prefix) else None
+        if static is None or environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+
+        coding, path, size = static.choose(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        headers = [
+            ('Content-Type', static.content_type),
+            ('Last-Modified', static.last_modified),
+            ('Cache-Control', IMMUTABLE if static.immutable else 'public, max-age=60'),
+            ('Expires', http_date(time.time() + (31536000 if static.immutable else 60))),
+        ]
+        # each encoding is a different body, so it gets its own ETag
+        etag = f'"{static.mtime:x}-{size:x}"'
+        headers.append(('ETag', etag))
+        if static.encoded:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 Not Modified', headers)
+            return []
+
+        headers.append(('Content-Length', str(size)))
+        if coding:
+            headers.append(('Content-Encoding', coding))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        f = open(path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper:
+            return file_wrapper(f, 64 * 1024)
+        return _iter_file(f)
+
+
+def _iter_file(f):
+    with f:
+        while chunk := f.read(64 * 1024):
+            yield chunk
@@ -0,0 +1,23 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+
+from core.staticfiles import variant_name
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(name):
+    """
+    The ``srcset`` value for the resized copies of ``name`` made by
+    collectstatic, or an empty string where there are none (development,
+    or a storage without a manifest).
+    """
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+    return ', '.join(
+        f"{static(variant_name(name, width))} {width}w"
+        for width in settings.STATIC_IMAGE_WIDTHS
+        if variant_name(name, width) in hashed_files
+    )
@@ -1,3 +1,292 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connections,transaction
+from django.template.loader import render_to_string
+from django.test import RequestFactory,TestCase,TransactionTestCase,override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import cache as account_cache
+from accounts.models import UserBankAccount
+from accounts.tests import make_customer
+from transactions import ledger
+from transactions.models import Transaction
+from .constants import PENDING,SENDING,SENT,FAILED
+from .mail import claim_batch,deliver_batch,queue_email
+from .middleware import QueryBudgetExceeded
+from .routers import ReplicaRouter,RoutingState,routing
+from .models import EmailOutbox
+
+
+@override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=[])
+class MetricsViewTests(TestCase):
+    def test_anonymous_is_refused(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_customer_is_refused(self):
+        self.client.force_login(User.objects.create_user('alice', 'alice@example.com', 'secret-pass-123'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_staff(self):
+        self.client.force_login(User.objects.create_user('ops', 'ops@example.com', 'secret-pass-123', is_staff=True))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'tau_', response.content)
+
+    @override_settings(METRICS_TOKEN='scrape')
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_allowed_ip(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.6').status_code, 403)
+
+
+# outside TestCase's transaction, so atomic blocks cost what they do in production
+@override_settings(QUERY_INSTRUMENTATION=True, QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TransactionTestCase):
+    def setUp(self):
+        self.user = make_customer('alice', 5000)
+        self.other = make_customer('bob', 100)
+        self.client.force_login(self.user)
+        ledger.deposit(self.user.account, Decimal('100'))
+        self.loan = ledger.approve_loan(ledger.request_loan(self.user.account, Decimal('200')))
+
+    def assertWithinBudget(self, response, status=200):
+        self.assertEqual(response.status_code, status)
+        self.assertLessEqual(int(response['X-DB-Queries']), int(response['X-DB-Query-Budget']))
+
+    def test_pages(self):
+        for name in ['homepage', 'profile', 'deposit_money', 'withdraw_money', 'loan_request',
+                     'loan_list', 'transaction_report', 'transaction_export', 'transfer_money', 'batch_transfer']:
+            with self.subTest(name):
+                self.assertWithinBudget(self.client.get(reverse(name)))
+        self.assertWithinBudget(self.client.get(reverse('transaction_report'), {'page': 'x'}))
+
+    def test_forms(self):
+        # browsers send the form's idempotency_key field
+        account_no = self.other.account.account_no
+        for name, data in [('deposit_money', {'amount': '300', 'transaction_type': '1'}),
+                           ('withdraw_money', {'amount': '500', 'transaction_type': '2'}),
+                           ('loan_request', {'amount': '100', 'transaction_type': '3'}),
+                           ('transfer_money', {'recipient_account_number': account_no, 'amount': '10'}),
+                           ('batch_transfer', {'lines': f"{account_no},1\n{account_no},2"})]:
+            with self.subTest(name):
+                self.assertWithinBudget(self.client.post(reverse(name), {**data, 'idempotency_key': name}), 302)
+        self.assertWithinBudget(self.client.get(reverse('pay', args=[self.loan.pk])), 302)
+
+    def test_api(self):
+        for name, body in [('api_deposit', {'amount': '300'}), ('api_withdraw', {'amount': '500'}),
+                           ('api_loan_request', {'amount': '100'}),
+                           ('api_transfer', {'recipient_account_number': self.other.account.account_no, 'amount': '5'})]:
+            with self.subTest(name):
+                response = self.client.post(reverse(name), json.dumps(body), content_type='application/json',
+                                            HTTP_IDEMPOTENCY_KEY=name)
+                self.assertWithinBudget(response, 201)
+
+    @override_settings(QUERY_BUDGETS={'transaction_report': 0})
+    def test_over_budget_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('transaction_report'))
+
+
+class RefusingBackend(EmailBackend):
+    """The locmem backend, refusing mail to anyone at refused.example."""
+    def send_messages(self, messages):
+        if any(to.endswith('@refused.example') for message in messages for to in message.to):
+            raise ConnectionRefusedError("recipient refused")
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='core.tests.RefusingBackend', EMAIL_OUTBOX_RETRY_DELAY=30, EMAIL_OUTBOX_MAX_ATTEMPTS=5)
+class EmailOutboxTests(TestCase):
+    def queue(self, to):
+        return queue_email("Deposit Message", to, 'transactions/deposit_email.html', {'amount': 10})
+
+    def test_queued_with_the_transaction(self):
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                self.queue('alice@example.com')
+                1 / 0
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertEqual(mail.outbox, [])
+
+        with transaction.atomic():
+            email = self.queue('alice@example.com')
+        self.assertEqual(EmailOutbox.objects.get().status, PENDING)
+        self.assertIn('10', email.html_body)
+
+    def test_batch_is_sent(self):
+        for n in range(3):
+            self.queue(f"customer{n}@example.com")
+        self.assertEqual(deliver_batch(), (3, 0))
+        self.assertEqual([message.to for message in mail.outbox], [[f"customer{n}@example.com"] for n in range(3)])
+        self.assertEqual(set(EmailOutbox.objects.values_list('status', flat=True)), {SENT})
+        self.assertEqual(deliver_batch(), (0, 0))
+
+    def test_command_drains_the_outbox(self):
+        for n in range(5):
+            self.queue(f"customer{n}@example.com")
+        out = io.StringIO()
+        call_command('send_queued_emails', once=True, batch_size=2, stdout=out)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertIn("5 sent, 0 failed", out.getvalue())
+
+    def test_failed_send_backs_off(self):
+        self.queue('alice@example.com')
+        refused = self.queue('bob@refused.example')
+        EmailOutbox.objects.filter(pk=refused.pk).update(attempts=2)
+        self.queue('carol@example.com')
+
+        before = timezone.now()
+        self.assertEqual(deliver_batch(), (2, 1))
+        self.assertEqual(len(mail.outbox), 2)
+        refused.refresh_from_db()
+        self.assertEqual((refused.status, refused.attempts, refused.last_error), (PENDING, 3, "recipient refused"))
+        # 30s doubled for each of the two earlier attempts
+        self.assertGreaterEqual(refused.next_attempt_at, before + timedelta(seconds=120))
+        self.assertLess(refused.next_attempt_at, before + timedelta(seconds=125))
+
+    def test_gives_up_after_max_attempts(self):
+        refused = self.queue('bob@refused.example')
+        EmailOutbox.objects.filter(pk=refused.pk).update(attempts=4)
+        self.assertEqual(deliver_batch(), (0, 1))
+        refused.refresh_from_db()
+        self.assertEqual((refused.status, refused.attempts), (FAILED, 5))
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_batch(), (0, 0))
+
+    def test_expired_lease_is_reclaimed(self):
+        leased = self.queue('alice@example.com')
+        abandoned = self.queue('bob@example.com')
+        EmailOutbox.objects.update(status=SENDING, next_attempt_at=timezone.now() + timedelta(minutes=5))
+        EmailOutbox.objects.filter(pk=abandoned.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual([email.pk for email in claim_batch(10)], [abandoned.pk])
+        self.assertEqual(claim_batch(10), [])
+        self.assertEqual(EmailOutbox.objects.get(pk=leased.pk).status, SENDING)
+
+
+class NavbarFragmentTests(TransactionTestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        self.user = make_customer('alice', 100)
+
+    def render(self):
+        request = RequestFactory().get('/')
+        request.user = account_cache.attach(User.objects.get(pk=self.user.pk))
+        return render_to_string('navbar.html', request=request)
+
+    def test_second_render_is_a_cache_hit(self):
+        first = self.render()
+        with mock.patch.object(caches['pages'], 'set') as cache_set:
+            second = self.render()
+        cache_set.assert_not_called()
+        self.assertEqual(second, first)
+
+    def test_balance_is_rendered_fresh(self):
+        self.assertIn('balance : 100', self.render())
+        ledger.deposit(self.user.account, Decimal('150'))
+        with mock.patch.object(caches['pages'], 'set') as cache_set:
+            self.assertIn('balance : 250', self.render())
+        cache_set.assert_not_called()
+
+
+# a second connection to the test database, standing in for a replica; it
+# has to exist before the test runner sets the databases up
+REPLICA = 'replica_test'
+connections.settings.setdefault(REPLICA, {**connections.settings['default'], 'TEST': {'MIRROR': 'default'}})
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        self.user = make_customer('alice', 500)
+        ledger.deposit(self.user.account, Decimal('100'))
+        self.client.force_login(self.user)
+
+    def replica_queries(self, *args, **kwargs):
+        with CaptureQueriesContext(connections[REPLICA]) as queries:
+            response = self.client.get(reverse('transaction_report'), *args, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_read_replica_view_reads_from_the_replica(self):
+        self.assertGreater(self.replica_queries(), 0)
+
+    def test_write_pins_the_client_to_the_primary(self):
+        response = self.client.post(reverse('deposit_money'), {'amount': '200', 'transaction_type': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        self.assertEqual(self.replica_queries(), 0)
+
+    def test_read_primary_header(self):
+        self.assertEqual(self.replica_queries(HTTP_X_READ_PRIMARY='1'), 0)
+
+    def test_writes_and_locks_use_the_primary(self):
+        router = ReplicaRouter()
+        with routing(RoutingState()) as state, CaptureQueriesContext(connections[REPLICA]) as queries:
+            state.replica_allowed = True
+            self.assertEqual(router.db_for_read(Transaction), REPLICA)
+            with transaction.atomic():
+                list(UserBankAccount.objects.select_for_update().filter(user=self.user))
+            ledger.deposit(self.user.account, Decimal('10'))
+            # and, having written, the rest of the request reads from the primary too
+            self.assertEqual(router.db_for_read(Transaction), 'default')
+        self.assertEqual(len(queries), 0)
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_TOKEN='profile-me', PROFILING_SAMPLE_RATE=0)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(PROFILING_DIR=self.directory))
+        self.staff = User.objects.create_user('ops', 'ops@example.com', 'secret-pass-123', is_staff=True)
+        self.customer = make_customer('alice')
+
+    def test_staff_profiles_a_request(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('homepage'), {'_profile': '1'})
+        name = response['X-Profile-Name']
+        self.assertEqual(sorted(os.listdir(self.directory)), [name + '.folded', name + '.json', name + '.prof'])
+
+        page = self.client.get(reverse('profile_list'))
+        self.assertEqual(page.status_code, 200)
+        self.assertEqual(page.context['selected'], name)
+        self.assertTrue(page.context['top_functions'])
+        download = self.client.get(reverse('profile_download', args=[name, 'folded']))
+        self.assertEqual(download.status_code, 200)
+
+    def test_customer_is_not_profiled(self):
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('homepage'), {'_profile': '1'})
+        self.assertNotIn('X-Profile-Name', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_token(self):
+        self.assertNotIn('X-Profile-Name', self.client.get(reverse('homepage'), HTTP_X_PROFILE='wrong'))
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertIn('X-Profile-Name', self.client.get(reverse('homepage'), HTTP_X_PROFILE='profile-me'))
+
+    def test_profiles_page_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('profile_list')).status_code, 302)
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(reverse('profile_list')).status_code, 302)
+        self.assertEqual(self.client.get(reverse('profile_download', args=['x', 'prof'])).status_code, 302)
@@ -0,0 +1,96 @@
+"""
+OpenTelemetry tracing.
+
+With TRACING_ENABLED, ``setup`` (called from CoreConfig.ready) installs a
+tracer provider that keeps TRACING_SAMPLE_RATIO of new traces and exports
+them to the console, a JSON-lines file or an OTLP collector. TracingMiddleware
+opens a span per request; inside it every ORM query, ledger operation, email
+template render and SMTP send gets a child span.
+
+When tracing is off the opentelemetry API hands out no-op spans, so the
+helpers below cost next to nothing and can be called unconditionally.
+"""
+import functools
+
+from django.conf import settings
+from opentelemetry import trace
+
+from .instrumentation import observe_queries
+
+tracer = trace.get_tracer('tau_bank')
+
+# upper bounds of the amount_bucket attribute; amounts are bucketed so traces
+# can be grouped by size without recording exact sums
+AMOUNT_BUCKETS = (100, 1000, 10000, 100000)
+MAX_STATEMENT_LENGTH = 2000
+
+
+def setup():
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': settings.TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO)),
+    )
+    if settings.TRACING_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT or None)
+    elif settings.TRACING_EXPORTER == 'file':
+        exporter = ConsoleSpanExporter(
+            out=open(settings.TRACING_FILE, 'a'),
+            formatter=lambda span: span.to_json(indent=None) + '\n',
+        )
+    else:
+        exporter = ConsoleSpanExporter()
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+def amount_bucket(amount):
+    for bound in AMOUNT_BUCKETS:
+        if amount < bound:
+            return f"<{bound}"
+    return f">={AMOUNT_BUCKETS[-1]}"
+
+
+def tag(span=None, account=None, transaction_type=None, amount=None):
+    """Tag ``span`` (the current span by default) with banking attributes."""
+    span = span or trace.get_current_span()
+    if not span.is_recording():
+        return
+    if account is not None:
+        span.set_attribute('bank.account_no', account.account_no)
+    if transaction_type is not None:
+        span.set_attribute('bank.transaction_type', transaction_type)
+    if amount is not None:
+        span.set_attribute('bank.amount_bucket', amount_bucket(amount))
+
+
+def traced(name):
+    """Run the decorated function in its own span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _query_span(execute, sql, params, many, context):
+    if not trace.get_current_span().is_recording():
+        return execute(sql, params, many, context)
+    connection = context['connection']
+    with tracer.start_as_current_span(sql.split(None, 1)[0].upper(), kind=trace.SpanKind.CLIENT) as span:
+        span.set_attribute('db.system', connection.vendor)
+        span.set_attribute('db.name', connection.alias)
+        span.set_attribute('db.statement', sql[:MAX_STATEMENT_LENGTH])
+        return execute(sql, params, many, context)
+
+
+def trace_queries():
+    """Give every query run inside the block its own span."""
+    return observe_queries(_query_span)
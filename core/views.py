@@ -1,8 +1,63 @@
-from django.shortcuts import render
+import os
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse,Http404,HttpResponse,HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views import View
 from django.views.generic import TemplateView
 
+from . import metrics
+from .mixins import arender
+from .profiling import recent_profiles,profile_path,top_functions
+
 # Create your views here.
 
 
-class HomeView(TemplateView):
-    template_name = 'index.html'
\ No newline at end of file
+class HomeView(View):
+    template_name = 'index.html'
+    query_budget = 4
+    page_cache_timeout = 300
+
+    async def get(self, request):
+        return await arender(request, self.template_name)
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class ProfileListView(TemplateView):
+    template_name = 'admin/profiles.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        profiles = recent_profiles(limit=100)
+        selected = self.request.GET.get('name') or (profiles[0]['name'] if profiles else None)
+        if selected and not os.path.exists(profile_path(selected, '.prof')):
+            raise Http404("No such profile")
+        context.update({
+            'title': 'Request profiles',
+            'profiles': profiles,
+            'selected': selected,
+            'top_functions': top_functions(selected, settings.PROFILING_TOP_N) if selected else [],
+        })
+        return context
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class ProfileDownloadView(View):
+    def get(self, request, name, kind):
+        path = profile_path(name, '.' + kind)
+        if not os.path.exists(path):
+            raise Http404("No such profile")
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
+
+
+def metrics_view(request):
+    allowed = (
+        settings.METRICS_TOKEN
+        and constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}")
+    ) or request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS or request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    body, content_type = metrics.exposition()
+    return HttpResponse(body, content_type=content_type)
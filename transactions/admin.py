@@ -1,6 +1,13 @@
+import time
+
 from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import transaction
+from .constants import LOAN
 from .models import Transaction
 from .views import send_transaction_email
+from . import ledger
+from core.mail import build_email,queue_emails
 
 
 @admin.register(Transaction)
@@ -12,13 +19,18 @@ class TransactionAdmin(admin.ModelAdmin):
         'transaction_type',
         'loan_approve',
     ]
+    # `account` in list_display would otherwise load each row's account separately
+    list_select_related = ['account']
+    # set by the ledger when a loan is approved and repaid
+    readonly_fields = ['approved_at', 'repaid_at']
+    actions = ['approve_selected_loans']
 
+    @transaction.atomic
     def save_model(self, request, obj, form, change):
 
-        if obj.loan_approve:
-            obj.account.balance += obj.amount
-            obj.balance_after_transaction = obj.account.balance
-            obj.account.save()
+        if obj.loan_approve and (not change or 'loan_approve' in form.changed_data):
+            # credits the account and saves the loan
+            ledger.approve_loan(obj)
             # Send email notification for loan approval
             send_transaction_email(
                 obj.account.user,
@@ -26,4 +38,38 @@ class TransactionAdmin(admin.ModelAdmin):
                 "Loan Approval Message",
                 'transactions/loan_approval_email.html'
             )
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        elif not change and obj.transaction_type == LOAN:
+            # a pending loan, counted in pending_loan_requests like one
+            # requested on the site; staff may go over the loan limit
+            record = ledger.request_loan(obj.account, obj.amount, check_limit=False)
+            obj.pk = record.pk
+            obj.timestamp = record.timestamp
+            obj.balance_after_transaction = record.balance_after_transaction
+        else:
+            super().save_model(request, obj, form, change)
+
+    @admin.action(description="Approve selected loans")
+    def approve_selected_loans(self, request, queryset):
+        started = time.perf_counter()
+        with transaction.atomic():
+            loans = ledger.approve_loans(queryset)
+
+            users = User.objects.in_bulk({loan.account.user_id for loan in loans})
+            for loan in loans:
+                loan.account.user = users[loan.account.user_id]
+            queue_emails([
+                build_email(
+                    "Loan Approval Message",
+                    loan.account.user.email,
+                    'transactions/loan_approval_email.html',
+                    {'user': loan.account.user, 'amount': loan.amount},
+                )
+                for loan in loans
+            ])
+        elapsed = time.perf_counter() - started
+
+        self.message_user(
+            request,
+            f"Approved {len(loans)} of {queryset.count()} selected rows in {elapsed:.2f}s "
+            f"({len(loans) / elapsed:.0f} loans/s). Rows that were not pending loans were skipped.",
+        )
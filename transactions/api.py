@@ -0,0 +1,131 @@
+"""
+JSON API for deposit, withdraw, transfer and loan request.
+
+Requests are authenticated with the session (and so need the CSRF token,
+in the X-CSRFToken header) and send a JSON object, e.g. ``{"amount": "250"}``
+or ``{"recipient_account_number": 1000042, "amount": "10.50"}``. Validation is
+the HTML forms'. Every endpoint accepts an ``Idempotency-Key`` header; see
+transactions.idempotency.
+"""
+import json
+
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+
+from accounts.models import UserBankAccount
+from . import ledger
+from .constants import DEPOSIT,WITHDRAWAL,LOAN
+from .forms import DepositForm,LoanRequestForm,WithdrawForm,TransferMoneyForm
+from .idempotency import idempotent
+from .views import send_transaction_email,send_moneytransfer_email
+
+
+def error_response(errors, status=400):
+    return JsonResponse({'errors': errors}, status=status)
+
+
+def serialize(record):
+    return {
+        'id': record.pk,
+        'transaction_type': record.get_transaction_type_display(),
+        'amount': f"{record.amount:.2f}",
+        'balance_after_transaction': f"{record.balance_after_transaction:.2f}",
+        'timestamp': record.timestamp.isoformat(),
+    }
+
+
+@method_decorator(idempotent, name='post')
+class TransactionApiView(View):
+    """Validates the body with ``form_class``, then calls ``perform``."""
+    http_method_names = ['post']
+    # an Idempotency-Key costs about five queries of these
+    query_budget = 20
+    form_class = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return error_response({'__all__': ["Authentication required."]}, status=401)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_form(self, data):
+        return self.form_class(data, account=self.request.user.account)
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return error_response({'__all__': ["The body must be a JSON object."]})
+        if not isinstance(data, dict):
+            return error_response({'__all__': ["The body must be a JSON object."]})
+
+        form = self.get_form(data)
+        if not form.is_valid():
+            return error_response({field: list(errors) for field, errors in form.errors.items()})
+        try:
+            with transaction.atomic():
+                result = self.perform(form.cleaned_data)
+        except UserBankAccount.DoesNotExist:
+            return error_response({'recipient_account_number': ["Recipient account not found."]})
+        except ledger.LedgerError as e:
+            return error_response({'__all__': [str(e)]})
+        result['balance'] = str(request.user.account.balance)
+        return JsonResponse(result, status=201)
+
+    def perform(self, cleaned_data):
+        raise NotImplementedError
+
+
+class ModelFormApiView(TransactionApiView):
+    transaction_type = None
+
+    def get_form(self, data):
+        return self.form_class(data, account=self.request.user.account,
+                               initial={'transaction_type': self.transaction_type})
+
+
+class DepositApiView(ModelFormApiView):
+    form_class = DepositForm
+    transaction_type = DEPOSIT
+
+    def perform(self, cleaned_data):
+        record = ledger.deposit(self.request.user.account, cleaned_data['amount'])
+        send_transaction_email(self.request.user, cleaned_data['amount'], "Deposit Message", 'transactions/deposit_email.html')
+        return {'transaction': serialize(record)}
+
+
+class WithdrawApiView(ModelFormApiView):
+    form_class = WithdrawForm
+    transaction_type = WITHDRAWAL
+
+    def perform(self, cleaned_data):
+        record = ledger.withdraw(self.request.user.account, cleaned_data['amount'])
+        send_transaction_email(self.request.user, cleaned_data['amount'], "Withdrawal Message", 'transactions/withdraw_email.html')
+        return {'transaction': serialize(record)}
+
+
+class LoanRequestApiView(ModelFormApiView):
+    form_class = LoanRequestForm
+    transaction_type = LOAN
+
+    def perform(self, cleaned_data):
+        record = ledger.request_loan(self.request.user.account, cleaned_data['amount'])
+        send_transaction_email(self.request.user, cleaned_data['amount'], "Loan Request Message", 'transactions/loan_request_email.html')
+        return {'transaction': serialize(record)}
+
+
+class TransferApiView(TransactionApiView):
+    form_class = TransferMoneyForm
+    query_budget = 25
+
+    def perform(self, cleaned_data):
+        user = self.request.user
+        recipient, sent, received = ledger.transfer(
+            user.account, cleaned_data['recipient_account_number'], cleaned_data['amount'],
+        )
+        send_moneytransfer_email(
+            user, recipient.user, recipient.account_no, cleaned_data['amount'], "Money Transfer Message",
+            'transactions/transfer_email_sender.html', 'transactions/transfer_email_reciver.html',
+        )
+        return {'transaction': serialize(sent)}
@@ -0,0 +1,196 @@
+"""
+Cold storage for old transactions.
+
+``manage.py archive_transactions`` moves every transaction older than a
+cutoff month, except loans (the ledger still rewrites LOAN rows, and the
+snapshot backfill needs the approval and repayment times of LOAN and
+LOAN_PAID ones), out of the Transaction table into one ArchivedSegment per account
+per month: the rows as gzipped CSV plus a summary. The account's
+``archived_until`` date then says how far back the hot table is complete.
+
+Reads stay transparent. When a statement reaches back before
+``archived_until``, the report and the export merge the hot rows with the
+archived ones in ``(timestamp, id)`` order; a segment is one row read and
+one decompression, and only the segments a page needs are opened. Archived
+rows keep their ids, so keyset cursors work across both. Ranges after
+``archived_until`` never touch the archive. The daily snapshots are left in
+place, so range summaries do not need it either.
+"""
+import csv
+import gzip
+import heapq
+import io
+from datetime import datetime, time
+from decimal import Decimal
+from itertools import groupby
+
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.cache import invalidate
+from accounts.models import UserBankAccount
+from .constants import BALANCE_SIGN,LOAN,LOAN_PAID
+from .export import EXPORT_FIELDS
+from .ledger import lock_accounts
+from .models import ArchivedSegment,Transaction
+
+# a segment stores whole rows, in the export's column order
+FIELDS = EXPORT_FIELDS
+
+
+def encode(rows):
+    """``(CSV, gzipped CSV)`` bytes of ``FIELDS`` tuples."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for id, timestamp, transaction_type, amount, balance, loan_approve in rows:
+        writer.writerow([id, timestamp.isoformat(), transaction_type, amount, balance, int(loan_approve)])
+    raw = buffer.getvalue().encode()
+    return raw, gzip.compress(raw, compresslevel=9, mtime=0)
+
+
+def decode(data):
+    """The ``FIELDS`` tuples of a segment, in ``(timestamp, id)`` order."""
+    text = gzip.decompress(bytes(data)).decode()
+    return [
+        (int(id), datetime.fromisoformat(timestamp), int(transaction_type),
+         Decimal(amount), Decimal(balance), loan_approve == '1')
+        for id, timestamp, transaction_type, amount, balance, loan_approve in csv.reader(io.StringIO(text))
+    ]
+
+
+def row_key(row):
+    return row[1], row[0]
+
+
+def month_of(timestamp):
+    return timezone.localdate(timestamp).replace(day=1)
+
+
+def covers(account, start=None):
+    """Whether a statement from ``start`` (or the beginning) reaches into the archive."""
+    if account.archived_until is None:
+        return False
+    return start is None or timezone.localdate(start) < account.archived_until
+
+
+def _segments(account, start=None, end=None, after=None, before=None, using=None):
+    segments = ArchivedSegment.objects.db_manager(using).filter(account=account)
+    if start is not None:
+        segments = segments.filter(last_timestamp__gte=start)
+    if end is not None:
+        segments = segments.filter(first_timestamp__lt=end)
+    if before is not None:
+        return segments.filter(first_timestamp__lte=before[0]).order_by('-month')
+    if after is not None:
+        segments = segments.filter(last_timestamp__gte=after[0])
+    return segments.order_by('month')
+
+
+def _page_rows(segment, start, end, after, before):
+    rows = [
+        row for row in decode(segment.data)
+        if (start is None or row[1] >= start) and (end is None or row[1] < end)
+        and (after is None or row_key(row) > after) and (before is None or row_key(row) < before)
+    ]
+    return rows[::-1] if before is not None else rows
+
+
+def _as_transaction(account, row):
+    id, timestamp, transaction_type, amount, balance, loan_approve = row
+    return Transaction(
+        id=id, account=account, timestamp=timestamp, transaction_type=transaction_type,
+        amount=amount, balance_after_transaction=balance, loan_approve=loan_approve,
+    )
+
+
+def archived_page(account, limit, start=None, end=None, after=None, before=None):
+    """
+    Up to ``limit`` archived transactions of ``account`` in ``[start, end)``
+    after or before a keyset cursor, in page order (newest first with
+    ``before``), as unsaved Transaction instances.
+    """
+    rows = []
+    # months do not overlap, so once a segment fills the page later ones cannot improve it
+    for segment in _segments(account, start, end, after, before).iterator(chunk_size=8):
+        rows += _page_rows(segment, start, end, after, before)
+        if len(rows) >= limit:
+            break
+    return [_as_transaction(account, row) for row in rows[:limit]]
+
+
+async def aarchived_page(account, limit, start=None, end=None, after=None, before=None):
+    """Async version of ``archived_page``."""
+    rows = []
+    async for segment in _segments(account, start, end, after, before).aiterator(chunk_size=8):
+        rows += _page_rows(segment, start, end, after, before)
+        if len(rows) >= limit:
+            break
+    return [_as_transaction(account, row) for row in rows[:limit]]
+
+
+def archived_rows(account, start=None, end=None, using=None):
+    """Every archived ``FIELDS`` tuple of ``account`` in ``[start, end)``, oldest first, read lazily."""
+    for segment in _segments(account, start, end, using=using).iterator(chunk_size=8):
+        for row in decode(segment.data):
+            if (start is None or row[1] >= start) and (end is None or row[1] < end):
+                yield row
+
+
+def merge(archived, hot):
+    """Merge two ``(timestamp, id)``-ordered streams of ``FIELDS`` tuples."""
+    return heapq.merge(archived, hot, key=row_key)
+
+
+def archive_account(account_id, cutoff, batch_size=1000):
+    """
+    Move the account's transactions before ``cutoff`` (the first day of a
+    month), loans excepted, into segments. A month that already has a
+    segment gets its new rows merged into it. Returns ``(rows, segments, raw bytes, stored bytes)``.
+    """
+    cutoff_at = datetime.combine(cutoff, time.min, tzinfo=timezone.get_current_timezone())
+    with transaction.atomic():
+        # the ledger cannot touch the account while its rows move
+        account = lock_accounts(pk=account_id)[account_id]
+        rows = list(
+            Transaction.objects.filter(account_id=account_id, timestamp__lt=cutoff_at)
+            .exclude(transaction_type__in=[LOAN, LOAN_PAID])
+            .order_by('timestamp', 'id')
+            .values_list(*FIELDS)
+        )
+        if not rows:
+            return 0, 0, 0, 0
+
+        by_month = {month: list(month_rows) for month, month_rows in groupby(rows, key=lambda row: month_of(row[1]))}
+        existing = {
+            segment.month: segment
+            for segment in ArchivedSegment.objects.filter(account_id=account_id, month__in=list(by_month))
+        }
+        created, updated = [], []
+        raw_size = stored_size = 0
+        for month, month_rows in by_month.items():
+            segment = existing.get(month) or ArchivedSegment(account_id=account_id, month=month)
+            if segment.pk:
+                month_rows = list(merge(decode(segment.data), month_rows))
+            first, last = month_rows[0], month_rows[-1]
+            raw, segment.data = encode(month_rows)
+            segment.row_count = len(month_rows)
+            segment.first_timestamp = first[1]
+            segment.last_timestamp = last[1]
+            segment.opening_balance = first[4] - BALANCE_SIGN[first[2]] * first[3]
+            segment.closing_balance = last[4]
+            (updated if segment.pk else created).append(segment)
+            raw_size += len(raw)
+            stored_size += len(segment.data)
+
+        ArchivedSegment.objects.bulk_create(created, batch_size=batch_size)
+        ArchivedSegment.objects.bulk_update(
+            updated, ['row_count', 'first_timestamp', 'last_timestamp', 'opening_balance', 'closing_balance', 'data'],
+            batch_size=batch_size,
+        )
+        ids = [row[0] for row in rows]
+        for start in range(0, len(ids), batch_size):
+            Transaction.objects.filter(pk__in=ids[start:start + batch_size]).delete()
+        if account.archived_until is None or account.archived_until < cutoff:
+            UserBankAccount.objects.filter(pk=account_id).update(archived_until=cutoff)
+        invalidate(account.user_id)
+    return len(rows), len(by_month), raw_size, stored_size
@@ -0,0 +1,90 @@
+"""
+Parsing of batch transfer (payroll) files.
+
+A batch is a list of ``(account_no, amount)`` lines, uploaded as CSV (an
+optional ``account_no,amount`` header, then one pair per row) or posted as
+JSON (``[{"account_no": ..., "amount": ...}, ...]``, or the same list under
+``"transfers"``). Parsing never stops at the first bad line: every problem
+is reported with its line number, and nothing is applied unless there are
+none. Checks that need the database (recipient exists, enough balance)
+happen in ``ledger.transfer_batch``.
+"""
+import csv
+import io
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+TransferLine = namedtuple('TransferLine', ['line', 'account_no', 'amount'])
+
+HEADER = ['account_no', 'amount']
+
+
+def _parse(line, account_no, amount):
+    """``(TransferLine, None)`` or ``(None, error message)``."""
+    try:
+        account_no = int(str(account_no).strip())
+    except (TypeError, ValueError):
+        return None, f"'{account_no}' is not an account number."
+    try:
+        amount = Decimal(str(amount).strip())
+    except (InvalidOperation, ValueError):
+        return None, f"'{amount}' is not an amount."
+    if not amount.is_finite() or amount <= 0:
+        return None, "Transfer amount must be greater than zero."
+    if amount.as_tuple().exponent < -2:
+        return None, "Amounts can have at most two decimal places."
+    if amount >= 10 ** 10:
+        return None, "Amount is too large."
+    return TransferLine(line, account_no, amount), None
+
+
+def _check_size(lines, errors):
+    if not lines and not errors:
+        errors.append((None, "The batch is empty."))
+    elif len(lines) + len(errors) > settings.BATCH_TRANSFER_MAX_LINES:
+        # refused outright, without checking the lines against the database
+        return [], [(None, f"A batch can have at most {settings.BATCH_TRANSFER_MAX_LINES} lines.")]
+    return lines, errors
+
+
+def parse_csv(text):
+    """Return ``(lines, errors)``; ``errors`` is a list of ``(line number, message)``."""
+    lines, errors = [], []
+    reader = csv.reader(io.StringIO(text))
+    for row in reader:
+        row = [cell.strip() for cell in row]
+        if not any(row):
+            continue
+        if reader.line_num == 1 and [cell.lower() for cell in row] == HEADER:
+            continue
+        if len(row) != 2:
+            errors.append((reader.line_num, "Expected two columns: account_no,amount."))
+            continue
+        parsed, error = _parse(reader.line_num, *row)
+        if error:
+            errors.append((reader.line_num, error))
+        else:
+            lines.append(parsed)
+    return _check_size(lines, errors)
+
+
+def parse_json(data):
+    """Like ``parse_csv`` for already decoded JSON; lines count from 1."""
+    if isinstance(data, dict):
+        data = data.get('transfers')
+    if not isinstance(data, list):
+        return [], [(None, "Expected a list of {\"account_no\": ..., \"amount\": ...} objects.")]
+
+    lines, errors = [], []
+    for number, item in enumerate(data, 1):
+        if not isinstance(item, dict) or 'account_no' not in item or 'amount' not in item:
+            errors.append((number, "Expected an object with account_no and amount."))
+            continue
+        parsed, error = _parse(number, item['account_no'], item['amount'])
+        if error:
+            errors.append((number, error))
+        else:
+            lines.append(parsed)
+    return _check_size(lines, errors)
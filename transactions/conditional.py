@@ -0,0 +1,87 @@
+"""
+Conditional GET for the statement pages (report, loan list and export).
+
+The ETag is built from the id of the account's latest transaction plus
+the balance and loan counters on the account row. Every ledger operation
+either adds a transaction or moves those totals (approving or repaying a
+loan rewrites an existing row, but always changes the balance and
+``active_loans``), so the validator changes whenever anything the pages
+show can. ``archived_until`` is in it as well: archiving
+(transactions.archive) can move the latest transaction out of the table,
+and the ETag must not fall back to one an older state had. Looking it up is one query that reads a single entry of
+txn_account_timestamp_idx; the account row already comes from the account
+cache.
+
+The ETag also covers the view, the query string and the name shown in the
+navbar. A request with flash messages waiting is never answered with 304,
+otherwise the messages would not be shown until the statement changes.
+
+There is no Last-Modified: approving or repaying a loan changes the page
+without adding a newer transaction, so If-Modified-Since would get a 304
+for a stale copy.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+
+from .ledger import ACCOUNT_TOTALS
+from .models import Transaction
+
+
+class Validators:
+    def __init__(self, etag):
+        self.etag = etag
+
+    def apply(self, response):
+        response.headers.setdefault('ETag', self.etag)
+        # per user, and always revalidated: the point is a cheap refresh, not a stale page
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
+def latest_transaction(account):
+    """The id of the account's newest transaction, or ``None``."""
+    return (
+        Transaction.objects.filter(account=account)
+        .order_by('-timestamp', '-id')
+        .values_list('id', flat=True)
+        .first()
+    )
+
+
+def statement_validators(request, account):
+    latest = latest_transaction(account)
+    parts = [
+        settings.STATEMENT_ETAG_VERSION,
+        request.resolver_match.url_name,
+        account.pk,
+        request.user.first_name,
+        latest or 0,
+        *(getattr(account, field) for field in ACCOUNT_TOTALS),
+        account.archived_until,
+        sorted(request.GET.lists()),
+    ]
+    return Validators(quote_etag(hashlib.sha1(repr(parts).encode()).hexdigest()))
+
+
+def not_modified(request, account):
+    """
+    Return ``(response, validators)``: a 304 response if the client's copy
+    is still current, else ``None`` and the validators to put on the full
+    response with ``validators.apply(response)``.
+    """
+    validators = statement_validators(request, account)
+    if len(get_messages(request)):
+        return None, validators
+    response = get_conditional_response(request, etag=validators.etag)
+    if response is not None:
+        validators.apply(response)
+    return response, validators
+
+
+anot_modified = sync_to_async(not_modified)
@@ -12,4 +12,24 @@ TRANSACTION_TYPE = (
     (LOAN_PAID, "Loan Paid"),
     (TRANSFER_SENT, "Transfer Sent"),
     (TRANSFER_RECEIVED, "Transfer Received"),
-)
\ No newline at end of file
+)
+
+# +1 if the transaction type credits the account, -1 if it debits it
+BALANCE_SIGN = {
+    DEPOSIT: 1,
+    WITHDRAWAL: -1,
+    LOAN: 1,
+    LOAN_PAID: -1,
+    TRANSFER_SENT: -1,
+    TRANSFER_RECEIVED: 1,
+}
+
+# DailyBalanceSnapshot column holding the day's total for each type
+SNAPSHOT_TOTAL_FIELDS = {
+    DEPOSIT: 'deposits',
+    WITHDRAWAL: 'withdrawals',
+    LOAN: 'loans',
+    LOAN_PAID: 'loan_payments',
+    TRANSFER_SENT: 'transfers_sent',
+    TRANSFER_RECEIVED: 'transfers_received',
+}
@@ -0,0 +1,312 @@
+"""
+Synthetic customers and transaction histories for load testing.
+
+``generate`` builds the whole dataset in NumPy arrays, seeded so the same
+arguments always give the same data:
+
+* every account opens with a DEPOSIT just before the history starts, then
+  gets a Poisson number of events whose rate is skewed across accounts (a
+  few busy accounts, a long quiet tail), at business-hours-weighted times;
+* amounts are log-normal per type; each TRANSFER_SENT gets its
+  TRANSFER_RECEIVED twin on another account at the same moment;
+* loans are pending, approved or repaid (LOAN_PAID), with at most
+  MAX_ACTIVE_LOANS approved ones left per account; approved loans are
+  credited when requested (``approved_at``) and repaid ones paid back up to
+  90 days later (``repaid_at``);
+* balances are a running sum of those changes per account (pending loans
+  leave the balance alone), ``balance_after_transaction`` is the balance
+  after a row's last change as the ledger leaves it, and the opening
+  deposit is sized so the balance never goes negative.
+
+The account balances and loan counters, and the DailyBalanceSnapshot rows,
+are derived from the same arrays, so reports and the reconcile commands
+agree with the generated history. ``load`` writes rows with ``executemany``,
+or ``COPY`` on PostgreSQL.
+"""
+import csv
+import io
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .constants import BALANCE_SIGN,DEPOSIT,WITHDRAWAL,LOAN,LOAN_PAID,TRANSFER_SENT,TRANSFER_RECEIVED,SNAPSHOT_TOTAL_FIELDS
+
+HOUR_US = 3600 * 10 ** 6
+DAY_US = 24 * HOUR_US
+
+# event kinds of the --mix option and what each one writes
+KINDS = {'deposit': DEPOSIT, 'withdrawal': WITHDRAWAL, 'loan': LOAN, 'transfer': TRANSFER_SENT}
+DEFAULT_MIX = {'deposit': 40, 'withdrawal': 30, 'loan': 4, 'transfer': 26}
+# (median $, sigma) of the log-normal amount of each kind
+AMOUNTS = {DEPOSIT: (300, 1.0), WITHDRAWAL: (150, 0.9), LOAN: (2000, 0.7), TRANSFER_SENT: (80, 1.1)}
+# relative activity per hour of the day, busiest around noon
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 12, 14, 15, 16, 16, 15, 14, 13, 12, 11, 10, 8, 6, 4, 3, 2]
+GENDERS = ['Male', 'Female']
+ACCOUNT_TYPES = ['Savings', 'Current']
+CITIES = ['Dhaka', 'Chattogram', 'Khulna', 'Rajshahi', 'Sylhet', 'Barishal', 'Rangpur', 'Mymensingh']
+
+
+class Dataset:
+    """
+    The generated rows as parallel arrays. Transactions are sorted by
+    account and time; accounts are numbered from 0. Money is in cents and
+    times in microseconds since the epoch.
+    """
+
+    def __init__(self, **arrays):
+        self.__dict__.update(arrays)
+
+    @property
+    def size(self):
+        return len(self.txn_account)
+
+
+def _timestamps(rng, size, start_us, end_us):
+    days = (end_us - start_us) // DAY_US + 1
+    weights = np.array(HOUR_WEIGHTS, dtype=float)
+    hours = rng.choice(24, size=size, p=weights / weights.sum())
+    timestamps = (start_us + rng.integers(0, days, size) * DAY_US
+                  + hours * HOUR_US + rng.integers(0, HOUR_US, size))
+    # the last day is only partly over
+    return np.where(timestamps > end_us, timestamps - DAY_US, timestamps)
+
+
+def _amounts(rng, kinds):
+    cents = np.zeros(len(kinds), dtype=np.int64)
+    for kind, (median, sigma) in AMOUNTS.items():
+        mask = kinds == kind
+        dollars = rng.lognormal(np.log(median), sigma, int(mask.sum()))
+        if kind == LOAN:
+            dollars = np.round(dollars / 50) * 50
+        cents[mask] = np.clip(np.round(dollars * 100), 100, 10 ** 8)
+    return cents
+
+
+def _segments(keys):
+    """Start index and length of each run of equal values in sorted ``keys``."""
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+    return starts, np.diff(np.r_[starts, len(keys)])
+
+
+def local_days(timestamps):
+    """Days since the epoch in TIME_ZONE, as ``timezone.localdate`` would give them."""
+    tz = timezone.get_current_timezone()
+    hours, inverse = np.unique(timestamps // HOUR_US, return_inverse=True)
+    offsets = np.array([
+        datetime.fromtimestamp(int(hour) * 3600, dt_timezone.utc).astimezone(tz).utcoffset() // timedelta(microseconds=1)
+        for hour in hours
+    ], dtype=np.int64)
+    return (timestamps + offsets[inverse]) // DAY_US
+
+
+def generate(accounts, per_account, days, mix=None, approved=0.7, repaid=0.3, seed=0, end=None):
+    """
+    ``per_account`` is the mean number of transactions per account, not
+    counting the opening deposit; ``mix`` maps the KINDS to relative weights.
+    """
+    if accounts < 2:
+        raise ValueError("Transfers need at least two accounts.")
+    rng = np.random.default_rng(seed)
+    mix = mix or DEFAULT_MIX
+    weights = np.array([mix.get(kind, 0) for kind in KINDS], dtype=float)
+    weights /= weights.sum()
+
+    end = end or timezone.now()
+    end_us = int(end.timestamp() * 10 ** 6)
+    start = timezone.localtime(end - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    start_us = int(start.timestamp() * 10 ** 6)
+
+    # every transfer writes two rows, so fewer events than rows
+    events_per_account = per_account / (1 + weights[list(KINDS).index('transfer')])
+    activity = rng.lognormal(0, 1, accounts)
+    counts = rng.poisson(activity / activity.mean() * events_per_account)
+    account = np.repeat(np.arange(accounts, dtype=np.int64), counts)
+    kinds = np.array(list(KINDS.values()), dtype=np.int8)[rng.choice(len(KINDS), size=len(account), p=weights)]
+    timestamps = _timestamps(rng, len(account), start_us, end_us)
+    cents = _amounts(rng, kinds)
+    approve = np.zeros(len(account), dtype=bool)
+    loans = kinds == LOAN
+    approve[loans] = rng.random(int(loans.sum())) < approved
+    kinds[approve & (rng.random(len(account)) < repaid)] = LOAN_PAID
+
+    sent = kinds == TRANSFER_SENT
+    recipients = (account[sent] + rng.integers(1, accounts, int(sent.sum()))) % accounts
+    opening_times = start_us - rng.integers(1, 30 * DAY_US, accounts)
+    account = np.concatenate([np.arange(accounts), account, recipients])
+    kinds = np.concatenate([np.full(accounts, DEPOSIT, dtype=np.int8), kinds,
+                            np.full(len(recipients), TRANSFER_RECEIVED, dtype=np.int8)])
+    timestamps = np.concatenate([opening_times, timestamps, timestamps[sent]])
+    cents = np.concatenate([np.zeros(accounts, dtype=np.int64), cents, cents[sent]])
+    approve = np.concatenate([np.zeros(accounts, dtype=bool), approve, np.zeros(len(recipients), dtype=bool)])
+
+    order = np.lexsort((timestamps, account))
+    account, kinds, timestamps, cents, approve = (
+        account[order], kinds[order], timestamps[order], cents[order], approve[order]
+    )
+    starts, lengths = _segments(account)
+
+    # repay the oldest approved loans of accounts left with too many
+    active = (kinds == LOAN) & approve
+    seen = np.cumsum(active)
+    totals = seen[starts + lengths - 1] - np.r_[0, seen[starts[1:] - 1]]
+    from_latest = np.repeat(totals, lengths) - (seen - np.repeat(seen[starts] - active[starts], lengths)) + 1
+    kinds[active & (from_latest > settings.MAX_ACTIVE_LOANS)] = LOAN_PAID
+
+    paid = kinds == LOAN_PAID
+    approved_at = np.where(approve, timestamps, -1)
+    repaid_at = np.where(paid, np.minimum(timestamps + rng.integers(HOUR_US, 90 * DAY_US, len(account)), end_us), -1)
+
+    # the balance changes: one per row at its timestamp (a repaid loan's is
+    # its credit, a pending loan's is zero) and one per repayment
+    signs = np.zeros(max(BALANCE_SIGN) + 1, dtype=np.int64)
+    for kind, sign in BALANCE_SIGN.items():
+        signs[kind] = sign
+    event_row = np.r_[np.arange(len(account)), np.flatnonzero(paid)]
+    event_kind = np.r_[np.where(paid, LOAN, kinds), np.full(int(paid.sum()), LOAN_PAID)].astype(np.int8)
+    event_time = np.r_[timestamps, repaid_at[paid]]
+    counted = (event_kind != LOAN) | approve[event_row]
+    # stable, so a repayment at its request time still comes after the credit
+    order = np.lexsort((event_time, account[event_row]))
+    event_row, event_kind, event_time, counted = event_row[order], event_kind[order], event_time[order], counted[order]
+    event_account = account[event_row]
+    event_cents = cents[event_row]
+    delta = np.where(counted, event_cents * signs[event_kind], 0)
+    event_starts, event_lengths = _segments(event_account)
+
+    # running balance per account, starting from an empty opening deposit,
+    # which is every account's first change
+    running = np.cumsum(delta)
+    balance = running - np.repeat(running[event_starts] - delta[event_starts], event_lengths)
+    lowest = np.minimum.reduceat(balance, event_starts)
+    opening = -np.minimum(lowest, 0) + np.round(rng.lognormal(np.log(1000), 1, accounts) * 100).astype(np.int64)
+    cents[starts] = opening
+    event_cents[event_starts] = opening
+    delta[event_starts] = opening
+    balance += np.repeat(opening, event_lengths)
+
+    row_balance = np.empty(len(account), dtype=np.int64)
+    repayments = event_kind == LOAN_PAID
+    row_balance[event_row[~repayments]] = balance[~repayments]
+    row_balance[event_row[repayments]] = balance[repayments]
+
+    active = (kinds == LOAN) & approve
+    pending = (kinds == LOAN) & ~approve
+    dataset = Dataset(
+        accounts=accounts,
+        opened=opening_times,
+        balance=balance[event_starts + event_lengths - 1],
+        active_loans=np.bincount(account[active], minlength=accounts),
+        pending_loan_requests=np.bincount(account[pending], minlength=accounts),
+        outstanding_loan_principal=np.bincount(account[active], weights=cents[active], minlength=accounts).astype(np.int64),
+        txn_account=account,
+        txn_type=kinds,
+        txn_timestamp=timestamps,
+        txn_amount=cents,
+        txn_balance=row_balance,
+        txn_approve=approve,
+        txn_approved_at=approved_at,
+        txn_repaid_at=repaid_at,
+    )
+    _snapshots(dataset, event_account[counted], event_kind[counted], event_cents[counted],
+               delta[counted], balance[counted], event_time[counted])
+    _customers(rng, dataset)
+    return dataset
+
+
+def _customers(rng, dataset):
+    size = dataset.accounts
+    dataset.gender = rng.integers(0, len(GENDERS), size)
+    dataset.account_type = rng.integers(0, len(ACCOUNT_TYPES), size)
+    dataset.city = rng.integers(0, len(CITIES), size)
+    dataset.postal_code = rng.integers(1000, 9500, size)
+    first, last = np.datetime64('1950-01-01', 'D').astype(np.int64), np.datetime64('2005-12-31', 'D').astype(np.int64)
+    dataset.birth_day = rng.integers(first, last + 1, size)
+
+
+def _snapshots(dataset, account, kinds, cents, delta, balance, timestamps):
+    """
+    One DailyBalanceSnapshot per account and local day, as the ledger keeps
+    them, from the balance changes and the balance after each.
+    """
+    day = local_days(timestamps)
+    # changes are in time order per account, so each account-day is one run
+    starts, lengths = _segments(account * 10 ** 6 + day)
+    ends = starts + lengths - 1
+    dataset.snap_account = account[starts]
+    dataset.snap_day = day[starts]
+    dataset.snap_opening = balance[starts] - delta[starts]
+    dataset.snap_closing = balance[ends]
+    dataset.snap_count = lengths
+    dataset.snap_totals = {
+        field: np.add.reduceat(np.where(kinds == kind, cents, 0), starts)
+        for kind, field in SNAPSHOT_TOTAL_FIELDS.items()
+    }
+
+
+def datetimes(microseconds):
+    """Naive UTC ``YYYY-MM-DD HH:MM:SS.ffffff`` strings, as Django writes them."""
+    return np.char.replace(np.datetime_as_string(microseconds.astype('datetime64[us]'), unit='us'), 'T', ' ').tolist()
+
+
+def optional_datetimes(microseconds):
+    """``datetimes``, with None where ``microseconds`` is -1."""
+    values = datetimes(np.maximum(microseconds, 0))
+    return [None if missing else value for value, missing in zip(values, (microseconds < 0).tolist())]
+
+
+def dates(days):
+    return np.datetime_as_string(days.astype('datetime64[D]'), unit='D').tolist()
+
+
+def money(cents):
+    # cents / 100 is the double closest to the two-place decimal, and its
+    # repr() is that decimal, so the values go through SQL unchanged
+    return (cents / 100).tolist()
+
+
+def rows(size, columns, batch_size):
+    """
+    Tuples from parallel ``columns``, converted a batch at a time. A column
+    is an array, or a function of ``(start, stop)`` returning a sequence.
+    """
+    for start in range(0, size, batch_size):
+        stop = min(start + batch_size, size)
+        yield from zip(*[
+            column(start, stop) if callable(column) else column[start:stop].tolist()
+            for column in columns
+        ])
+
+
+def load(connection, model, fields, rows, batch_size):
+    """Insert ``rows`` (tuples in ``fields`` order) into ``model``'s table."""
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = ', '.join(qn(model._meta.get_field(name).column) for name in fields)
+    rows = iter(rows)
+    count = 0
+    with connection.cursor() as cursor:
+        while batch := list(islice(rows, batch_size)):
+            if connection.vendor == 'postgresql':
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                _copy(cursor.cursor, f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            else:
+                cursor.executemany(
+                    f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(fields))})", batch,
+                )
+            count += len(batch)
+    return count
+
+
+def _copy(cursor, sql, buffer):
+    if hasattr(cursor, 'copy_expert'):
+        # psycopg2
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+    else:
+        with cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
@@ -0,0 +1,73 @@
+"""
+Streaming statement serializers.
+
+Rows are pulled from the database in chunks and written out as they arrive,
+so an export holds one chunk in memory no matter how long the history is.
+"""
+import csv
+import json
+import zlib
+
+from .constants import TRANSACTION_TYPE
+
+EXPORT_FIELDS = ['id', 'timestamp', 'transaction_type', 'amount', 'balance_after_transaction', 'loan_approve']
+TRANSACTION_TYPE_LABELS = dict(TRANSACTION_TYPE)
+
+
+class Echo:
+    """File-like object whose write() hands the line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def _serialize(row):
+    record = dict(zip(EXPORT_FIELDS, row))
+    record['timestamp'] = record['timestamp'].isoformat()
+    record['transaction_type'] = TRANSACTION_TYPE_LABELS.get(record['transaction_type'], '')
+    record['amount'] = str(record['amount'])
+    record['balance_after_transaction'] = str(record['balance_after_transaction'])
+    return record
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(_serialize(row).values())
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(_serialize(row)) + '\n'
+
+
+def encode(lines, buffer_size=64 * 1024):
+    """Join lines into ~``buffer_size`` byte chunks instead of one write per row."""
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_stream(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
@@ -63,6 +63,23 @@ class LoanRequestForm(TransactionForm):
         return amount
     
 
+class BatchTransferForm(forms.Form):
+    lines = forms.CharField(widget=forms.Textarea, required=False)
+    file = forms.FileField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('file')
+        if upload:
+            try:
+                cleaned_data['lines'] = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                raise forms.ValidationError("The file must be a UTF-8 encoded CSV.")
+        if not cleaned_data.get('lines', '').strip():
+            raise forms.ValidationError("Enter the transfers or upload a CSV file.")
+        return cleaned_data
+
+
 class TransferMoneyForm(forms.Form):
     recipient_account_number = forms.IntegerField(label="Recipient Account Number")
     amount = forms.DecimalField(decimal_places=2, max_digits=12, label="Transfer Amount")
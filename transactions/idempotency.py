@@ -0,0 +1,195 @@
+"""
+Idempotency keys for the requests that move money.
+
+A client sends ``Idempotency-Key: <unique string>`` (forms send an
+``idempotency_key`` field instead) and may then retry the request as often
+as it likes: the first one runs, every later one with the same key gets the
+first one's response back without validating anything or touching a
+balance.
+
+The key is claimed by inserting its IdempotencyKey row in the same database
+transaction as the operation itself, and the response is written to that
+row before it commits. So either the operation and its stored response are
+both committed or neither is, and a concurrent duplicate blocks on the
+unique constraint until the first one finishes. Responses of 500 and above
+are not kept, so those requests can be retried for real.
+
+Finished responses are also kept in a per-process LRU (IDEMPOTENCY_LRU_SIZE
+entries), so a retry that lands on the same worker needs no query at all.
+Keys expire after IDEMPOTENCY_KEY_TTL seconds.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+# headers worth replaying; cookies and the like belong to the original request
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+
+
+class StoredResponse:
+    def __init__(self, fingerprint, status_code, headers, body, expires_at):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.headers = headers
+        self.body = bytes(body)
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.fingerprint, row.status_code, row.headers, row.body, row.expires_at)
+
+    def response(self):
+        response = HttpResponse(self.body, status=self.status_code)
+        for header, value in self.headers.items():
+            response[header] = value
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+class ResponseLRU:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, cache_key):
+        with self.lock:
+            stored = self.entries.get(cache_key)
+            if stored is None:
+                return None
+            if stored.expires_at <= timezone.now():
+                del self.entries[cache_key]
+                return None
+            self.entries.move_to_end(cache_key)
+            return stored
+
+    def put(self, cache_key, stored):
+        with self.lock:
+            self.entries[cache_key] = stored
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+responses = ResponseLRU(settings.IDEMPOTENCY_LRU_SIZE)
+
+
+def fingerprint(request):
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    if request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        # the CSRF token is re-masked on every page render; leave it out
+        # so a resubmitted form still matches
+        digest.update(repr(sorted(
+            (name, values) for name, values in request.POST.lists() if name != 'csrfmiddlewaretoken'
+        )).encode())
+        for name, upload in sorted(request.FILES.items()):
+            digest.update(name.encode())
+            for chunk in upload.chunks():
+                digest.update(chunk)
+            upload.seek(0)
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def lookup(user_id, key):
+    """The finished response stored for the key, from the LRU or the primary."""
+    stored = responses.get((user_id, key))
+    if stored is not None:
+        return stored
+    row = (
+        IdempotencyKey.objects.db_manager('default')
+        .filter(user_id=user_id, key=key, expires_at__gt=timezone.now(), status_code__isnull=False)
+        .first()
+    )
+    if row is None:
+        return None
+    stored = StoredResponse.from_row(row)
+    responses.put((user_id, key), stored)
+    return stored
+
+
+def _replay(stored, request):
+    if stored.fingerprint != fingerprint(request):
+        return JsonResponse({'errors': {'__all__': [
+            f"This {HEADER} was already used for a different request."
+        ]}}, status=422)
+    return stored.response()
+
+
+def _claim(user_id, key, request):
+    """The new IdempotencyKey row, or None if a concurrent request with the key got there first."""
+    now = timezone.now()
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user_id=user_id,
+                    key=key,
+                    fingerprint=fingerprint(request),
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                )
+        except IntegrityError:
+            # an expired row for the same key blocks the insert: drop it and try once more
+            if attempt or not IdempotencyKey.objects.filter(user_id=user_id, key=key, expires_at__lte=now).delete()[0]:
+                return None
+
+
+def idempotent(view):
+    """
+    Decorator for views (or, through method_decorator, ``post`` methods)
+    that move money. Requests without a key, or from anonymous users, run as
+    usual.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER) or request.POST.get(FIELD)
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return JsonResponse({'errors': {'__all__': [f"{HEADER} can be at most 255 characters."]}}, status=400)
+
+        user_id = request.user.pk
+        stored = lookup(user_id, key)
+        if stored is not None:
+            return _replay(stored, request)
+
+        with transaction.atomic():
+            row = _claim(user_id, key, request)
+            if row is not None:
+                response = view(request, *args, **kwargs)
+                if response.status_code >= 500 or getattr(response, 'streaming', False):
+                    transaction.set_rollback(True)
+                    return response
+                if hasattr(response, 'render'):
+                    # a TemplateResponse, such as a form sent back with its errors
+                    response.render()
+                row.status_code = response.status_code
+                row.headers = {header: response[header] for header in REPLAYED_HEADERS if response.has_header(header)}
+                row.body = response.content
+                row.save(update_fields=['status_code', 'headers', 'body'])
+                transaction.on_commit(lambda: responses.put((user_id, key), StoredResponse.from_row(row)))
+                return response
+
+        stored = lookup(user_id, key)
+        if stored is None:
+            return JsonResponse({'errors': {'__all__': [
+                f"A request with this {HEADER} is still being processed."
+            ]}}, status=409)
+        return _replay(stored, request)
+    return wrapper
@@ -0,0 +1,378 @@
+"""
+Every change to an account balance goes through this module.
+
+Each operation runs in one atomic block, locks the accounts it touches with
+``select_for_update`` (always in ``account_no`` order, so two transfers going
+opposite ways cannot deadlock) and moves the balance with an ``F()`` update
+instead of saving the whole row. Today's DailyBalanceSnapshot row is kept
+up to date under the same lock.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from accounts.cache import invalidate
+from core.metrics import count_operation
+from core.tracing import tag,traced
+from .constants import DEPOSIT,WITHDRAWAL,LOAN,LOAN_PAID,TRANSFER_SENT,TRANSFER_RECEIVED
+from .models import Transaction
+from . import snapshots
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class AccountBankrupt(LedgerError):
+    pass
+
+
+class InvalidLoan(LedgerError):
+    pass
+
+
+class LoanLimitExceeded(LedgerError):
+    pass
+
+
+class BatchTransferError(LedgerError):
+    """A batch transfer was refused; ``errors`` lists ``(line number or None, message)``."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} lines of the batch were refused")
+        self.errors = errors
+
+
+# balance plus the denormalized loan counters, all kept on UserBankAccount
+ACCOUNT_TOTALS = ['balance', 'active_loans', 'pending_loan_requests', 'outstanding_loan_principal']
+
+
+def lock_accounts(*args, **filters):
+    accounts = UserBankAccount.objects.select_for_update().filter(*args, **filters).order_by('account_no')
+    return {account.pk: account for account in accounts}
+
+
+def _lock_account(account):
+    return lock_accounts(pk=account.pk)[account.pk]
+
+
+def _adjust(account, **deltas):
+    UserBankAccount.objects.filter(pk=account.pk).update(**{
+        field: F(field) + delta for field, delta in deltas.items()
+    })
+    # the row is locked, so the new values can be worked out here
+    for field, delta in deltas.items():
+        setattr(account, field, getattr(account, field) + delta)
+    invalidate(account.user_id)
+
+
+def _copy_totals(target, source):
+    for field in ACCOUNT_TOTALS:
+        setattr(target, field, getattr(source, field))
+
+
+@traced('ledger.deposit')
+def deposit(account, amount):
+    tag(account=account, transaction_type=DEPOSIT, amount=amount)
+    with transaction.atomic():
+        locked = _lock_account(account)
+        _adjust(locked, balance=amount)
+        snapshots.record(locked, DEPOSIT, amount)
+        count_operation('deposit', amount)
+        record = Transaction.objects.create(
+            account=locked,
+            amount=amount,
+            balance_after_transaction=locked.balance,
+            transaction_type=DEPOSIT,
+        )
+    _copy_totals(account, locked)
+    return record
+
+
+@traced('ledger.withdraw')
+def withdraw(account, amount):
+    tag(account=account, transaction_type=WITHDRAWAL, amount=amount)
+    with transaction.atomic():
+        locked = _lock_account(account)
+        if locked.is_bankrupt:
+            raise AccountBankrupt("You are bankrupt and cannot withdraw money.")
+        if amount > locked.balance:
+            raise InsufficientFunds(
+                f'You have {locked.balance} $ in your Account.'
+                'You Can not withdraw more then your Account Balance.'
+            )
+        _adjust(locked, balance=-amount)
+        snapshots.record(locked, WITHDRAWAL, amount)
+        count_operation('withdrawal', amount)
+        record = Transaction.objects.create(
+            account=locked,
+            amount=amount,
+            balance_after_transaction=locked.balance,
+            transaction_type=WITHDRAWAL,
+        )
+    _copy_totals(account, locked)
+    return record
+
+
+@traced('ledger.transfer')
+def transfer(sender, recipient_account_no, amount):
+    """
+    Move ``amount`` from ``sender`` to the account numbered
+    ``recipient_account_no``. Returns ``(recipient, sent, received)``.
+    """
+    tag(account=sender, transaction_type=TRANSFER_SENT, amount=amount)
+    with transaction.atomic():
+        accounts = lock_accounts(Q(pk=sender.pk) | Q(account_no=recipient_account_no))
+        locked_sender = accounts[sender.pk]
+        recipient = next((a for a in accounts.values() if a.account_no == recipient_account_no), None)
+        if recipient is None:
+            raise UserBankAccount.DoesNotExist("Recipient account not found.")
+        if recipient.pk == locked_sender.pk:
+            raise LedgerError("You cannot transfer money to your own account.")
+        if amount > locked_sender.balance:
+            raise InsufficientFunds("Insufficient balance for this transfer.")
+
+        _adjust(locked_sender, balance=-amount)
+        _adjust(recipient, balance=amount)
+        snapshots.record(locked_sender, TRANSFER_SENT, amount)
+        snapshots.record(recipient, TRANSFER_RECEIVED, amount)
+        count_operation('transfer', amount)
+        sent, received = Transaction.objects.bulk_create([
+            Transaction(
+                account=locked_sender,
+                amount=amount,
+                balance_after_transaction=locked_sender.balance,
+                transaction_type=TRANSFER_SENT,
+            ),
+            Transaction(
+                account=recipient,
+                amount=amount,
+                balance_after_transaction=recipient.balance,
+                transaction_type=TRANSFER_RECEIVED,
+            ),
+        ])
+    _copy_totals(sender, locked_sender)
+    return recipient, sent, received
+
+
+@traced('ledger.transfer_batch')
+def transfer_batch(sender, lines, errors=(), batch_size=1000):
+    """
+    Pay every ``batch.TransferLine`` in ``lines`` from ``sender`` as one
+    operation: one query locks and checks all the recipients, one UPDATE per
+    ``batch_size`` recipients moves the money and a single ``bulk_create``
+    writes the TRANSFER_SENT / TRANSFER_RECEIVED pairs. Either every line is
+    applied or, with BatchTransferError listing every bad line, none is.
+    ``errors`` are problems already found while parsing the batch; they are
+    reported together with these checks. Returns ``(recipients by account number, sent, received)``.
+    """
+    total = sum(line.amount for line in lines)
+    tag(account=sender, transaction_type=TRANSFER_SENT, amount=total)
+    with transaction.atomic():
+        accounts = lock_accounts(Q(pk=sender.pk) | Q(account_no__in={line.account_no for line in lines}))
+        locked_sender = accounts[sender.pk]
+        by_number = {account.account_no: account for account in accounts.values()}
+
+        errors = list(errors)
+        for line in lines:
+            if line.account_no == locked_sender.account_no:
+                errors.append((line.line, "You cannot transfer money to your own account."))
+            elif line.account_no not in by_number:
+                errors.append((line.line, f"Recipient account {line.account_no} not found."))
+        if total > locked_sender.balance:
+            errors.append((None, f"The batch totals {total} $ but the balance is {locked_sender.balance} $."))
+        if errors:
+            raise BatchTransferError(sorted(errors, key=lambda error: (error[0] is None, error[0] or 0)))
+
+        credited = {}
+        counts = Counter()
+        for line in lines:
+            recipient = by_number[line.account_no]
+            credited[recipient.pk] = credited.get(recipient.pk, 0) + line.amount
+            counts[recipient.pk] += 1
+
+        _adjust(locked_sender, balance=-total)
+        account_ids = list(credited)
+        for start in range(0, len(account_ids), batch_size):
+            chunk = account_ids[start:start + batch_size]
+            UserBankAccount.objects.filter(pk__in=chunk).update(
+                balance=F('balance') + _per_account(chunk, credited, DecimalField(decimal_places=2, max_digits=12)),
+            )
+
+        # running balances, line by line, for balance_after_transaction
+        sender_balance = locked_sender.balance + total
+        records = []
+        for line in lines:
+            recipient = by_number[line.account_no]
+            sender_balance -= line.amount
+            recipient.balance += line.amount
+            records.append(Transaction(
+                account=locked_sender,
+                amount=line.amount,
+                balance_after_transaction=sender_balance,
+                transaction_type=TRANSFER_SENT,
+            ))
+            records.append(Transaction(
+                account=recipient,
+                amount=line.amount,
+                balance_after_transaction=recipient.balance,
+                transaction_type=TRANSFER_RECEIVED,
+            ))
+        records = Transaction.objects.bulk_create(records)
+
+        snapshots.record(locked_sender, TRANSFER_SENT, total, count=len(lines))
+        snapshots.record_many(
+            [(accounts[pk], amount, counts[pk]) for pk, amount in credited.items()], TRANSFER_RECEIVED,
+        )
+        for pk in credited:
+            invalidate(accounts[pk].user_id)
+        count_operation('transfer', total, count=len(lines))
+    _copy_totals(sender, locked_sender)
+    recipients = {accounts[pk].account_no: accounts[pk] for pk in credited}
+    return recipients, records[0::2], records[1::2]
+
+
+@traced('ledger.request_loan')
+def request_loan(account, amount, check_limit=True):
+    """Record a pending loan request, enforcing the active loan limit unless told not to."""
+    tag(account=account, transaction_type=LOAN, amount=amount)
+    with transaction.atomic():
+        locked = _lock_account(account)
+        if check_limit and locked.active_loans >= settings.MAX_ACTIVE_LOANS:
+            raise LoanLimitExceeded(f"You have crossed the limit of {settings.MAX_ACTIVE_LOANS} loans")
+        _adjust(locked, pending_loan_requests=1)
+        count_operation('loan_request', amount)
+        record = Transaction.objects.create(
+            account=locked,
+            amount=amount,
+            balance_after_transaction=locked.balance,
+            transaction_type=LOAN,
+        )
+    _copy_totals(account, locked)
+    return record
+
+
+@traced('ledger.approve_loan')
+def approve_loan(loan):
+    """Credit a loan to its account and save it as approved."""
+    tag(account=loan.account, transaction_type=LOAN, amount=loan.amount)
+    with transaction.atomic():
+        locked = _lock_account(loan.account)
+        previous = None
+        if loan.pk:
+            previous = Transaction.objects.select_for_update().filter(pk=loan.pk).values_list(
+                'transaction_type', 'loan_approve'
+            ).first()
+        if previous and previous[1]:
+            raise InvalidLoan("This loan has already been approved.")
+
+        counters = {}
+        if loan.transaction_type == LOAN:
+            counters = {'active_loans': 1, 'outstanding_loan_principal': loan.amount}
+            if previous == (LOAN, False):
+                counters['pending_loan_requests'] = -1
+        _adjust(locked, balance=loan.amount, **counters)
+        loan.approved_at = timezone.now()
+        snapshots.record(locked, LOAN, loan.amount, when=loan.approved_at)
+        count_operation('loan_approval', loan.amount)
+        loan.loan_approve = True
+        loan.balance_after_transaction = locked.balance
+        loan.save()
+    _copy_totals(loan.account, locked)
+    return loan
+
+
+def _per_account(pks, values, output_field):
+    return Case(*[When(pk=pk, then=Value(values[pk])) for pk in pks], output_field=output_field)
+
+
+@traced('ledger.approve_loans')
+def approve_loans(queryset, batch_size=1000):
+    """
+    Approve every pending loan in ``queryset`` as one batch: one UPDATE per
+    ``batch_size`` accounts for the balances and one per ``batch_size``
+    loans to mark them approved. Returns the approved loans, each with its
+    locked account attached.
+    """
+    with transaction.atomic():
+        pending = Transaction.objects.filter(
+            pk__in=queryset.values('pk'),
+            transaction_type=LOAN,
+            loan_approve=False,
+        )
+        accounts = lock_accounts(pk__in=pending.values('account_id'))
+        loans = list(pending.select_for_update().order_by('account_id', 'timestamp', 'id'))
+
+        credited = {}
+        now = timezone.now()
+        for loan in loans:
+            account = accounts[loan.account_id]
+            account.balance += loan.amount
+            account.active_loans += 1
+            account.pending_loan_requests -= 1
+            account.outstanding_loan_principal += loan.amount
+            credited[account.pk] = credited.get(account.pk, 0) + loan.amount
+            loan.account = account
+            loan.loan_approve = True
+            loan.approved_at = now
+            loan.balance_after_transaction = account.balance
+
+        counts = Counter(loan.account_id for loan in loans)
+        account_ids = list(credited)
+        for start in range(0, len(account_ids), batch_size):
+            chunk = account_ids[start:start + batch_size]
+            UserBankAccount.objects.filter(pk__in=chunk).update(
+                balance=F('balance') + _per_account(chunk, credited, DecimalField(decimal_places=2, max_digits=12)),
+                outstanding_loan_principal=F('outstanding_loan_principal') + _per_account(chunk, credited, DecimalField(decimal_places=2, max_digits=12)),
+                active_loans=F('active_loans') + _per_account(chunk, counts, IntegerField()),
+                pending_loan_requests=F('pending_loan_requests') - _per_account(chunk, counts, IntegerField()),
+            )
+        Transaction.objects.bulk_update(
+            loans, ['loan_approve', 'approved_at', 'balance_after_transaction'], batch_size=batch_size,
+        )
+
+        snapshots.record_many(
+            [(accounts[pk], amount, counts[pk]) for pk, amount in credited.items()], LOAN, when=now,
+        )
+        for pk in credited:
+            invalidate(accounts[pk].user_id)
+        count_operation('loan_approval', sum(credited.values()), count=len(loans))
+    return loans
+
+
+@traced('ledger.repay_loan')
+def repay_loan(loan):
+    tag(account=loan.account, transaction_type=LOAN_PAID, amount=loan.amount)
+    with transaction.atomic():
+        locked = _lock_account(loan.account)
+        current = Transaction.objects.select_for_update().get(pk=loan.pk)
+        if not current.loan_approve or current.transaction_type != LOAN:
+            raise InvalidLoan("This loan is not outstanding.")
+        if not current.amount < locked.balance:
+            raise InsufficientFunds("Loan amount is greater than available balance")
+        _adjust(
+            locked,
+            balance=-current.amount,
+            active_loans=-1,
+            outstanding_loan_principal=-current.amount,
+        )
+        loan.repaid_at = timezone.now()
+        snapshots.record(locked, LOAN_PAID, current.amount, when=loan.repaid_at)
+        count_operation('loan_repayment', current.amount)
+        loan.transaction_type = LOAN_PAID
+        loan.balance_after_transaction = locked.balance
+        Transaction.objects.filter(pk=loan.pk).update(
+            transaction_type=LOAN_PAID,
+            balance_after_transaction=locked.balance,
+            repaid_at=loan.repaid_at,
+        )
+    _copy_totals(loan.account, locked)
+    return loan
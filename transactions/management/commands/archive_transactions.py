@@ -0,0 +1,66 @@
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from transactions import archive
+from transactions.constants import LOAN,LOAN_PAID
+from transactions.models import Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Move transactions older than a cutoff month, loans excepted, into "
+        "compressed per-account monthly ArchivedSegment rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help="Archive the months before this date (YYYY-MM-DD); "
+                                             "default: TRANSACTION_ARCHIVE_AFTER_DAYS ago.")
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help="Only archive this account number (repeatable).")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Count what would be archived without moving anything.")
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                cutoff = datetime.strptime(options['before'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f"'{options['before']}' is not a YYYY-MM-DD date.")
+        else:
+            cutoff = timezone.localdate() - timedelta(days=settings.TRANSACTION_ARCHIVE_AFTER_DAYS)
+        # whole months only
+        cutoff = cutoff.replace(day=1)
+        cutoff_at = datetime.combine(cutoff, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+
+        candidates = Transaction.objects.filter(timestamp__lt=cutoff_at).exclude(transaction_type__in=[LOAN, LOAN_PAID])
+        if options['accounts']:
+            candidates = candidates.filter(account__in=UserBankAccount.objects.filter(account_no__in=options['accounts']))
+        if options['dry_run']:
+            rows = candidates.count()
+            accounts = candidates.values('account_id').distinct().count()
+            self.stdout.write(f"would archive {rows} transactions of {accounts} accounts from before {cutoff}")
+            return
+
+        started = time.perf_counter()
+        account_count = row_count = segment_count = raw_size = stored_size = 0
+        account_ids = list(candidates.order_by('account_id').values_list('account_id', flat=True).distinct())
+        for account_id in account_ids:
+            rows, segments, raw, stored = archive.archive_account(account_id, cutoff, options['batch_size'])
+            account_count += 1
+            row_count += rows
+            segment_count += segments
+            raw_size += raw
+            stored_size += stored
+
+        elapsed = time.perf_counter() - started
+        ratio = f", {raw_size / stored_size:.1f}x compression" if stored_size else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"archived {row_count} transactions of {account_count} accounts from before {cutoff} "
+            f"into {segment_count} segments ({stored_size} bytes{ratio}) in {elapsed:.1f}s"
+        ))
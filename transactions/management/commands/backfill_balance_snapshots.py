@@ -0,0 +1,91 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from transactions import archive
+from transactions.constants import BALANCE_SIGN,SNAPSHOT_TOTAL_FIELDS,LOAN,LOAN_PAID
+from transactions.ledger import lock_accounts
+from transactions.models import Transaction,DailyBalanceSnapshot
+
+
+class Command(BaseCommand):
+    help = "Rebuild DailyBalanceSnapshot rows from the transaction history, archived months included."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help="Only rebuild this account number (repeatable).")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        accounts = UserBankAccount.objects.order_by('pk')
+        if options['accounts']:
+            accounts = accounts.filter(account_no__in=options['accounts'])
+
+        started = time.perf_counter()
+        account_count = snapshot_count = 0
+        for account_id in accounts.values_list('pk', flat=True).iterator():
+            snapshot_count += self.rebuild(account_id, options['batch_size'])
+            account_count += 1
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{snapshot_count} snapshots for {account_count} accounts in {elapsed:.1f}s"
+        ))
+
+    def events(self, account_id):
+        """
+        ``(when, transaction_type, amount)`` of every balance change of the
+        account, in no particular order. A loan row keeps its request time,
+        so its credit is dated by ``approved_at`` and, once it is LOAN_PAID,
+        its repayment by ``repaid_at``; pending loans changed nothing.
+        """
+        rows = (
+            Transaction.objects.filter(account_id=account_id)
+            .exclude(transaction_type=LOAN, loan_approve=False)
+            .values_list('timestamp', 'transaction_type', 'amount', 'approved_at', 'repaid_at')
+        )
+        for timestamp, transaction_type, amount, approved_at, repaid_at in rows.iterator():
+            if transaction_type in (LOAN, LOAN_PAID):
+                # loans approved or repaid before those columns existed only have the request time
+                yield approved_at or timestamp, LOAN, amount
+                if transaction_type == LOAN_PAID:
+                    yield repaid_at or timestamp, LOAN_PAID, amount
+            else:
+                yield timestamp, transaction_type, amount
+        # archived months hold no loans
+        for _, timestamp, transaction_type, amount, _, _ in archive.archived_rows(account_id):
+            yield timestamp, transaction_type, amount
+
+    def rebuild(self, account_id, batch_size):
+        with transaction.atomic():
+            # hold the account lock so the ledger cannot write mid-rebuild
+            account = lock_accounts(pk=account_id)[account_id]
+            DailyBalanceSnapshot.objects.filter(account_id=account_id).delete()
+
+            days, changes = {}, {}
+            for when, transaction_type, amount in self.events(account_id):
+                if transaction_type not in SNAPSHOT_TOTAL_FIELDS:
+                    continue
+                date = timezone.localdate(when)
+                day = days.get(date)
+                if day is None:
+                    day = days[date] = DailyBalanceSnapshot(account_id=account_id, date=date)
+                    changes[date] = 0
+                field = SNAPSHOT_TOTAL_FIELDS[transaction_type]
+                setattr(day, field, getattr(day, field) + amount)
+                day.transaction_count += 1
+                changes[date] += BALANCE_SIGN[transaction_type] * amount
+
+            # balances are worked forward from what the account held before its first change
+            balance = account.balance - sum(changes.values())
+            snapshots = [days[date] for date in sorted(days)]
+            for day in snapshots:
+                day.opening_balance = balance
+                balance += changes[day.date]
+                day.closing_balance = balance
+
+            DailyBalanceSnapshot.objects.bulk_create(snapshots, batch_size=batch_size)
+        return len(snapshots)
@@ -0,0 +1,195 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from transactions.constants import DEPOSIT,WITHDRAWAL,LOAN,TRANSFER_SENT,TRANSFER_RECEIVED
+from transactions.models import Transaction
+
+ALIAS = 'index_benchmark'
+BEFORE_INDEXES = '0004_alter_transaction_transaction_type'
+TYPES = [DEPOSIT, WITHDRAWAL, LOAN, TRANSFER_SENT, TRANSFER_RECEIVED]
+WEIGHTS = [40, 30, 5, 13, 12]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a scratch SQLite database and compare EXPLAIN plans and timings of "
+        "the hot Transaction queries before and after the 0005 indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=2000)
+        parser.add_argument('--rows', type=int, default=500000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--sample', type=int, default=20,
+                            help="Number of accounts the queries are run for.")
+        parser.add_argument('--path', help="SQLite file to use (default: a temporary file).")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        path = options['path'] or os.path.join(tempfile.mkdtemp(), 'index_benchmark.sqlite3')
+        if os.path.exists(path):
+            os.remove(path)
+        connections.databases[ALIAS] = {
+            **connections['default'].settings_dict,
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': path,
+            'OPTIONS': {},
+        }
+        self.rng = random.Random(options['seed'])
+
+        try:
+            call_command('migrate', database=ALIAS, verbosity=0)
+            call_command('migrate', 'transactions', BEFORE_INDEXES, database=ALIAS, verbosity=0)
+
+            started = time.perf_counter()
+            account_ids = self.seed(options['accounts'], options['rows'])
+            self.stdout.write(f"seeded {options['rows']} transactions over {len(account_ids)} accounts "
+                              f"in {time.perf_counter() - started:.1f}s ({path})")
+            self.analyze()
+            sample = self.rng.sample(account_ids, min(options['sample'], len(account_ids)))
+
+            before = self.run_queries(self.old_queries(), sample, options['repeat'])
+
+            started = time.perf_counter()
+            call_command('migrate', database=ALIAS, verbosity=0)
+            self.analyze()
+            self.stdout.write(f"\napplied index migrations in {time.perf_counter() - started:.1f}s")
+
+            after = self.run_queries(self.new_queries(), sample, options['repeat'])
+        finally:
+            connections[ALIAS].close()
+
+        self.report(before, after)
+
+    def seed(self, account_count, row_count):
+        # Raw SQL against the 0004-era schema: rolling transactions back also
+        # unapplies later migrations elsewhere, so the current models may not
+        # match the tables at this point.
+        now = timezone.now()
+        joined = now.strftime('%Y-%m-%d %H:%M:%S.%f')
+        with transaction.atomic(using=ALIAS), connections[ALIAS].cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO auth_user (password, is_superuser, username, first_name, last_name, '
+                'email, is_staff, is_active, date_joined) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                [('!', False, f"bench{n}", '', '', '', False, True, joined) for n in range(account_count)],
+            )
+            cursor.execute("SELECT id FROM auth_user WHERE username LIKE 'bench%%'")
+            user_ids = [row[0] for row in cursor.fetchall()]
+            cursor.executemany(
+                'INSERT INTO accounts_userbankaccount (user_id, account_type, account_no, gender, '
+                'initial_deposite_date, balance, is_bankrupt) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                [(user_id, 'Savings', 1000000 + user_id, 'Male', now.date().isoformat(), 0, False) for user_id in user_ids],
+            )
+            cursor.execute('SELECT id FROM accounts_userbankaccount')
+            account_ids = [row[0] for row in cursor.fetchall()]
+
+        start = now - timedelta(days=730)
+        span = int((now - start).total_seconds())
+        sql = (
+            'INSERT INTO transactions_transaction '
+            '(account_id, amount, balance_after_transaction, transaction_type, timestamp, loan_approve) '
+            'VALUES (%s, %s, %s, %s, %s, %s)'
+        )
+        with transaction.atomic(using=ALIAS), connections[ALIAS].cursor() as cursor:
+            batch = []
+            for _ in range(row_count):
+                transaction_type = self.rng.choices(TYPES, WEIGHTS)[0]
+                timestamp = start + timedelta(seconds=self.rng.randrange(span))
+                batch.append((
+                    self.rng.choice(account_ids),
+                    Decimal(self.rng.randint(100, 5000)),
+                    Decimal(0),
+                    transaction_type,
+                    timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                    transaction_type == LOAN and self.rng.random() < 0.7,
+                ))
+                if len(batch) == 10000:
+                    cursor.executemany(sql, batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+        return account_ids
+
+    def analyze(self):
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def date_window(self):
+        end = timezone.now() - timedelta(days=self.rng.randrange(0, 600))
+        return end - timedelta(days=90), end
+
+    def old_queries(self):
+        txns = Transaction.objects.using(ALIAS)
+
+        def report(account_id):
+            start, end = self.date_window()
+            return txns.filter(
+                account_id=account_id,
+                timestamp__date__gte=start.date(),
+                timestamp__date__lte=end.date(),
+            ).distinct()
+
+        return {
+            'report (90 day range)': report,
+            'loan limit count': lambda account_id: txns.filter(account_id=account_id, transaction_type=LOAN, loan_approve=True),
+            'loan list': lambda account_id: txns.filter(account_id=account_id, transaction_type=LOAN),
+        }
+
+    def new_queries(self):
+        txns = Transaction.objects.using(ALIAS)
+        queries = self.old_queries()
+
+        def report(account_id):
+            # first keyset page, as TransactionReportView now fetches it
+            start, end = self.date_window()
+            return txns.filter(
+                account_id=account_id,
+                timestamp__gte=start,
+                timestamp__lt=end,
+            ).order_by('timestamp', 'id')[:settings.TRANSACTION_REPORT_PAGE_SIZE + 1]
+
+        queries['report (90 day range)'] = report
+        return queries
+
+    def run_queries(self, queries, sample, repeat):
+        results = {}
+        for label, build in queries.items():
+            timings = []
+            for _ in range(repeat):
+                for account_id in sample:
+                    queryset = build(account_id)
+                    started = time.perf_counter()
+                    if 'count' in label:
+                        queryset.count()
+                    else:
+                        list(queryset)
+                    timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[label] = {
+                'plan': build(sample[0]).explain(),
+                'median': statistics.median(timings),
+                'p95': timings[int(len(timings) * 0.95) - 1],
+            }
+        return results
+
+    def report(self, before, after):
+        for label in before:
+            self.stdout.write(f"\n== {label}")
+            for when, results in (('before', before), ('after', after)):
+                plan = results[label]['plan'].replace('\n', '\n' + ' ' * 10)
+                self.stdout.write(f"  {when + ':':<8}{plan}")
+            self.stdout.write(
+                f"  median {before[label]['median']:.2f}ms -> {after[label]['median']:.2f}ms, "
+                f"p95 {before[label]['p95']:.2f}ms -> {after[label]['p95']:.2f}ms"
+            )
@@ -0,0 +1,164 @@
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+
+from accounts.models import UserAddress,UserBankAccount
+from transactions.constants import SNAPSHOT_TOTAL_FIELDS
+from transactions.models import Transaction,DailyBalanceSnapshot
+
+try:
+    import numpy as np
+    from transactions import dataset
+except ImportError:
+    # NumPy is only needed here, not by the site
+    dataset = None
+
+
+def sliced(convert, array):
+    return lambda start, stop: convert(array[start:stop])
+
+
+def constant(value):
+    return lambda start, stop: [value] * (stop - start)
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in dataset.KINDS:
+            raise CommandError(f"Unknown kind '{kind}' in --mix; use {', '.join(dataset.KINDS)}.")
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise CommandError(f"'{weight}' is not a weight for {kind}.")
+    if sum(mix.values()) <= 0:
+        raise CommandError("--mix needs at least one positive weight.")
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic customers and a consistent transaction "
+        "history (balances, snapshots and loan counters included) for load testing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=10000)
+        parser.add_argument('--per-account', type=float, default=100,
+                            help="Mean number of transactions per account.")
+        parser.add_argument('--days', type=int, default=365, help="Length of the history.")
+        parser.add_argument('--mix', default='deposit=40,withdrawal=30,loan=4,transfer=26',
+                            help="Relative weights of deposit, withdrawal, loan and transfer.")
+        parser.add_argument('--approved', type=float, default=0.7, help="Share of loans approved.")
+        parser.add_argument('--repaid', type=float, default=0.3, help="Share of approved loans repaid.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='load', help="Usernames are <prefix><n>.")
+        parser.add_argument('--password', help="Password for every user (default: unusable).")
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if dataset is None:
+            raise CommandError("generate_dataset needs NumPy (pip install numpy).")
+        mix = parse_mix(options['mix'])
+        alias = options['database']
+        prefix = options['prefix']
+        if User.objects.using(alias).filter(username__startswith=prefix).exists():
+            raise CommandError(f"There are already users named {prefix}...; pick another --prefix.")
+
+        started = time.perf_counter()
+        try:
+            data = dataset.generate(
+                options['accounts'], options['per_account'], options['days'], mix,
+                approved=options['approved'], repaid=options['repaid'], seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"generated {data.size} transactions and {len(data.snap_account)} snapshots "
+            f"for {data.accounts} accounts in {time.perf_counter() - started:.1f}s"
+        )
+
+        started = time.perf_counter()
+        connection = connections[alias]
+        with transaction.atomic(using=alias):
+            total = self.load(connection, data, options)
+            # ids were given explicitly, so move the sequences past them
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, UserBankAccount]):
+                    cursor.execute(sql)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"loaded {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)"
+        ))
+
+    def load(self, connection, data, options):
+        alias, batch_size = options['database'], options['batch_size']
+        first_user = (User.objects.using(alias).aggregate(Max('id'))['id__max'] or 0) + 1
+        first_account = (UserBankAccount.objects.using(alias).aggregate(Max('id'))['id__max'] or 0) + 1
+        user_ids = np.arange(first_user, first_user + data.accounts)
+        account_ids = np.arange(first_account, first_account + data.accounts)
+        prefix = options['prefix']
+        # one hash for everyone: hashing each password would take longer than the load
+        password = make_password(options['password'])
+
+        def usernames(start, stop):
+            return [f"{prefix}{n}" for n in range(start, stop)]
+
+        def by_index(values, indexes):
+            return lambda start, stop: [values[i] for i in indexes[start:stop].tolist()]
+
+        tables = [
+            (User, ['id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+                    'is_staff', 'is_active', 'date_joined'], data.accounts, [
+                user_ids, constant(password), constant(False), usernames, constant('Customer'),
+                lambda start, stop: [str(n) for n in range(start, stop)],
+                lambda start, stop: [f"{prefix}{n}@example.com" for n in range(start, stop)],
+                constant(False), constant(True), sliced(dataset.datetimes, data.opened),
+            ]),
+            (UserBankAccount, ['id', 'user', 'account_type', 'account_no', 'birth_date', 'gender',
+                               'initial_deposite_date', 'balance', 'is_bankrupt', 'active_loans',
+                               'pending_loan_requests', 'outstanding_loan_principal'], data.accounts, [
+                account_ids, user_ids, by_index(dataset.ACCOUNT_TYPES, data.account_type), 1000000 + user_ids,
+                sliced(dataset.dates, data.birth_day), by_index(dataset.GENDERS, data.gender),
+                sliced(dataset.dates, dataset.local_days(data.opened)), sliced(dataset.money, data.balance),
+                constant(False), data.active_loans, data.pending_loan_requests,
+                sliced(dataset.money, data.outstanding_loan_principal),
+            ]),
+            (UserAddress, ['user', 'street_address', 'city', 'postal_code', 'country'], data.accounts, [
+                user_ids, lambda start, stop: [f"{n % 200 + 1} Road {n % 97 + 1}" for n in range(start, stop)],
+                by_index(dataset.CITIES, data.city), data.postal_code, constant('Bangladesh'),
+            ]),
+            (Transaction, ['account', 'amount', 'balance_after_transaction', 'transaction_type',
+                           'timestamp', 'loan_approve', 'approved_at', 'repaid_at'], data.size, [
+                account_ids[data.txn_account], sliced(dataset.money, data.txn_amount),
+                sliced(dataset.money, data.txn_balance), data.txn_type,
+                sliced(dataset.datetimes, data.txn_timestamp), data.txn_approve,
+                sliced(dataset.optional_datetimes, data.txn_approved_at),
+                sliced(dataset.optional_datetimes, data.txn_repaid_at),
+            ]),
+            (DailyBalanceSnapshot, ['account', 'date', 'opening_balance', 'closing_balance',
+                                    *SNAPSHOT_TOTAL_FIELDS.values(), 'transaction_count'], len(data.snap_account), [
+                account_ids[data.snap_account], sliced(dataset.dates, data.snap_day),
+                sliced(dataset.money, data.snap_opening), sliced(dataset.money, data.snap_closing),
+                *[sliced(dataset.money, data.snap_totals[field]) for field in SNAPSHOT_TOTAL_FIELDS.values()],
+                data.snap_count,
+            ]),
+        ]
+
+        total = 0
+        for model, fields, size, columns in tables:
+            started = time.perf_counter()
+            count = dataset.load(connection, model, fields, dataset.rows(size, columns, batch_size), batch_size)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"  {model._meta.db_table:<36}{count:>10} rows {elapsed:>7.1f}s "
+                              f"{count / elapsed if elapsed else 0:>9.0f} rows/s")
+            total += count
+        return total
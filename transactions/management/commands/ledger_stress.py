@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Sum
+
+from accounts.models import UserBankAccount
+from transactions import ledger
+from transactions.constants import BALANCE_SIGN
+from transactions.models import Transaction,DailyBalanceSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer the ledger with concurrent deposits, withdrawals and two-way "
+        "transfers between a small set of throwaway accounts, then check that "
+        "no update was lost."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=10)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=500,
+                            help="Operations per worker.")
+        parser.add_argument('--initial-balance', type=Decimal, default=Decimal('10000'))
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the generated accounts instead of deleting them.")
+
+    def handle(self, *args, **options):
+        if options['accounts'] < 2:
+            raise CommandError("--accounts must be at least 2")
+
+        prefix = f"ledger_stress_{uuid.uuid4().hex[:8]}"
+        accounts = self.create_accounts(prefix, options['accounts'], options['initial_balance'])
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.stdout.write(f"{len(accounts)} accounts, {options['workers']} workers x "
+                          f"{options['operations']} operations (seed {seed})")
+
+        totals = {'deposited': Decimal(0), 'withdrawn': Decimal(0), 'ok': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(n):
+            rng = random.Random(seed + n)
+            local = {'deposited': Decimal(0), 'withdrawn': Decimal(0), 'ok': 0, 'rejected': 0, 'errors': 0}
+            try:
+                for _ in range(options['operations']):
+                    account = rng.choice(accounts)
+                    amount = Decimal(rng.randint(1, 500))
+                    op = rng.random()
+                    try:
+                        if op < 0.2:
+                            ledger.deposit(account, amount)
+                            local['deposited'] += amount
+                        elif op < 0.4:
+                            ledger.withdraw(account, amount)
+                            local['withdrawn'] += amount
+                        else:
+                            other = rng.choice([a for a in accounts if a.pk != account.pk])
+                            ledger.transfer(account, other.account_no, amount)
+                        local['ok'] += 1
+                    except ledger.LedgerError:
+                        local['rejected'] += 1
+                    except Exception as e:
+                        local['errors'] += 1
+                        self.stderr.write(f"worker {n}: {e!r}")
+            finally:
+                connections.close_all()
+                with lock:
+                    for key, value in local.items():
+                        totals[key] += value
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['workers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            problems = self.verify(accounts, options['initial_balance'], totals)
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=prefix).delete()
+
+        operations = totals['ok'] + totals['rejected'] + totals['errors']
+        self.stdout.write(
+            f"{operations} operations in {elapsed:.2f}s ({operations / elapsed:.1f} ops/s): "
+            f"{totals['ok']} applied, {totals['rejected']} rejected, {totals['errors']} errors"
+        )
+        if problems or totals['errors']:
+            for problem in problems:
+                self.stderr.write(problem)
+            raise CommandError("ledger stress test failed")
+        self.stdout.write(self.style.SUCCESS("balances consistent"))
+
+    def create_accounts(self, prefix, count, balance):
+        accounts = []
+        for n in range(count):
+            user = User.objects.create_user(f"{prefix}_{n}", f"{prefix}_{n}@example.com")
+            accounts.append(UserBankAccount.objects.create(
+                user=user,
+                account_type="Savings",
+                gender="Male",
+                account_no=1000000 + user.id,
+                balance=balance,
+            ))
+        return accounts
+
+    def verify(self, accounts, initial_balance, totals):
+        problems = []
+        pks = [account.pk for account in accounts]
+
+        expected_total = initial_balance * len(accounts) + totals['deposited'] - totals['withdrawn']
+        actual_total = UserBankAccount.objects.filter(pk__in=pks).aggregate(total=Sum('balance'))['total']
+        if actual_total != expected_total:
+            problems.append(f"total balance is {actual_total}, expected {expected_total}")
+
+        balances = dict(UserBankAccount.objects.filter(pk__in=pks).values_list('pk', 'balance'))
+        running = {pk: initial_balance for pk in pks}
+        rows = Transaction.objects.filter(account_id__in=pks).order_by('id').values_list(
+            'id', 'account_id', 'amount', 'transaction_type', 'balance_after_transaction'
+        )
+        for txn_id, account_id, amount, transaction_type, balance_after in rows:
+            running[account_id] += BALANCE_SIGN[transaction_type] * amount
+            if running[account_id] != balance_after:
+                problems.append(f"transaction {txn_id}: balance_after is {balance_after}, "
+                                f"replayed balance is {running[account_id]}")
+        for pk in pks:
+            if running[pk] != balances[pk]:
+                problems.append(f"account {pk}: balance is {balances[pk]}, replayed {running[pk]}")
+            if balances[pk] < 0:
+                problems.append(f"account {pk} went negative: {balances[pk]}")
+
+        closing = DailyBalanceSnapshot.objects.filter(account_id__in=pks).order_by('date').values_list('account_id', 'closing_balance')
+        for account_id, closing_balance in dict(closing).items():
+            if closing_balance != balances[account_id]:
+                problems.append(f"account {account_id}: snapshot closes at {closing_balance}, "
+                                f"balance is {balances[account_id]}")
+        return problems
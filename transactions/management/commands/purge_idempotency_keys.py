@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from transactions.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys past their expiry, in batches (uses idempotency_expires_idx)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            batch = list(
+                IdempotencyKey.objects.filter(expires_at__lte=now)
+                .order_by('expires_at').values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f"deleted {deleted} expired idempotency keys"))
@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from accounts.cache import invalidate
+from accounts.models import UserBankAccount
+from transactions.constants import LOAN
+from transactions.ledger import lock_accounts
+from transactions.models import Transaction
+
+COUNTERS = ['active_loans', 'pending_loan_requests', 'outstanding_loan_principal']
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-account loan counters from the Transaction table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report drifted accounts without fixing them.")
+
+    def handle(self, *args, **options):
+        account_ids = list(UserBankAccount.objects.order_by('pk').values_list('pk', flat=True))
+        batch_size = options['batch_size']
+        checked = fixed = 0
+
+        for start in range(0, len(account_ids), batch_size):
+            chunk = account_ids[start:start + batch_size]
+            with transaction.atomic():
+                # the ledger cannot change these accounts while we count
+                accounts = lock_accounts(pk__in=chunk)
+                stats = {
+                    row['account_id']: row
+                    for row in Transaction.objects.filter(account_id__in=chunk, transaction_type=LOAN)
+                    .values('account_id')
+                    .annotate(
+                        active_loans=Count('id', filter=Q(loan_approve=True)),
+                        pending_loan_requests=Count('id', filter=Q(loan_approve=False)),
+                        outstanding_loan_principal=Sum('amount', filter=Q(loan_approve=True)),
+                    )
+                }
+
+                drifted = []
+                for account in accounts.values():
+                    row = stats.get(account.pk, {})
+                    expected = {
+                        'active_loans': row.get('active_loans', 0),
+                        'pending_loan_requests': row.get('pending_loan_requests', 0),
+                        'outstanding_loan_principal': row.get('outstanding_loan_principal') or Decimal(0),
+                    }
+                    actual = {field: getattr(account, field) for field in COUNTERS}
+                    if actual != expected:
+                        self.stdout.write(f"account {account.account_no}: {actual} -> {expected}")
+                        for field, value in expected.items():
+                            setattr(account, field, value)
+                        drifted.append(account)
+
+                if drifted and not options['dry_run']:
+                    UserBankAccount.objects.bulk_update(drifted, COUNTERS)
+                    for account in drifted:
+                        invalidate(account.user_id)
+            checked += len(accounts)
+            fixed += len(drifted)
+
+        verb = "would fix" if options['dry_run'] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"checked {checked} accounts, {verb} {fixed}"))
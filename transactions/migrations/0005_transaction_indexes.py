@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_userbankaccount_is_bankrupt'),
+        ('transactions', '0004_alter_transaction_transaction_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'timestamp', 'id'], name='txn_account_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('transaction_type', 3)), fields=['account', 'loan_approve'], name='txn_account_loan_idx'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='accounts.userbankaccount'),
+        ),
+    ]
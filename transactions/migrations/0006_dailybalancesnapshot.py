@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_userbankaccount_is_bankrupt'),
+        ('transactions', '0005_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('deposits', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('withdrawals', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('loans', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('loan_payments', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transfers_sent', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transfers_received', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_snapshots', to='accounts.userbankaccount')),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'date'), name='unique_account_snapshot_date')],
+            },
+        ),
+    ]
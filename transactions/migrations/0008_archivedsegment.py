@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_archived_until'),
+        ('transactions', '0007_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('row_count', models.PositiveIntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('data', models.BinaryField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_segments', to='accounts.userbankaccount')),
+            ],
+            options={
+                'ordering': ['month'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'month'), name='unique_account_archive_month')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_archivedsegment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='approved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='repaid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
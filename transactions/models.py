@@ -1,20 +1,117 @@
 from django.db import models
+from django.contrib.auth.models import User
 from accounts.models import UserBankAccount
-from .constants import TRANSACTION_TYPE
+from .constants import TRANSACTION_TYPE,LOAN
 # Create your models here.
 
 
 class Transaction(models.Model):
-    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='transactions')
+    # indexed through the leading column of txn_account_timestamp_idx
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='transactions', db_index=False)
     amount = models.DecimalField(decimal_places=2, max_digits=12)
     balance_after_transaction = models.DecimalField(decimal_places=2,max_digits=12)
     transaction_type = models.IntegerField(choices=TRANSACTION_TYPE,null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     loan_approve = models.BooleanField(default=False)
+    # when transactions.ledger credited and paid back a loan; the row keeps
+    # the request time, and backfill_balance_snapshots dates those changes by these
+    approved_at = models.DateTimeField(null=True, blank=True)
+    repaid_at = models.DateTimeField(null=True, blank=True)
 
 
     class Meta:
         ordering  = ['timestamp']
+        indexes = [
+            # statement pages: account + date range, keyset ordered by (timestamp, id)
+            models.Index(fields=['account', 'timestamp', 'id'], name='txn_account_timestamp_idx'),
+            # loan limit check and loan list only ever look at LOAN rows
+            models.Index(
+                fields=['account', 'loan_approve'],
+                condition=models.Q(transaction_type=LOAN),
+                name='txn_account_loan_idx',
+            ),
+        ]
 
 
+class DailyBalanceSnapshot(models.Model):
+    """
+    One row per account per day with activity: the balance before the day's
+    first transaction, after its last one, and the day's totals by type.
+    """
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='daily_snapshots')
+    date = models.DateField()
+    opening_balance = models.DecimalField(decimal_places=2, max_digits=12)
+    closing_balance = models.DecimalField(decimal_places=2, max_digits=12)
+    deposits = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    withdrawals = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    loans = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    loan_payments = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    transfers_sent = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    transfers_received = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    transaction_count = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='unique_account_snapshot_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.account} {self.date}"
+
+
+class ArchivedSegment(models.Model):
+    """
+    One month of an account's transactions, moved out of the Transaction
+    table by ``manage.py archive_transactions``. ``data`` holds the rows as
+    gzipped CSV (see transactions.archive); the other columns summarize
+    them so the segment can be found and skipped without opening it.
+    """
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='archived_segments')
+    # first day of the month, in TIME_ZONE
+    month = models.DateField()
+    row_count = models.PositiveIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    opening_balance = models.DecimalField(decimal_places=2, max_digits=12)
+    closing_balance = models.DecimalField(decimal_places=2, max_digits=12)
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ['month']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'month'], name='unique_account_archive_month'),
+        ]
+
+    def __str__(self):
+        return f"{self.account} {self.month:%Y-%m}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored response to a money-moving request sent with an
+    Idempotency-Key, so a retry gets the same answer instead of moving the
+    money twice. ``status_code`` is null while the first request is still
+    running. Rows past ``expires_at`` are ignored and deleted by
+    ``manage.py purge_idempotency_keys``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # hash of method, path and body: a key reused for another request is refused
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    headers = models.JSONField(default=dict)
+    body = models.BinaryField(default=bytes)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key}"
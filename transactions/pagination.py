@@ -0,0 +1,99 @@
+"""
+Keyset ("cursor") pagination over ``(timestamp, id)``.
+
+A page is fetched by seeking past the last row the client saw rather than by
+OFFSET, so page 500 costs the same as page 1 and rows inserted meanwhile do
+not shift the pages around.
+"""
+import base64
+import heapq
+from datetime import datetime
+from itertools import islice
+
+from django.db.models import Q
+
+
+def encode_cursor(row):
+    raw = f"{row.timestamp.isoformat()}|{row.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return ``(timestamp, pk)`` or ``None`` for a missing/garbled token."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, pk = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def _page_query(queryset, page_size, after=None, before=None):
+    if before is not None:
+        timestamp, pk = before
+        return (
+            queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+            .order_by('-timestamp', '-id')[:page_size + 1]
+        )
+    if after is not None:
+        timestamp, pk = after
+        queryset = queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+    return queryset.order_by('timestamp', 'id')[:page_size + 1]
+
+
+def _make_page(rows, page_size, after=None, before=None):
+    has_more = len(rows) > page_size
+    if before is not None:
+        rows = rows[:page_size][::-1]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1]) if rows else None,
+            previous_cursor=encode_cursor(rows[0]) if has_more else None,
+        )
+    rows = rows[:page_size]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if has_more else None,
+        previous_cursor=encode_cursor(rows[0]) if after is not None and rows else None,
+    )
+
+
+def _merge(rows, archived, page_size, before=None):
+    if not archived:
+        return rows
+    merged = heapq.merge(rows, archived, key=lambda row: (row.timestamp, row.pk), reverse=before is not None)
+    return list(islice(merged, page_size + 1))
+
+
+def keyset_paginate(queryset, page_size, after=None, before=None, archived=None):
+    """
+    Return one page of ``queryset`` in ``(timestamp, id)`` order, starting
+    right after the ``after`` cursor or ending right before ``before``.
+    ``archived`` are rows from outside the queryset (transactions.archive)
+    for the same page, in the same order as the query fetches them.
+    """
+    rows = list(_page_query(queryset, page_size, after, before))
+    return _make_page(_merge(rows, archived, page_size, before), page_size, after, before)
+
+
+async def akeyset_paginate(queryset, page_size, after=None, before=None, archived=None):
+    """Async version of ``keyset_paginate``."""
+    rows = [row async for row in _page_query(queryset, page_size, after, before).aiterator()]
+    return _make_page(_merge(rows, archived, page_size, before), page_size, after, before)
@@ -0,0 +1,122 @@
+"""
+Incremental maintenance of DailyBalanceSnapshot rows.
+
+The ledger calls ``record`` for every balance change while it still holds
+the account lock, so updating today's row never races another writer.
+Date-range reports then read a handful of snapshot rows instead of
+aggregating over the raw transaction table.
+"""
+from decimal import Decimal
+
+from django.db.models import F
+from django.utils import timezone
+
+from .constants import BALANCE_SIGN,SNAPSHOT_TOTAL_FIELDS
+from .models import DailyBalanceSnapshot
+
+
+def record(account, transaction_type, amount, when=None, count=1):
+    """
+    Fold a balance change into the account's snapshot for ``when`` (today by
+    default). ``account.balance`` must already include the change; ``amount``
+    may be the total of ``count`` transactions of the same type.
+    """
+    day = timezone.localdate(when)
+    field = SNAPSHOT_TOTAL_FIELDS[transaction_type]
+    updated = DailyBalanceSnapshot.objects.filter(account_id=account.pk, date=day).update(
+        closing_balance=account.balance,
+        transaction_count=F('transaction_count') + count,
+        **{field: F(field) + amount},
+    )
+    if not updated:
+        DailyBalanceSnapshot.objects.create(
+            account_id=account.pk,
+            date=day,
+            opening_balance=account.balance - BALANCE_SIGN[transaction_type] * amount,
+            closing_balance=account.balance,
+            transaction_count=count,
+            **{field: amount},
+        )
+
+
+def record_many(changes, transaction_type, when=None):
+    """
+    ``record`` for many accounts at once, in three queries however many there
+    are. ``changes`` is a list of ``(account, amount, count)``; each account
+    must be locked and its balance already include the change.
+    """
+    day = timezone.localdate(when)
+    field = SNAPSHOT_TOTAL_FIELDS[transaction_type]
+    existing = {
+        snapshot.account_id: snapshot
+        for snapshot in DailyBalanceSnapshot.objects.filter(
+            account_id__in=[account.pk for account, _, _ in changes], date=day,
+        )
+    }
+    updated, created = [], []
+    for account, amount, count in changes:
+        snapshot = existing.get(account.pk)
+        if snapshot is None:
+            created.append(DailyBalanceSnapshot(
+                account_id=account.pk,
+                date=day,
+                opening_balance=account.balance - BALANCE_SIGN[transaction_type] * amount,
+                closing_balance=account.balance,
+                transaction_count=count,
+                **{field: amount},
+            ))
+        else:
+            # the account lock covers its snapshot rows, so no F() needed
+            snapshot.closing_balance = account.balance
+            snapshot.transaction_count += count
+            setattr(snapshot, field, getattr(snapshot, field) + amount)
+            updated.append(snapshot)
+    if updated:
+        DailyBalanceSnapshot.objects.bulk_update(updated, ['closing_balance', 'transaction_count', field])
+    if created:
+        DailyBalanceSnapshot.objects.bulk_create(created)
+
+
+def _summarize(days, previous_close):
+    summary = {field: Decimal(0) for field in SNAPSHOT_TOTAL_FIELDS.values()}
+    summary['transaction_count'] = 0
+    for day in days:
+        for field in SNAPSHOT_TOTAL_FIELDS.values():
+            summary[field] += getattr(day, field)
+        summary['transaction_count'] += day.transaction_count
+
+    if days:
+        summary['opening_balance'] = days[0].opening_balance
+        summary['closing_balance'] = days[-1].closing_balance
+    else:
+        # no activity in the range: the balance is whatever it closed at before
+        summary['opening_balance'] = summary['closing_balance'] = previous_close or Decimal(0)
+    return summary
+
+
+def _days(account, start_date, end_date):
+    return DailyBalanceSnapshot.objects.filter(account=account, date__gte=start_date, date__lte=end_date)
+
+
+def _previous_close(account, start_date):
+    return (
+        DailyBalanceSnapshot.objects.filter(account=account, date__lt=start_date)
+        .order_by('-date').values_list('closing_balance', flat=True)
+    )
+
+
+def range_summary(account, start_date, end_date):
+    """
+    Opening/closing balance and per-type totals for ``account`` between two
+    dates (inclusive), read from the snapshot rows.
+    """
+    days = list(_days(account, start_date, end_date))
+    previous_close = None if days else _previous_close(account, start_date).first()
+    return _summarize(days, previous_close)
+
+
+async def arange_summary(account, start_date, end_date):
+    """Async version of ``range_summary``."""
+    days = [day async for day in _days(account, start_date, end_date).aiterator()]
+    previous_close = None if days else await _previous_close(account, start_date).afirst()
+    return _summarize(days, previous_close)
@@ -0,0 +1,17 @@
+import uuid
+
+from django import template
+from django.utils.html import format_html
+
+from transactions.idempotency import FIELD
+
+register = template.Library()
+
+
+@register.simple_tag
+def idempotency_field():
+    """
+    Hidden input with a fresh idempotency key, so submitting the rendered
+    form twice moves the money once.
+    """
+    return format_html('<input type="hidden" name="{}" value="{}">', FIELD, uuid.uuid4().hex)
@@ -1,3 +1,676 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock,skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connections
+from django.db.models import Q
+from django.test import TestCase,TransactionTestCase,override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from accounts.tests import make_customer
+from . import archive,ledger
+from .batch import TransferLine
+from .constants import BALANCE_SIGN,LOAN,LOAN_PAID,TRANSFER_SENT
+from .export import EXPORT_FIELDS
+from .idempotency import responses
+from .management.commands import generate_dataset
+from .models import DailyBalanceSnapshot,IdempotencyKey,Transaction
+from .pagination import decode_cursor,keyset_paginate
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        responses.clear()
+        self.user = make_customer('alice', 1000)
+        self.client.force_login(self.user)
+
+    def test_invalid_form_with_key_is_stored_and_replayed(self):
+        data = {'amount': '5', 'transaction_type': '1', 'idempotency_key': 'form-1'}
+        response = self.client.post(reverse('deposit_money'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "at least 100")
+        self.assertNotIn('Idempotent-Replayed', response)
+
+        responses.clear()
+        replay = self.client.post(reverse('deposit_money'), data)
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.content, response.content)
+
+    def test_deposit_with_key_runs_once(self):
+        data = {'amount': '250', 'transaction_type': '1', 'idempotency_key': 'form-2'}
+        first = self.client.post(reverse('deposit_money'), data)
+        second = self.client.post(reverse('deposit_money'), data)
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(UserBankAccount.objects.get(user=self.user).balance, Decimal('1250'))
+
+    def test_key_reused_for_another_request(self):
+        self.client.post(reverse('deposit_money'), {'amount': '250', 'transaction_type': '1', 'idempotency_key': 'k'})
+        response = self.client.post(reverse('deposit_money'), {'amount': '300', 'transaction_type': '1', 'idempotency_key': 'k'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_expired_key_can_be_used_again(self):
+        data = {'amount': '250', 'transaction_type': '1', 'idempotency_key': 'old'}
+        self.client.post(reverse('deposit_money'), data)
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        responses.clear()
+        response = self.client.post(reverse('deposit_money'), data)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+        self.assertEqual(UserBankAccount.objects.get(user=self.user).balance, Decimal('1500'))
+
+
+def on_day(days_ago):
+    """Run the ledger as if it were noon ``days_ago`` days back."""
+    noon = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=days_ago), datetime.min.time()))
+    return mock.patch('django.utils.timezone.now', return_value=noon + timedelta(hours=12))
+
+
+def snapshot_rows(*accounts):
+    return list(DailyBalanceSnapshot.objects.filter(account__in=accounts).order_by('account_id', 'date').values_list(
+        'account_id', 'date', 'opening_balance', 'closing_balance', 'deposits', 'withdrawals', 'loans',
+        'loan_payments', 'transfers_sent', 'transfers_received', 'transaction_count',
+    ))
+
+
+class BackfillTests(TestCase):
+    def test_backfill_matches_incremental_snapshots(self):
+        alice = make_customer('alice').account
+        bob = make_customer('bob').account
+        with on_day(5):
+            ledger.deposit(alice, Decimal('1000'))
+            ledger.deposit(bob, Decimal('500'))
+            first = ledger.request_loan(alice, Decimal('300'))
+            second = ledger.request_loan(alice, Decimal('200'))
+        with on_day(4):
+            ledger.transfer(alice, bob.account_no, Decimal('200'))
+            ledger.approve_loan(first)
+        with on_day(2):
+            ledger.withdraw(bob, Decimal('100'))
+            ledger.approve_loans(Transaction.objects.filter(pk=second.pk))
+        with on_day(1):
+            ledger.repay_loan(first)
+        ledger.deposit(bob, Decimal('50'))
+
+        incremental = snapshot_rows(alice, bob)
+        call_command('backfill_balance_snapshots', stdout=io.StringIO())
+        self.assertEqual(snapshot_rows(alice, bob), incremental)
+
+        alice.refresh_from_db()
+        self.assertEqual(alice.balance, Decimal('1000'))
+        closing = DailyBalanceSnapshot.objects.filter(account=alice).order_by('date').last().closing_balance
+        self.assertEqual(closing, alice.balance)
+
+
+class ApproveLoansTests(TestCase):
+    def request_loans(self, *usernames):
+        return [ledger.request_loan(make_customer(username).account, Decimal('100')) for username in usernames]
+
+    def test_queries_do_not_grow_with_accounts(self):
+        one = self.request_loans('alice')
+        many = self.request_loans('bob', 'carol', 'dave')
+        for loans in (one, many):
+            with self.assertNumQueries(8):
+                approved = ledger.approve_loans(Transaction.objects.filter(pk__in=[loan.pk for loan in loans]))
+            self.assertEqual(len(approved), len(loans))
+        self.assertEqual(
+            list(DailyBalanceSnapshot.objects.order_by('account_id').values_list('loans', 'transaction_count')),
+            [(Decimal('100'), 1)] * 4,
+        )
+
+
+class AdminLoanTests(TestCase):
+    def setUp(self):
+        self.account = make_customer('alice', 1000).account
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123'))
+
+    def loan_form(self, **changes):
+        data = {'account': self.account.pk, 'amount': '400', 'balance_after_transaction': '0',
+                'transaction_type': '3'}
+        data.update(changes)
+        return data
+
+    def test_pending_loan_added_then_approved(self):
+        response = self.client.post(reverse('admin:transactions_transaction_add'), self.loan_form())
+        self.assertEqual(response.status_code, 302)
+        loan = Transaction.objects.get(account=self.account)
+        self.assertEqual(loan.balance_after_transaction, Decimal('1000'))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.pending_loan_requests, 1)
+
+        response = self.client.post(
+            reverse('admin:transactions_transaction_change', args=[loan.pk]),
+            self.loan_form(loan_approve='on', balance_after_transaction='1000'),
+        )
+        self.assertEqual(response.status_code, 302)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.pending_loan_requests, 0)
+        self.assertEqual(self.account.active_loans, 1)
+        self.assertEqual(self.account.balance, Decimal('1400'))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = make_customer('alice')
+        self.client.force_login(self.user)
+        ledger.deposit(self.user.account, Decimal('1000'))
+
+    def test_unchanged_statement_is_not_modified(self):
+        first = self.client.get(reverse('transaction_report'))
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('Last-Modified', first)
+        again = self.client.get(reverse('transaction_report'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_loan_approval_changes_the_statement(self):
+        loan = ledger.request_loan(self.user.account, Decimal('300'))
+        first = self.client.get(reverse('loan_list'))
+        ledger.approve_loan(loan)
+        again = self.client.get(reverse('loan_list'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertNotEqual(again['ETag'], first['ETag'])
+        # the loan row is no newer than before, so a date cannot tell
+        since = self.client.get(reverse('loan_list'), HTTP_IF_MODIFIED_SINCE='Sun, 01 Jan 2090 00:00:00 GMT')
+        self.assertEqual(since.status_code, 200)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.alice = make_customer('alice', 1000).account
+        self.bob = make_customer('bob', 500).account
+
+    def assertBalances(self, alice, bob):
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual((self.alice.balance, self.bob.balance), (Decimal(alice), Decimal(bob)))
+
+    def test_deposit(self):
+        record = ledger.deposit(self.alice, Decimal('250'))
+        self.assertEqual(record.balance_after_transaction, Decimal('1250'))
+        self.assertEqual(self.alice.balance, Decimal('1250'))
+        self.assertBalances(1250, 500)
+        snapshot = DailyBalanceSnapshot.objects.get(account=self.alice)
+        self.assertEqual((snapshot.opening_balance, snapshot.closing_balance, snapshot.deposits),
+                         (Decimal('1000'), Decimal('1250'), Decimal('250')))
+
+    def test_withdraw(self):
+        ledger.withdraw(self.alice, Decimal('400'))
+        self.assertBalances(600, 500)
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.withdraw(self.alice, Decimal('601'))
+        self.assertBalances(600, 500)
+
+    def test_withdraw_when_bankrupt(self):
+        UserBankAccount.objects.filter(pk=self.alice.pk).update(is_bankrupt=True)
+        with self.assertRaises(ledger.AccountBankrupt):
+            ledger.withdraw(self.alice, Decimal('1'))
+
+    def test_transfer(self):
+        recipient, sent, received = ledger.transfer(self.alice, self.bob.account_no, Decimal('300'))
+        self.assertEqual(recipient.pk, self.bob.pk)
+        self.assertEqual((sent.balance_after_transaction, received.balance_after_transaction),
+                         (Decimal('700'), Decimal('800')))
+        self.assertBalances(700, 800)
+
+    def test_transfer_refused(self):
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.transfer(self.alice, self.bob.account_no, Decimal('1000.01'))
+        with self.assertRaises(ledger.LedgerError):
+            ledger.transfer(self.alice, self.alice.account_no, Decimal('1'))
+        with self.assertRaises(UserBankAccount.DoesNotExist):
+            ledger.transfer(self.alice, 42, Decimal('1'))
+        self.assertBalances(1000, 500)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_transfer_batch(self):
+        carol = make_customer('carol').account
+        lines = [TransferLine(1, self.bob.account_no, Decimal('100')),
+                 TransferLine(2, carol.account_no, Decimal('50')),
+                 TransferLine(3, self.bob.account_no, Decimal('25'))]
+        recipients, sent, received = ledger.transfer_batch(self.alice, lines)
+        self.assertEqual(set(recipients), {self.bob.account_no, carol.account_no})
+        self.assertEqual([record.balance_after_transaction for record in sent],
+                         [Decimal('900'), Decimal('850'), Decimal('825')])
+        self.assertEqual([record.balance_after_transaction for record in received],
+                         [Decimal('600'), Decimal('50'), Decimal('625')])
+        self.assertBalances(825, 625)
+        self.assertEqual(DailyBalanceSnapshot.objects.get(account=self.bob).transaction_count, 2)
+
+    def test_transfer_batch_is_all_or_nothing(self):
+        lines = [TransferLine(1, self.bob.account_no, Decimal('100')),
+                 TransferLine(2, 42, Decimal('50')),
+                 TransferLine(3, self.alice.account_no, Decimal('1'))]
+        with self.assertRaises(ledger.BatchTransferError) as raised:
+            ledger.transfer_batch(self.alice, lines)
+        self.assertEqual([line for line, _ in raised.exception.errors], [2, 3])
+        self.assertBalances(1000, 500)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_loan_lifecycle(self):
+        loan = ledger.request_loan(self.alice, Decimal('300'))
+        self.alice.refresh_from_db()
+        self.assertEqual((self.alice.balance, self.alice.pending_loan_requests), (Decimal('1000'), 1))
+
+        [approved] = ledger.approve_loans(Transaction.objects.filter(pk=loan.pk))
+        self.assertTrue(approved.loan_approve)
+        self.assertIsNotNone(approved.approved_at)
+        self.alice.refresh_from_db()
+        self.assertEqual(
+            (self.alice.balance, self.alice.active_loans, self.alice.pending_loan_requests,
+             self.alice.outstanding_loan_principal),
+            (Decimal('1300'), 1, 0, Decimal('300')),
+        )
+        # already approved: approving it again changes nothing
+        self.assertEqual(ledger.approve_loans(Transaction.objects.filter(pk=loan.pk)), [])
+        with self.assertRaises(ledger.InvalidLoan):
+            ledger.approve_loan(Transaction.objects.get(pk=loan.pk))
+
+        ledger.repay_loan(Transaction.objects.get(pk=loan.pk))
+        loan.refresh_from_db()
+        self.assertEqual(loan.transaction_type, LOAN_PAID)
+        self.assertIsNotNone(loan.repaid_at)
+        self.alice.refresh_from_db()
+        self.assertEqual(
+            (self.alice.balance, self.alice.active_loans, self.alice.outstanding_loan_principal),
+            (Decimal('1000'), 0, Decimal('0')),
+        )
+        with self.assertRaises(ledger.InvalidLoan):
+            ledger.repay_loan(loan)
+
+    def test_repay_needs_the_balance(self):
+        loan = ledger.approve_loan(ledger.request_loan(self.bob, Decimal('300')))
+        ledger.withdraw(self.bob, Decimal('600'))
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.repay_loan(loan)
+
+    @override_settings(MAX_ACTIVE_LOANS=1)
+    def test_loan_limit(self):
+        ledger.approve_loan(ledger.request_loan(self.alice, Decimal('100')))
+        with self.assertRaises(ledger.LoanLimitExceeded):
+            ledger.request_loan(self.alice, Decimal('100'))
+
+
+class ConcurrentTransferTests(TransactionTestCase):
+    workers = 4
+    transfers = 25
+
+    def test_opposite_transfers_lose_nothing(self):
+        accounts = [make_customer(f"user{n}", 1000).account for n in range(3)]
+        barrier = threading.Barrier(self.workers)
+        errors = []
+
+        def worker(n):
+            try:
+                barrier.wait()
+                for i in range(self.transfers):
+                    # every pair in both directions, the pattern that deadlocks without ordered locks
+                    sender, recipient = accounts[(n + i) % 3], accounts[(n + i + 1 + n % 2) % 3]
+                    try:
+                        ledger.transfer(sender, recipient.account_no, Decimal(n + 1))
+                    except ledger.InsufficientFunds:
+                        pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+        self.assertFalse(any(thread.is_alive() for thread in threads), "transfers deadlocked")
+        self.assertEqual(errors, [])
+
+        balances = dict(UserBankAccount.objects.values_list('pk', 'balance'))
+        self.assertEqual(sum(balances.values()), Decimal('3000'))
+        self.assertEqual(Transaction.objects.filter(transaction_type=TRANSFER_SENT).count(),
+                         self.workers * self.transfers)
+        # each account's rows, replayed in order, end at its balance
+        for account in accounts:
+            running = Decimal('1000')
+            for transaction_type, amount, balance_after in Transaction.objects.filter(account=account).order_by(
+                'id'
+            ).values_list('transaction_type', 'amount', 'balance_after_transaction'):
+                running += BALANCE_SIGN[transaction_type] * amount
+                self.assertEqual(running, balance_after)
+            self.assertEqual(running, balances[account.pk])
+
+
+def history(account, days_ago, count):
+    """``count`` deposits of 1, 2, 3... on each of the ``days_ago`` days, all at the same moment."""
+    for day in days_ago:
+        with on_day(day):
+            for n in range(count):
+                ledger.deposit(account, Decimal(n + 1))
+    return list(Transaction.objects.filter(account=account).order_by('timestamp', 'id').values_list('id', flat=True))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = make_customer('alice')
+        self.account = self.user.account
+        # same timestamps within a day, so the id breaks the ties
+        self.ids = history(self.account, [3, 2, 1], 4)
+
+    def walk(self, page_size):
+        queryset = Transaction.objects.filter(account=self.account)
+        pages = [keyset_paginate(queryset, page_size)]
+        while pages[-1].has_next:
+            pages.append(keyset_paginate(queryset, page_size, after=decode_cursor(pages[-1].next_cursor)))
+        return pages
+
+    def test_forward(self):
+        pages = self.walk(5)
+        self.assertEqual([len(page.object_list) for page in pages], [5, 5, 2])
+        self.assertEqual([row.pk for page in pages for row in page.object_list], self.ids)
+        self.assertFalse(pages[0].has_previous)
+
+    def test_backward(self):
+        pages = self.walk(5)
+        queryset = Transaction.objects.filter(account=self.account)
+        back = keyset_paginate(queryset, 5, before=decode_cursor(pages[-1].previous_cursor))
+        self.assertEqual([row.pk for row in back.object_list], [row.pk for row in pages[1].object_list])
+        first = keyset_paginate(queryset, 5, before=decode_cursor(back.previous_cursor))
+        self.assertEqual([row.pk for row in first.object_list], self.ids[:5])
+        self.assertFalse(first.has_previous)
+
+    def test_garbled_cursor(self):
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertIsNone(decode_cursor(''))
+
+    def test_report_pages(self):
+        self.client.force_login(self.user)
+        seen = []
+        url = reverse('transaction_report') + '?page_size=5'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row.pk for row in response.context['report_list']]
+            url = response.context['next_url'] and reverse('transaction_report') + response.context['next_url']
+        self.assertEqual(seen, self.ids)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = make_customer('alice')
+        self.ids = history(self.user.account, [3, 2], 3)
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('transaction_export'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn(f'statement-{self.user.account.account_no}.csv', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows[0], EXPORT_FIELDS)
+        self.assertEqual([int(row[0]) for row in rows[1:]], self.ids)
+        self.assertEqual(rows[1][2:5], ['Deposit', '1.00', '1.00'])
+
+    def test_jsonl_for_a_date_range(self):
+        day = str(timezone.localdate() - timedelta(days=2))
+        response, body = self.export(format='jsonl', start_date=day, end_date=day)
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([record['id'] for record in records], self.ids[3:])
+        self.assertEqual(records[-1]['balance_after_transaction'], '12.00')
+
+    def test_gzip(self):
+        response, body = self.export(compress='gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(body), self.export()[1])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get(reverse('transaction_export'), {'format': 'xml'}).status_code, 400)
+
+
+class BatchTransferTests(TestCase):
+    def setUp(self):
+        self.user = make_customer('alice', 1000)
+        self.bob = make_customer('bob').account
+        self.carol = make_customer('carol').account
+        self.client.force_login(self.user)
+
+    def balances(self):
+        return list(UserBankAccount.objects.order_by('pk').values_list('balance', flat=True))
+
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile('pay.csv', f"account_no,amount\n{self.bob.account_no},100\n"
+                                               f"{self.carol.account_no},50.50\n".encode())
+        response = self.client.post(reverse('batch_transfer'), {'file': upload})
+        self.assertRedirects(response, reverse('transaction_report'), fetch_redirect_response=False)
+        self.assertEqual(self.balances(), [Decimal('849.50'), Decimal('100'), Decimal('50.50')])
+
+    def test_pasted_lines_with_errors_apply_nothing(self):
+        response = self.client.post(reverse('batch_transfer'), {
+            'lines': f"{self.bob.account_no},100\n{self.carol.account_no},-5\n42,1\n",
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([line for line, _ in response.context['errors']], [2, 3])
+        self.assertEqual(self.balances(), [Decimal('1000'), Decimal('0'), Decimal('0')])
+
+    def test_json(self):
+        body = {'transfers': [{'account_no': self.bob.account_no, 'amount': '10'},
+                              {'account_no': self.bob.account_no, 'amount': '15'}]}
+        response = self.client.post(reverse('batch_transfer'), json.dumps(body), content_type='application/json')
+        self.assertEqual(response.json(), {'transferred': 2, 'total': '25', 'balance': '975.00'})
+        self.assertEqual(Transaction.objects.filter(account=self.bob).count(), 2)
+
+    def test_json_over_balance(self):
+        body = [{'account_no': self.bob.account_no, 'amount': '600'},
+                {'account_no': self.carol.account_no, 'amount': '600'}]
+        response = self.client.post(reverse('batch_transfer'), json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['line'], None)
+        self.assertEqual(self.balances(), [Decimal('1000'), Decimal('0'), Decimal('0')])
+
+    @override_settings(BATCH_TRANSFER_MAX_LINES=1)
+    def test_too_many_lines(self):
+        response = self.client.post(reverse('batch_transfer'), {
+            'lines': f"{self.bob.account_no},1\n{self.carol.account_no},1\n",
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.balances(), [Decimal('1000'), Decimal('0'), Decimal('0')])
+
+
+class JsonApiTests(TestCase):
+    def setUp(self):
+        responses.clear()
+        self.user = make_customer('alice', 1000)
+        self.client.force_login(self.user)
+
+    def post(self, name, body, **headers):
+        return self.client.post(reverse(name), json.dumps(body), content_type='application/json', headers=headers)
+
+    def test_deposit(self):
+        response = self.post('api_deposit', {'amount': '250'})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['balance'], '1250.00')
+        self.assertEqual(data['transaction']['transaction_type'], 'Deposit')
+        self.assertEqual(data['transaction']['balance_after_transaction'], '1250.00')
+
+    def test_invalid_amount(self):
+        response = self.post('api_withdraw', {'amount': '5000'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount', response.json()['errors'])
+        self.assertEqual(UserBankAccount.objects.get(user=self.user).balance, Decimal('1000'))
+
+    def test_body_must_be_an_object(self):
+        self.assertEqual(self.post('api_deposit', ['250']).status_code, 400)
+        response = self.client.post(reverse('api_deposit'), 'amount=250', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertEqual(self.post('api_deposit', {'amount': '250'}).status_code, 401)
+
+    def test_replayed_with_idempotency_key(self):
+        first = self.post('api_deposit', {'amount': '250'}, **{'Idempotency-Key': 'api-1'})
+        second = self.post('api_deposit', {'amount': '250'}, **{'Idempotency-Key': 'api-1'})
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(UserBankAccount.objects.get(user=self.user).balance, Decimal('1250'))
+
+    def test_transfer(self):
+        bob = make_customer('bob').account
+        response = self.post('api_transfer', {'recipient_account_number': bob.account_no, 'amount': '10.50'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['balance'], '989.50')
+        self.assertEqual(UserBankAccount.objects.get(pk=bob.pk).balance, Decimal('10.50'))
+
+    def test_transfer_to_unknown_account(self):
+        response = self.post('api_transfer', {'recipient_account_number': 42, 'amount': '10'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recipient_account_number', response.json()['errors'])
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = make_customer('alice')
+        self.account = self.user.account
+        with on_day(100):
+            ledger.deposit(self.account, Decimal('1000'))
+            self.loan = ledger.request_loan(self.account, Decimal('300'))
+        history(self.account, [100], 3)
+        with on_day(99):
+            ledger.approve_loan(self.loan)
+        history(self.account, [70, 40, 2], 3)
+        with on_day(1):
+            ledger.repay_loan(self.loan)
+        self.client.force_login(self.user)
+
+    def report(self):
+        seen = []
+        url = reverse('transaction_report') + '?page_size=4'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [(row.pk, row.transaction_type, row.amount, row.balance_after_transaction)
+                     for row in response.context['report_list']]
+            url = response.context['next_url'] and reverse('transaction_report') + response.context['next_url']
+        return seen
+
+    def export(self):
+        return b''.join(self.client.get(reverse('transaction_export'), {'format': 'jsonl'}).streaming_content)
+
+    def archive(self):
+        before = timezone.localdate() - timedelta(days=30)
+        call_command('archive_transactions', before=str(before), stdout=io.StringIO())
+        self.account.refresh_from_db()
+        return before.replace(day=1)
+
+    def test_reads_are_unchanged(self):
+        report, export, snapshots = self.report(), self.export(), snapshot_rows(self.account)
+        cutoff = self.archive()
+
+        self.assertEqual(self.account.archived_until, cutoff)
+        self.assertTrue(self.account.archived_segments.exists())
+        self.assertEqual(self.report(), report)
+        self.assertEqual(self.export(), export)
+        self.assertEqual(snapshot_rows(self.account), snapshots)
+
+    def test_loans_stay_in_the_hot_table(self):
+        cutoff = self.archive()
+        hot = Transaction.objects.filter(account=self.account)
+        self.assertFalse(hot.filter(timestamp__date__lt=cutoff).exclude(pk=self.loan.pk).exists())
+        self.assertTrue(hot.filter(pk=self.loan.pk).exists())
+        self.assertEqual(hot.filter(transaction_type=LOAN_PAID).count(), 1)
+
+    def test_covers(self):
+        self.assertFalse(archive.covers(self.account))
+        cutoff = self.archive()
+        self.assertTrue(archive.covers(self.account))
+        before_cutoff = timezone.make_aware(datetime.combine(cutoff - timedelta(days=1), datetime.min.time()))
+        self.assertTrue(archive.covers(self.account, before_cutoff))
+        self.assertFalse(archive.covers(self.account, timezone.now()))
+
+    def test_backfill_after_archiving(self):
+        snapshots = snapshot_rows(self.account)
+        self.archive()
+        call_command('backfill_balance_snapshots', stdout=io.StringIO())
+        self.assertEqual(snapshot_rows(self.account), snapshots)
+
+
+@skipUnless(generate_dataset.dataset, "generate_dataset needs NumPy")
+class GenerateDatasetTests(TestCase):
+    def setUp(self):
+        call_command('generate_dataset', accounts=30, per_account=20, days=90, seed=7, batch_size=100,
+                     stdout=io.StringIO())
+        self.accounts = UserBankAccount.objects.filter(user__username__startswith='load')
+
+    def test_balances_are_the_sum_of_the_transactions(self):
+        self.assertEqual(self.accounts.count(), 30)
+        for account in self.accounts:
+            balance = Decimal(0)
+            # a repaid loan is one LOAN_PAID row whose credit and debit cancel out; a pending one credits nothing
+            for transaction_type, amount in Transaction.objects.filter(account=account).exclude(
+                Q(transaction_type=LOAN_PAID) | Q(transaction_type=LOAN, loan_approve=False),
+            ).values_list('transaction_type', 'amount'):
+                balance += BALANCE_SIGN[transaction_type] * amount
+            self.assertEqual(account.balance, balance)
+
+    def test_loan_counters_need_no_reconciling(self):
+        out = io.StringIO()
+        call_command('reconcile_loan_counters', dry_run=True, stdout=out)
+        self.assertIn("would fix 0", out.getvalue())
+
+    def test_snapshots_match_the_backfill(self):
+        generated = snapshot_rows(*self.accounts)
+        self.assertTrue(generated)
+        call_command('backfill_balance_snapshots', stdout=io.StringIO())
+        self.assertEqual(snapshot_rows(*self.accounts), generated)
+
+
+class ReconcileLoanCountersTests(TestCase):
+    def setUp(self):
+        self.account = make_customer('alice', 1000).account
+        ledger.approve_loan(ledger.request_loan(self.account, Decimal('300')))
+        ledger.request_loan(self.account, Decimal('200'))
+        self.bob = make_customer('bob').account
+
+    def counters(self):
+        return UserBankAccount.objects.filter(pk=self.account.pk).values(
+            'active_loans', 'pending_loan_requests', 'outstanding_loan_principal',
+        ).get()
+
+    def reconcile(self, **options):
+        out = io.StringIO()
+        call_command('reconcile_loan_counters', stdout=out, **options)
+        return out.getvalue()
+
+    def test_drift_is_reported_and_repaired(self):
+        correct = self.counters()
+        self.assertEqual(correct, {'active_loans': 1, 'pending_loan_requests': 1,
+                                   'outstanding_loan_principal': Decimal('300')})
+        UserBankAccount.objects.filter(pk=self.account.pk).update(
+            active_loans=4, pending_loan_requests=0, outstanding_loan_principal=Decimal('9'),
+        )
+
+        out = self.reconcile(dry_run=True)
+        self.assertIn(f"account {self.account.account_no}:", out)
+        self.assertIn("would fix 1", out)
+        self.assertEqual(self.counters()['active_loans'], 4)
+
+        out = self.reconcile()
+        self.assertIn(f"account {self.account.account_no}:", out)
+        self.assertNotIn(f"account {self.bob.account_no}:", out)
+        self.assertIn("checked 2 accounts, fixed 1", out)
+        self.assertEqual(self.counters(), correct)
+        self.assertIn("fixed 0", self.reconcile())
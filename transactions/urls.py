@@ -1,14 +1,21 @@
 from django.urls import path
-from .views import DepositMoneyView, WithdrawMoneyView, TransactionReportView,LoanRequestMoneyView,PayLoanView,LoanListView,TransferMoneyView
+from .api import DepositApiView,WithdrawApiView,LoanRequestApiView,TransferApiView
+from .views import DepositMoneyView, WithdrawMoneyView, TransactionReportView,LoanRequestMoneyView,PayLoanView,LoanListView,TransferMoneyView,TransactionExportView,BatchTransferView
 
 
 # app_name = 'transactions'
 urlpatterns = [
     path("deposit/", DepositMoneyView.as_view(), name="deposit_money"),
     path("report/", TransactionReportView.as_view(), name="transaction_report"),
+    path("export/", TransactionExportView.as_view(), name="transaction_export"),
     path("withdraw/", WithdrawMoneyView.as_view(), name="withdraw_money"),
     path("loan_request/", LoanRequestMoneyView.as_view(), name="loan_request"),
     path("loans/", LoanListView.as_view(), name="loan_list"),
     path("loans/<int:loan_id>/", PayLoanView.as_view(), name="pay"),
     path("transfer/", TransferMoneyView.as_view(), name="transfer_money"),
+    path("transfer/batch/", BatchTransferView.as_view(), name="batch_transfer"),
+    path("api/deposit/", DepositApiView.as_view(), name="api_deposit"),
+    path("api/withdraw/", WithdrawApiView.as_view(), name="api_withdraw"),
+    path("api/loan_request/", LoanRequestApiView.as_view(), name="api_loan_request"),
+    path("api/transfer/", TransferApiView.as_view(), name="api_transfer"),
 ]
\ No newline at end of file
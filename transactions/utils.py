@@ -0,0 +1,41 @@
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def parse_dates(params):
+    """
+    The ``start_date``/``end_date`` query parameters (YYYY-MM-DD, both
+    inclusive) as a pair of dates, or ``None`` if either is missing or bad.
+    """
+    start_date_str = params.get('start_date')
+    end_date_str = params.get('end_date')
+    if not (start_date_str and end_date_str):
+        return None
+    try:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    return start_date, end_date
+
+
+def parse_date_range(params):
+    """
+    Turn the ``start_date``/``end_date`` query parameters into an aware
+    ``[start, end)`` datetime pair, or ``None``.
+
+    Filtering on ``timestamp >= start AND timestamp < end`` keeps the
+    predicate sargable, unlike ``timestamp__date`` which wraps the column in
+    a function and rules out the (account, timestamp, id) index.
+    """
+    dates = parse_dates(params)
+    if dates is None:
+        return None
+    start_date, end_date = dates
+
+    tz = timezone.get_current_timezone()
+    return (
+        datetime.combine(start_date, time.min, tzinfo=tz),
+        datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=tz),
+    )
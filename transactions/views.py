@@ -1,60 +1,90 @@
+import json
+
 from django.shortcuts import render,redirect,get_object_or_404
-from django.views.generic import CreateView,ListView
+from django.views.generic import CreateView
+from django.utils.decorators import method_decorator
 from django.contrib.auth.mixins import LoginRequiredMixin
 from .models import Transaction
-from .forms import DepositForm,LoanRequestForm,WithdrawForm,TransferMoneyForm
-from .constants import DEPOSIT,WITHDRAWAL,LOAN,LOAN_PAID,TRANSFER_SENT,TRANSFER_RECEIVED
+from .forms import DepositForm,LoanRequestForm,WithdrawForm,TransferMoneyForm,BatchTransferForm
+from .constants import DEPOSIT,WITHDRAWAL,LOAN
 from django.contrib import messages
-from django.http import HttpResponse
-from datetime import datetime
-from django.db.models import Sum
+from django.http import HttpResponse,HttpResponseRedirect,HttpResponseBadRequest,JsonResponse,StreamingHttpResponse
 from django.views import View
 from django.urls import reverse_lazy
 from accounts.models import UserBankAccount
-
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from . import archive,ledger
+from .batch import parse_csv,parse_json
+from .pagination import akeyset_paginate,decode_cursor
+from .utils import parse_date_range,parse_dates
+from .snapshots import arange_summary
+from .export import EXPORT_FIELDS,FORMATS,encode,gzip_stream
+from .conditional import anot_modified,not_modified
+from .idempotency import idempotent
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from django.db import router,transaction
+from core.mail import build_email,queue_email,queue_emails
+from core.mixins import AsyncLoginRequiredMixin,arender
 # Create your views here.
 
 
 def send_transaction_email(user, amount, subject, template):
-    message = render_to_string(template, {
+    queue_email(subject, user.email, template, {
         'user': user,
         'amount': amount,
 
     })
-    send_email = EmailMultiAlternatives(subject,'',to=[user.email])
-
-    send_email.attach_alternative(message, "text/html")
-    send_email.send()
 
 
 def send_moneytransfer_email(user,recipient,recipient_account_number, amount, subject, template1,template2):
-    message1 = render_to_string(template1, {
+    queue_emails([
+        build_email(subject, user.email, template1, {
+            'user': user,
+            'recipient': recipient,
+            'amount': amount,
+            'recipient_account_number': recipient_account_number,
+        }),
+        build_email(subject, recipient.email, template2, {
+            'user': recipient,
+            'sender': user,
+            'amount': amount,
+            'sender_account_number': user.account.account_no,
+        }),
+    ])
+
+
+
+def send_batch_transfer_emails(user, lines, recipients, subject):
+    # one mail to the sender for the whole batch and one per recipient, however
+    # many lines paid them, all queued with a single insert
+    total = sum(line.amount for line in lines)
+    received = {}
+    for line in lines:
+        received[line.account_no] = received.get(line.account_no, 0) + line.amount
+    users = User.objects.in_bulk([account.user_id for account in recipients.values()])
+
+    emails = [build_email(subject, user.email, 'transactions/transfer_batch_email_sender.html', {
         'user': user,
-        'recipient': recipient,
-        'amount': amount,
-        'recipient_account_number': recipient_account_number,
-    })
-    message2 = render_to_string(template2, {
-        'user': recipient,
-        'sender': user,
-        'amount': amount,
-        'sender_account_number': user.account.account_no,
-    })
-    send_email = EmailMultiAlternatives(subject,'',to=[user.email])
-
-    send_email.attach_alternative(message1, "text/html")
-    send_email.send()
-
-    send_email2 = EmailMultiAlternatives(subject,'',to=[recipient.email])
-    send_email2.attach_alternative(message2, "text/html")
-    send_email2.send()
-
-
-
+        'lines': lines,
+        'total': total,
+    })]
+    for account_no, amount in received.items():
+        recipient = users[recipients[account_no].user_id]
+        emails.append(build_email(subject, recipient.email, 'transactions/transfer_email_reciver.html', {
+            'user': recipient,
+            'sender': user,
+            'amount': amount,
+            'sender_account_number': user.account.account_no,
+        }))
+    queue_emails(emails)
+
+
+@method_decorator(idempotent, name='post')
 class TransactionCreateMixin(LoginRequiredMixin,CreateView):
     template_name= 'transactions/transaction_form.html'
+    # the form's idempotency key costs about five queries of these
+    query_budget = 20
     model = Transaction
     title = ''
     success_url = reverse_lazy('transaction_report')
@@ -86,16 +116,14 @@ class DepositMoneyView(TransactionCreateMixin):
     def form_valid(self, form):
         amount  = form.cleaned_data.get('amount') 
         account = self.request.user.account
-        account.balance += amount
-        account.save(
-            update_fields = ['balance']
-        )
-        messages.success(self.request, f"{amount}$ was deposited to your account Successfully ")
+        with transaction.atomic():
+            self.object = ledger.deposit(account, amount)
 
-        # Send email notification
-        send_transaction_email(self.request.user,amount,"Deposit Message",'transactions/deposit_email.html' )
+            # Send email notification
+            send_transaction_email(self.request.user,amount,"Deposit Message",'transactions/deposit_email.html' )
 
-        return super().form_valid(form)
+        messages.success(self.request, f"{amount}$ was deposited to your account Successfully ")
+        return HttpResponseRedirect(self.get_success_url())
 
 class WithdrawMoneyView(TransactionCreateMixin):
     form_class = WithdrawForm
@@ -109,18 +137,19 @@ class WithdrawMoneyView(TransactionCreateMixin):
         amount  = form.cleaned_data.get('amount') 
         account = self.request.user.account
 
-        if account.is_bankrupt:
-            form.add_error(None, "You are bankrupt and cannot withdraw money.")
+        try:
+            with transaction.atomic():
+                self.object = ledger.withdraw(account, amount)
+                send_transaction_email(self.request.user,amount,"Withdrawal Message",'transactions/withdraw_email.html' )
+        except ledger.AccountBankrupt as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
+        except ledger.InsufficientFunds as e:
+            form.add_error('amount', str(e))
             return self.form_invalid(form)
-        
-        account.balance -= amount
-        account.save(
-            update_fields = ['balance']
-        )
-        messages.success(self.request, f"{amount}$ was withdrawn from your account Successfully ")
 
-        send_transaction_email(self.request.user,amount,"Withdrawal Message",'transactions/withdraw_email.html' )
-        return super().form_valid(form)
+        messages.success(self.request, f"{amount}$ was withdrawn from your account Successfully ")
+        return HttpResponseRedirect(self.get_success_url())
         
 
 class LoanRequestMoneyView(TransactionCreateMixin):
@@ -134,91 +163,161 @@ class LoanRequestMoneyView(TransactionCreateMixin):
     
     def form_valid(self, form):
         amount  = form.cleaned_data.get('amount') 
-        current_loan_count = Transaction.objects.filter(account = self.request.user.account, transaction_type = LOAN, loan_approve = True).count()
 
-        if current_loan_count >= 3:
-            return HttpResponse("You have crossed the limit of 3 loans")
+        try:
+            with transaction.atomic():
+                # the loan limit is checked against the account's active_loans counter
+                self.object = ledger.request_loan(self.request.user.account, amount)
+                send_transaction_email(self.request.user,amount,"Loan Request Message",'transactions/loan_request_email.html' )
+        except ledger.LoanLimitExceeded as e:
+            return HttpResponse(str(e))
 
         messages.success(self.request, f"{amount}$ was requested as a loan Successfully ")
-
-        send_transaction_email(self.request.user,amount,"Loan Request Message",'transactions/loan_request_email.html' )
-
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
         
-class TransactionReportView(LoginRequiredMixin,ListView):
+class TransactionReportView(AsyncLoginRequiredMixin,View):
     template_name = 'transactions/transaction_report.html'
-    model = Transaction
-    balance = 0
-    context_object_name = 'report_list'
+    query_budget = 8
+    read_replica = True
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET.get('page_size', settings.TRANSACTION_REPORT_PAGE_SIZE))
+        except ValueError:
+            page_size = settings.TRANSACTION_REPORT_PAGE_SIZE
+        return max(1, min(page_size, settings.TRANSACTION_REPORT_MAX_PAGE_SIZE))
+
+    def page_url(self, **cursor):
+        params = self.request.GET.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        params.update(cursor)
+        return '?' + params.urlencode()
+
+    async def get(self, request):
+        account = await self.aget_account()
+        unchanged, validators = await anot_modified(request, account)
+        if unchanged:
+            return unchanged
+        queryset = Transaction.objects.filter(account=account)
+
+        date_range = parse_date_range(request.GET)
+        summary = None
+        start = end = None
+
+        if date_range:
+            start, end = date_range
+
+            queryset = queryset.filter(timestamp__gte=start, timestamp__lt=end)
+
+            # opening/closing balance and totals come from the daily snapshots
+            start_date, end_date = parse_dates(request.GET)
+            summary = await arange_summary(account, start_date, end_date)
+            balance = summary['closing_balance']
 
-    def get_queryset(self):
-        queryset = super().get_queryset().filter(account=self.request.user.account)
+        else:
+            balance = account.balance
+
+        page_size = self.get_page_size()
+        after = decode_cursor(request.GET.get('after'))
+        before = decode_cursor(request.GET.get('before'))
+        archived = None
+        if archive.covers(account, start):
+            archived = await archive.aarchived_page(account, page_size + 1, start, end, after=after, before=before)
+        page = await akeyset_paginate(queryset, page_size, after=after, before=before, archived=archived)
+        response = await arender(request, self.template_name, {
+            'view': self,
+            'report_list': page.object_list,
+            'account': account,
+            'balance': balance,
+            'summary': summary,
+            'page': page,
+            'next_url': self.page_url(after=page.next_cursor) if page.has_next else None,
+            'previous_url': self.page_url(before=page.previous_cursor) if page.has_previous else None,
+        })
+        return validators.apply(response)
 
-        start_date_str = self.request.GET.get('start_date')
-        end_date_str = self.request.GET.get('end_date')
 
-        if start_date_str and end_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+class TransactionExportView(LoginRequiredMixin,View):
+    query_budget = 5
+    read_replica = True
+
+    def get(self, request):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in FORMATS:
+            return HttpResponseBadRequest("Unsupported export format.")
+        serializer, content_type = FORMATS[export_format]
+
+        account = request.user.account
+        unchanged, validators = not_modified(request, account)
+        if unchanged:
+            return unchanged
+        # the rows are read while streaming, after the routing middleware has
+        # returned, so pick the database now
+        using = router.db_for_read(Transaction)
+        queryset = Transaction.objects.db_manager(using).filter(account=account)
+        start = end = None
+        date_range = parse_date_range(request.GET)
+        if date_range:
+            start, end = date_range
+            queryset = queryset.filter(timestamp__gte=start, timestamp__lt=end)
+        rows = queryset.order_by('timestamp', 'id').values_list(*EXPORT_FIELDS).iterator(
+            chunk_size=settings.TRANSACTION_EXPORT_CHUNK_SIZE
+        )
+        if archive.covers(account, start):
+            rows = archive.merge(archive.archived_rows(account, start, end, using=using), rows)
+
+        stream = encode(serializer(rows))
+        filename = f"statement-{account.account_no}.{export_format}"
+        if request.GET.get('compress') == 'gzip':
+            stream = gzip_stream(stream)
+            content_type = 'application/gzip'
+            filename += '.gz'
+
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return validators.apply(response)
 
-            queryset = queryset.filter(timestamp__date__gte=start_date, timestamp__date__lte=end_date)
 
-            self.balance = Transaction.objects.filter(timestamp__date__gte=start_date, timestamp__date__lte=end_date).aggregate(Sum('amount'))['amount__sum']
-        
-        else:
-            self.balance = self.request.user.account.balance
-        
-        return queryset.distinct()
-    
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context.update({
-            'account': self.request.user.account,
-            'balance': self.balance,
-        })
-        return context
-    
-     
 class PayLoanView(LoginRequiredMixin, View):
+    query_budget = 12
+
     def get(self, request, loan_id):
-        loan = get_object_or_404(Transaction, id=loan_id)
-        print(loan)
+        loan = get_object_or_404(Transaction.objects.select_related('account'), id=loan_id, account=request.user.account)
         if loan.loan_approve:
-            user_account = loan.account
-                # Reduce the loan amount from the user's balance
-                # 5000, 500 + 5000 = 5500
-                # balance = 3000, loan = 5000
-            if loan.amount < user_account.balance:
-                user_account.balance -= loan.amount
-                loan.balance_after_transaction = user_account.balance
-                user_account.save()
-                loan.loan_approve = True
-                loan.transaction_type = LOAN_PAID
-                loan.save()
-                return redirect('loan_list')
-            else:
-                messages.error(
-            self.request,
-            f'Loan amount is greater than available balance'
-        )
+            # Reduce the loan amount from the user's balance
+            # 5000, 500 + 5000 = 5500
+            # balance = 3000, loan = 5000
+            try:
+                ledger.repay_loan(loan)
+            except ledger.InsufficientFunds as e:
+                messages.error(self.request, str(e))
+            except ledger.InvalidLoan:
+                pass
 
         return redirect('loan_list')
 
 
-class LoanListView(LoginRequiredMixin,ListView):
-    model = Transaction
+class LoanListView(AsyncLoginRequiredMixin,View):
     template_name = 'transactions/loan_request.html'
-    context_object_name = 'loans' # loan list ta ei loans context er moddhe thakbe
-    
-    def get_queryset(self):
-        user_account = self.request.user.account
-        queryset = Transaction.objects.filter(account=user_account,transaction_type=LOAN)
-        print(queryset)
-        return queryset
+    query_budget = 6
+    read_replica = True
+
+    async def get(self, request):
+        account = await self.aget_account()
+        unchanged, validators = await anot_modified(request, account)
+        if unchanged:
+            return unchanged
+        # loan list ta ei loans context er moddhe thakbe
+        loans = [loan async for loan in Transaction.objects.filter(account=account,transaction_type=LOAN).aiterator()]
+        response = await arender(request, self.template_name, {'loans': loans, 'account': account})
+        return validators.apply(response)
 
 
+@method_decorator(idempotent, name='post')
 class TransferMoneyView(LoginRequiredMixin,View):
     template_name = 'transactions/transfer_money.html'
+    query_budget = 25
     title = 'Transfer Money'
     success_url = reverse_lazy('transaction_report')
 
@@ -234,50 +333,80 @@ class TransferMoneyView(LoginRequiredMixin,View):
                 recipient_account_number = form.cleaned_data['recipient_account_number']
                 amount = form.cleaned_data['amount']
                 
-                # Get recipient account
-                recipient_account = UserBankAccount.objects.get(account_no=recipient_account_number)
                 sender_account = request.user.account
 
-                # Check if sender has sufficient balance (this should also be checked in form validation)
-                if sender_account.balance < amount:
-                    messages.error(request, "Insufficient balance for this transfer.")
-                    return render(request, self.template_name, {'form':form, 'title':self.title})
-
-                # Update balances
-                recipient_account.balance += amount
-                sender_account.balance -= amount
-
-                # Save accounts
-                sender_account.save()
-                recipient_account.save()
-
-                # Create transaction records
-                # For sender (money going out)
-                Transaction.objects.create(
-                    account = sender_account,
-                    amount = amount,
-                    balance_after_transaction = sender_account.balance,
-                    transaction_type = TRANSFER_SENT
-                )
-
-                # For recipient (money coming in)
-                Transaction.objects.create(
-                    account = recipient_account,
-                    amount = amount,
-                    balance_after_transaction = recipient_account.balance,
-                    transaction_type = TRANSFER_RECEIVED
-                )
+                with transaction.atomic():
+                    # Locks both accounts, moves the money and writes the
+                    # TRANSFER_SENT / TRANSFER_RECEIVED pair
+                    recipient_account, sent, received = ledger.transfer(sender_account, recipient_account_number, amount)
 
-                messages.success(request, f"${amount} was transferred to account {recipient_account_number} successfully.")
+                    send_moneytransfer_email(self.request.user,recipient_account.user,recipient_account_number,amount,"Money Transfer Message",'transactions/transfer_email_sender.html', 'transactions/transfer_email_reciver.html')
 
-                send_moneytransfer_email(self.request.user,recipient_account.user,recipient_account_number,amount,"Money Transfer Message",'transactions/transfer_email_sender.html', 'transactions/transfer_email_reciver.html')
+                messages.success(request, f"${amount} was transferred to account {recipient_account_number} successfully.")
                 return redirect(self.success_url)
                 
             except UserBankAccount.DoesNotExist:
-                form.error(request, "Recipient account not found.")
+                form.add_error('recipient_account_number', "Recipient account not found.")
+                return render(request, self.template_name, {'form':form, 'title':self.title})
+            except ledger.LedgerError as e:
+                messages.error(request, str(e))
                 return render(request, self.template_name, {'form':form, 'title':self.title})
             except Exception as e:
                 messages.error(request, f"Transfer failed: {str(e)}")
                 return render(request, self.template_name, {'form':form, 'title':self.title})
         
-        return render(request, self.template_name, {'form':form, 'title':self.title})
\ No newline at end of file
+        return render(request, self.template_name, {'form':form, 'title':self.title})
+
+
+@method_decorator(idempotent, name='post')
+class BatchTransferView(LoginRequiredMixin,View):
+    """
+    Pay many accounts at once from an uploaded CSV, a pasted list, or a JSON
+    body (``Content-Type: application/json``), which gets a JSON answer.
+    """
+    template_name = 'transactions/transfer_batch.html'
+    query_budget = 24
+    title = 'Batch Transfer'
+    success_url = reverse_lazy('transaction_report')
+
+    def get(self, request):
+        return render(request, self.template_name, {'form': BatchTransferForm(), 'title': self.title})
+
+    def post(self, request):
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                return JsonResponse({'errors': [{'line': None, 'error': "Invalid JSON."}]}, status=400)
+            lines, errors = parse_json(data)
+            errors = self.apply(lines, errors)
+            if errors:
+                return JsonResponse({'errors': [{'line': line, 'error': error} for line, error in errors]}, status=400)
+            return JsonResponse({
+                'transferred': len(lines),
+                'total': str(sum(line.amount for line in lines)),
+                'balance': str(request.user.account.balance),
+            })
+
+        form = BatchTransferForm(request.POST, request.FILES)
+        errors = [(None, error) for error in form.non_field_errors()] if not form.is_valid() else []
+        if not errors:
+            lines, errors = parse_csv(form.cleaned_data['lines'])
+            errors = self.apply(lines, errors)
+        if errors:
+            return render(request, self.template_name, {'form': form, 'title': self.title, 'errors': errors}, status=400)
+
+        messages.success(request, f"${sum(line.amount for line in lines)} was transferred to {len(lines)} recipients successfully.")
+        return redirect(self.success_url)
+
+    def apply(self, lines, errors):
+        """Run the batch; returns every refused line, or an empty list once it is paid."""
+        if not lines:
+            return errors
+        try:
+            with transaction.atomic():
+                recipients, sent, received = ledger.transfer_batch(self.request.user.account, lines, errors)
+                send_batch_transfer_emails(self.request.user, lines, recipients, "Money Transfer Message")
+        except ledger.BatchTransferError as e:
+            return e.errors
+        return []